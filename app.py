@@ -1,35 +1,54 @@
 # app.py
 # -*- coding: utf-8 -*-
-from flask import Flask, render_template, render_template_string, request, redirect, url_for, jsonify, session, send_from_directory, abort
-import os, json, datetime
+from flask import Flask, Response, render_template, render_template_string, request, redirect, url_for, jsonify, session, send_from_directory, abort, stream_with_context
+import os, re, sys, json, time, atexit, hashlib, datetime, threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import click
 from werkzeug.utils import secure_filename
 from config import Config
-from database import db
-from sqlalchemy import text, func
+from database import db, install_sqlite_pragmas, sqlite_settings
+from sqlalchemy import func, tuple_
 
 from models import (
     User, Category, Record, RecordAttachment,
-    ConfigSetting, GeneratedReport, SmartReport, seed_categories_if_needed
+    ConfigSetting, GeneratedReport, SmartReport, seed_categories_if_needed, project_rows
 )
+from json_provider import install_json_provider
 
 from report_generator import generate_category_report
+from migrations import run_migrations, schema_version, LATEST_VERSION
+from search import search as fts_search, rebuild_search_index
+import render_queue
+import preview_jobs
+from category_stats import (
+    register_stats_listeners, rebuild_category_stats, ensure_category_stats,
+    category_counts, category_version, totals_by_category
+)
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.triggers.cron import CronTrigger
+import scheduler_lease
 
 # === Smart / AI ===
 # لو ملف smart_ai.py غير موجود، خلي الاستيراد كما هو وسيشتغل الفرع الاحتياطي
 try:
-    from smart_ai import generate_deep_hms_report
+    from smart_ai import generate_deep_hms_report, stream_deep_hms_report
 except Exception:
     generate_deep_hms_report = None
+    stream_deep_hms_report = None
 
-from smart_reporter import render_pdf, build_paths
+from smart_reporter import build_paths
 
 # ------------------ إعدادات عامة ------------------
 ALLOWED_EXTS = {"jpg", "jpeg", "png", "pdf"}
 
 app = Flask(__name__)
 app.config.from_object(Config)
+install_json_provider(app)   # orjson إن توفر، وإلا json القياسي بنفس صيغة التواريخ
 db.init_app(app)
+with app.app_context():
+    install_sqlite_pragmas(db.engine, app.config.get("SQLITE_PRAGMAS"))
+register_stats_listeners()
 
 # ===== مسارات وتهيئة أساسية بعد إنشاء app =====
 BASE_DIR   = os.path.dirname(__file__)
@@ -60,32 +79,38 @@ def ensure_upload_dirs():
         os.makedirs(os.path.join(p, "smart_reports"), exist_ok=True)
         os.makedirs(os.path.join(p, "manual_reports"), exist_ok=True)
 
-# --- إصلاح مخطط قاعدة البيانات للحالات القديمة (إضافة أعمدة إن لزم) ---
-def _ensure_column(table: str, col: str, col_def: str):
-    try:
-        info = db.session.execute(text(f"PRAGMA table_info({table})")).fetchall()
-        cols = {row[1] for row in info}
-        if col not in cols:
-            db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {col_def}"))
-            db.session.commit()
-            print(f"[Schema] Added column '{col}' to '{table}'.")
-    except Exception as e:
-        print(f"[Schema] Error while ensuring column {table}.{col}: {e}")
-
-def ensure_smart_reports_schema():
-    _ensure_column("smart_reports", "status",   "status VARCHAR(20) DEFAULT 'open'")
-    _ensure_column("smart_reports", "pdf_path", "pdf_path TEXT")
-    _ensure_column("smart_reports", "html_path","html_path TEXT")
-
 # ---------- HEALTH & DEBUG ----------
 @app.route("/_health")
 def _health():
     return "OK", 200
 
+# ------------------ ETag / GET شرطي ------------------
+# لوحات المطبخ تستطلع كل بضع ثوانٍ: نقارن If-None-Match بإصدار الفئة (category_versions)
+# قبل أي استعلام ثقيل أو تسلسل، ونرجّع 304 بدون جسم.
+def _weak_etag(*parts) -> str:
+    return hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:24]
+
+def _conditional(etag: str, build):
+    if request.if_none_match.contains_weak(etag):
+        resp = app.response_class(status=304)
+    else:
+        resp = app.make_response(build())
+        if resp.status_code != 200:
+            return resp
+    resp.set_etag(etag, weak=True)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+def _category_etag(code: str | None = None) -> str:
+    version, updated = category_version(code or None)
+    return _weak_etag(request.path, code or "*", version, updated, request.query_string.decode("latin-1"))
+
+CATEGORY_ITEMS = [{"code": c, "label": NOR_LABELS.get(c, c.capitalize())} for c in UPLOAD_DIRS.keys()]
+CATEGORIES_ETAG = _weak_etag(json.dumps(CATEGORY_ITEMS, sort_keys=True))
+
 @app.route("/api/categories")
 def api_categories():
-    items = [{"code": c, "label": NOR_LABELS.get(c, c.capitalize())} for c in UPLOAD_DIRS.keys()]
-    return jsonify({"ok": True, "items": items})
+    return _conditional(CATEGORIES_ETAG, lambda: jsonify({"ok": True, "items": CATEGORY_ITEMS}))
 
 @app.route("/_test/pdf")
 def _test_pdf():
@@ -124,6 +149,18 @@ def _debug_seed():
     db.session.commit()
     return jsonify({"ok": True, "seeded_category": category})
 
+@app.route("/_debug/ai_cache")
+def _debug_ai_cache():
+    from llm_cache import cache
+    from smart_ai import llm_metrics
+    return jsonify({"ok": True, "cache": cache.stats(), "llm": llm_metrics()})
+
+@app.route("/_debug/db")
+def _debug_db():
+    pool = db.engine.pool
+    return jsonify({"ok": True, "sqlite": sqlite_settings(db.engine), "pool": pool.status(),
+                    "render_jobs": render_queue.queue_stats()})
+
 # ------------------ اللغات ------------------
 def load_lang(code: str):
     lang_dir = app.config.get("LANG_DIR") or os.path.join(BASE_DIR, "langs")
@@ -169,15 +206,126 @@ def get_form_partial(category):
         abort(404)
     return render_template(f"forms/{FORM_FILES[category]}")
 
+# ------------------ مؤشرات اللوحة (من category_stats) ------------------
+@app.route("/api/stats")
+def api_stats():
+    # by_category يغطي كل الفئات ⇒ الإصدار الكلي
+    return _conditional(_category_etag(), _api_stats_body)
+
+def _api_stats_body():
+    code = (request.args.get("category") or "").strip()
+    counts = category_counts(code or None)
+    by_status = {}
+    for src in ("manual", "smart"):
+        for st, n in counts.get(src, {}).items():
+            by_status[st] = by_status.get(st, 0) + n
+    per_cat = totals_by_category()
+    by_category = {c: v["manual"] + v["smart"] for c, v in per_cat.items()}
+    total = sum(by_status.values())
+    return jsonify({
+        "ok": True, "category": code or None,
+        "total": total,
+        "open": by_status.get("open", 0),
+        "in_progress": by_status.get("in_progress", 0) + by_status.get("processing", 0),
+        "closed": by_status.get("closed", 0),
+        "sources": counts,
+        "by_category": by_category,
+        "sikkerhet": by_status.get("open", 0),
+        "rapporter": by_category.get("reports", 0),
+        "avvik": by_category.get("deviations", 0),
+        "arbeidere": by_category.get("workers", 0),
+    })
+
 # ------------------ CRUD مختصر للسجلات ------------------
+# ترقيم بالمؤشّر: ?after=<created_at>,<id> (من حقل "next" في الرد السابق) &limit=
+# فلاتر: status (قائمة بفواصل)، date_from/date_to (YYYY-MM-DD، شاملة)، created_by
+# اختيار الحقول: ?fields=id,title,status,created_at,category
+RECORDS_PAGE_DEFAULT = 50
+RECORDS_PAGE_MAX     = 500
+RECORD_FIELDS = dict(zip(Record.__api_fields__, Record.api_columns()), category=Category.code)
+RECORD_FIELDS_DEFAULT = list(Record.__api_fields__)
+
+def _parse_cursor(raw: str):
+    ts, _, rid = raw.rpartition(",")
+    return datetime.datetime.fromisoformat(ts), int(rid)
+
+def _parse_day(raw: str):
+    return datetime.datetime.strptime(raw, "%Y-%m-%d")
+
 @app.route("/api/records")
 def api_records():
-    code = request.args.get("category", "")
-    q = Record.query.join(Category)
+    return _conditional(_category_etag(request.args.get("category", "")), _api_records_body)
+
+def _api_records_body():
+    args = request.args
+    code = args.get("category", "")
+    try:
+        limit = min(max(int(args.get("limit", RECORDS_PAGE_DEFAULT)), 1), RECORDS_PAGE_MAX)
+        after = _parse_cursor(args["after"]) if args.get("after") else None
+        date_from = _parse_day(args["date_from"]) if args.get("date_from") else None
+        date_to = _parse_day(args["date_to"]) + datetime.timedelta(days=1) if args.get("date_to") else None
+    except ValueError as e:
+        return jsonify({"ok": False, "error": "bad_query", "detail": str(e)}), 400
+
+    fields = [f.strip() for f in args.get("fields", "").split(",") if f.strip()] or RECORD_FIELDS_DEFAULT
+    unknown = [f for f in fields if f not in RECORD_FIELDS]
+    if unknown:
+        return jsonify({"ok": False, "error": "unknown_fields", "fields": unknown}), 400
+
+    # id و created_at دائمًا (للمؤشّر)، ثم الحقول المطلوبة فقط — بدون تحميل كائنات ORM
+    cols = [Record.id, Record.created_at] + [RECORD_FIELDS[f] for f in fields]
+    q = db.session.query(*cols)
+    if code or "category" in fields:
+        q = q.join(Category, Record.category_id == Category.id)
     if code:
         q = q.filter(Category.code == code)
-    rows = q.order_by(Record.created_at.desc()).limit(500).all()
-    return jsonify({"records": [r.to_dict() for r in rows]})
+    statuses = [x for x in args.get("status", "").split(",") if x]
+    if statuses:
+        q = q.filter(Record.status.in_(statuses))
+    if args.get("created_by"):
+        q = q.filter(Record.created_by == args["created_by"])
+    if date_from:
+        q = q.filter(Record.created_at >= date_from)
+    if date_to:
+        q = q.filter(Record.created_at < date_to)
+    if after:
+        q = q.filter(tuple_(Record.created_at, Record.id) < tuple_(*after))
+
+    rows = q.order_by(Record.created_at.desc(), Record.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    out = project_rows((row[2:] for row in rows), fields)
+    nxt = None
+    if has_more and rows:
+        last_id, last_ts = rows[-1][0], rows[-1][1]
+        nxt = f"{last_ts.isoformat()},{last_id}"
+    return jsonify({"ok": True, "records": out, "next": nxt})
+
+# ------------------ بحث نصّي (FTS5) ------------------
+# ?q=نص&category=&source=manual|smart&status=&limit=&offset=
+SEARCH_PAGE_MAX = 100
+
+@app.route("/api/search")
+def api_search():
+    return _conditional(_category_etag(), _api_search_body)
+
+def _api_search_body():
+    args = request.args
+    q = (args.get("q") or "").strip()
+    if not q:
+        return jsonify({"ok": False, "error": "missing_query"}), 400
+    try:
+        limit = min(max(int(args.get("limit", 20)), 1), SEARCH_PAGE_MAX)
+        offset = max(int(args.get("offset", 0)), 0)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": "bad_query", "detail": str(e)}), 400
+    t0 = time.perf_counter()
+    res = fts_search(q, category=args.get("category") or None, source=args.get("source") or None,
+                     status=args.get("status") or None, limit=limit, offset=offset)
+    nxt = offset + limit if offset + limit < res["total"] else None
+    return jsonify({"ok": True, "q": q, "total": res["total"], "items": res["items"], "next_offset": nxt,
+                    "took_ms": round((time.perf_counter() - t0) * 1000, 2)})
 
 # ------------------ تنزيل المرفقات/التقارير ------------------
 @app.route("/uploads/<category>/<path:filename>")
@@ -230,122 +378,284 @@ def smart_report_new():
     return render_template("smart_report_form.html", category=category)
 
 # 2) معاينة فورية (ذكاء + حقن كهرباء عند الكلمات المفتاحية)
-@app.route("/smart_report/preview", methods=["POST"])
-def smart_report_preview():
-    import re
-    g = request.form.get
-
-    category   = (g("category") or "").strip()
-    reporter   = (g("reporter") or "admin").strip()
-    date_str   = (g("date") or datetime.datetime.now().strftime("%Y-%m-%d")).strip()
-
-    location   = (g("location") or g("site") or g("الموقع") or "").strip()
-    incident   = (g("incident_type") or g("نوع_الحادث") or "").strip()
-    root_cause = (g("root_cause") or g("السبب_الجذري") or "").strip()
-    impact     = (g("impact") or g("result") or g("النتيجة") or "").strip()
-
-    act_i = (g("immediate_actions")  or g("actions_immediate")  or g("إجراءات_عاجلة")    or "").strip()
-    act_c = (g("corrective_actions") or g("actions_corrective") or g("إجراءات_تصحيحية")  or "").strip()
-    act_p = (g("preventive_actions") or g("actions_preventive") or g("إجراءات_وقائية")    or "").strip()
-
-    responsible = (g("responsible") or g("المسؤول") or reporter).strip()
-    due_date    = (g("due_date") or g("deadline") or g("الموعد") or "").strip()
-    risk_before = (g("risk_before") or g("likelihood") or g("مستوى_الخطر") or "Middels").strip()
-    free_notes  = (g("details") or g("ملاحظات") or "").strip()
-
-    if category not in UPLOAD_DIRS:
-        abort(400)
+_ELECTRIC_RE = re.compile(r"(سلك|كهرب|electri|strøm|ledning)")
+
+def _text_field(form, key):
+    """قيمة حقل كنص: رقم ⇒ str؛ قائمة/كائن/منطقي (من JSON) ⇒ ValueError."""
+    v = form.get(key)
+    if v is None or isinstance(v, str):
+        return v
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return str(v)
+    raise ValueError(f"field '{key}' must be a string")
+
+def _preview_inputs(form) -> dict:
+    """يقرأ حقول النموذج (بأسمائها البديلة) ويبني الملاحظات الموحّدة لإطعام الذكاء."""
+    g = lambda key: _text_field(form, key)
+    inp = {
+        "category":    (g("category") or "").strip(),
+        "reporter":    (g("reporter") or "admin").strip(),
+        "date":        (g("date") or datetime.datetime.now().strftime("%Y-%m-%d")).strip(),
+        "location":    (g("location") or g("site") or g("الموقع") or "").strip(),
+        "incident":    (g("incident_type") or g("نوع_الحادث") or "").strip(),
+        "root_cause":  (g("root_cause") or g("السبب_الجذري") or "").strip(),
+        "impact":      (g("impact") or g("result") or g("النتيجة") or "").strip(),
+        "act_i":       (g("immediate_actions")  or g("actions_immediate")  or g("إجراءات_عاجلة")    or "").strip(),
+        "act_c":       (g("corrective_actions") or g("actions_corrective") or g("إجراءات_تصحيحية")  or "").strip(),
+        "act_p":       (g("preventive_actions") or g("actions_preventive") or g("إجراءات_وقائية")    or "").strip(),
+        "due_date":    (g("due_date") or g("deadline") or g("الموعد") or "").strip(),
+        "risk_before": (g("risk_before") or g("likelihood") or g("مستوى_الخطر") or "Middels").strip(),
+        "free_notes":  (g("details") or g("ملاحظات") or "").strip(),
+    }
+    inp["responsible"] = (g("responsible") or g("المسؤول") or inp["reporter"]).strip()
 
     # ملاحظات موحّدة لإطعام الذكاء
     notes_lines = [
-        f"Sted: {location}" if location else "",
-        f"Hendelsestype: {incident}" if incident else "",
-        f"Rotårsak: {root_cause}" if root_cause else "",
-        f"Konsekvens/effekt: {impact}" if impact else "",
-        f"Akutte tiltak (innmeldt): {act_i}" if act_i else "",
-        f"Korrigerende tiltak (innmeldt): {act_c}" if act_c else "",
-        f"Forebyggende tiltak (innmeldt): {act_p}" if act_p else "",
-        f"Ansvarlig: {responsible}" if responsible else "",
-        f"Frist: {due_date}" if due_date else "",
-        f"Fritekst: {free_notes}" if free_notes else "",
-        f"Forhåndsvurdert risiko: {risk_before}",
+        f"Sted: {inp['location']}" if inp["location"] else "",
+        f"Hendelsestype: {inp['incident']}" if inp["incident"] else "",
+        f"Rotårsak: {inp['root_cause']}" if inp["root_cause"] else "",
+        f"Konsekvens/effekt: {inp['impact']}" if inp["impact"] else "",
+        f"Akutte tiltak (innmeldt): {inp['act_i']}" if inp["act_i"] else "",
+        f"Korrigerende tiltak (innmeldt): {inp['act_c']}" if inp["act_c"] else "",
+        f"Forebyggende tiltak (innmeldt): {inp['act_p']}" if inp["act_p"] else "",
+        f"Ansvarlig: {inp['responsible']}" if inp["responsible"] else "",
+        f"Frist: {inp['due_date']}" if inp["due_date"] else "",
+        f"Fritekst: {inp['free_notes']}" if inp["free_notes"] else "",
+        f"Forhåndsvurdert risiko: {inp['risk_before']}",
     ]
-    notes = "\n".join([x for x in notes_lines if x])
-
+    inp["notes"] = "\n".join([x for x in notes_lines if x])
+    return inp
+
+def _default_title(category: str) -> str:
+    return f"Hendelsesrapport – {NOR_LABELS.get(category, category.capitalize())}"
+
+def _is_electric(inp: dict) -> bool:
+    text_all = " ".join([inp["notes"], inp["free_notes"], inp["incident"]]).lower()
+    return bool(_ELECTRIC_RE.search(text_all))
+
+def _finish_preview(p: dict) -> dict:
+    p["description"] = "\n\n".join([f"{s['title']}:\n{s['body']}" for s in p["sections"]])
+    return p
+
+def _fallback_preview(inp: dict) -> dict:
+    # احتياطي: نولّد من المدخلات مباشرة
+    severity = "Middels"
+    location, responsible, due_date = inp["location"], inp["responsible"], inp["due_date"]
+    act_i, act_c, act_p = inp["act_i"], inp["act_c"], inp["act_p"]
+    sections = [
+        {"title":"Sammendrag", "body": f"Hendelse registrert på {location or 'ukjent sted'}. Foreløpig risiko: {severity}."},
+        {"title":"Tema", "body": inp["incident"] or "Ikke spesifisert"},
+        {"title":"Observasjoner", "body": inp["impact"] or "—"},
+        {"title":"Årsaksanalyse (5 hvorfor)", "body": inp["root_cause"] or "—"},
+        {"title":"Risikovurdering", "body": f"Forhåndsvurdert nivå før tiltak: {severity}."},
+        {"title":"Tiltaksplan", "body": "Se tabellen nedenfor."},
+        {"title":"Etterlevelse", "body": "Vurdert mot HMS/HACCP for restaurantdrift."},
+        {"title":"Konklusjon", "body": "Tiltak følges opp til lukking."},
+    ]
+    actions = []
+    if act_i: actions.append({"tiltak": act_i, "ansvar": responsible, "frist": due_date or "+1 dag", "status":"Planlagt"})
+    if act_c: actions.append({"tiltak": act_c, "ansvar": responsible, "frist": due_date or "+7 dager", "status":"Planlagt"})
+    if act_p: actions.append({"tiltak": act_p, "ansvar": "HMS-ansvarlig", "frist": "+14 dager", "status":"Planlagt"})
+    risk_table = [["Risiko","Beskrivelse","Tiltak"],
+                  [severity, (inp["impact"] or "Foreløpig vurdering"), (act_i or act_c or act_p or "Oppfølging")]]
+    return _finish_preview({"title": _default_title(inp["category"]), "severity": severity, "status": "open",
+                            "sections": sections, "actions": actions, "risk_table": risk_table})
+
+def _electric_preview(inp: dict) -> dict:
+    # حقن ذكي لخطر الكهرباء حسب الكلمات (يتجاوز ناتج الذكاء دائمًا، لذلك لا نستدعيه أصلًا)
+    location = inp["location"]
+    sections = [
+        {"title":"Sammendrag", "body": f"Oppdaget eksponert elektrisk ledning i {location or 'ukjent område'}. Umiddelbar avsperring og varsling. Risiko vurdert som Høy."},
+        {"title":"Tema", "body": "Elektrisk fare – eksponert ledning"},
+        {"title":"Bakgrunn", "body": (inp["free_notes"] or "—")},
+        {"title":"Observasjoner", "body": (inp["impact"] or "Fare for elektrisk støt, brann og personskade ved berøring.")},
+        {"title":"Årsaksanalyse (5 hvorfor)", "body": (inp["root_cause"] or "Foreløpig antatt: mekanisk skade/feil montasje/manglende vedlikehold.")},
+        {"title":"Risikovurdering", "body": "Sannsynlighet: Middels–Høy. Konsekvens: Alvorlig. Samlet nivå: Høy før tiltak."},
+        {"title":"Tiltaksplan", "body": "Se tabellen for akutte, korrigerende og forebyggende tiltak."},
+        {"title":"Etterlevelse", "body": "Krav iht. NEK 400, internkontrollforskriften og bedriftens HMS-rutiner."},
+        {"title":"Konklusjon", "body": "Tiltak gjennomføres umiddelbart. Saken lukkes etter verifikasjon fra autorisert elektriker."},
+    ]
+    actions = [
+        {"tiltak":"Sperr området og kutt strømkrets hvis mulig.", "ansvar":"Skiftleder", "frist":"Straks", "status":"Igangsatt"},
+        {"tiltak":"Isoler مؤقتًا الموصل المكشوف حتى يصل الكهربائي.", "ansvar":"HMS-ansvarlig", "frist":"Straks", "status":"Planlagt"},
+        {"tiltak":"Kontakt autorisert elektriker لاصلاح دائم وتوثيق.", "ansvar":"Daglig leder", "frist":"+1 dag", "status":"Planlagt"},
+        {"tiltak":"Kontroller kabler مجاورة وتحديث logg vedlikehold.", "ansvar":"HMS-ansvarlig", "frist":"+3 dager", "status":"Planlagt"},
+        {"tiltak":"Vernerunde سريعة وتذكير بإبلاغ avvik.", "ansvar":"Verneombud", "frist":"+7 dager", "status":"Planlagt"},
+    ]
+    risk_table = [
+        ["Risiko","Beskrivelse","Tiltak (før/etter)"],
+        ["Høy","Eksponert elektrisk ledning; støt/brannskade","FØR: Avsperring/strøm av. ETTER: Fagmessig utbedring + kontroll."],
+    ]
+    return _finish_preview({"title": "Hendelsesrapport – Elektrisk fare (eksponert ledning)", "severity": "Høy",
+                            "status": "open", "sections": sections, "actions": actions, "risk_table": risk_table})
+
+def _preview_from_gen(inp: dict, gen: dict) -> dict:
+    return _finish_preview({
+        "title":      gen.get("title", _default_title(inp["category"])),
+        "severity":   gen.get("severity", "Middels"),
+        "status":     gen.get("status", "open"),
+        "sections":   gen.get("sections", []),
+        "actions":    gen.get("actions", []),
+        "risk_table": gen.get("risk_table", []),
+    })
+
+def _build_preview(inp: dict) -> dict:
+    if _is_electric(inp):
+        return _electric_preview(inp)
     # توليد عميق إن توفّر smart_ai، وإلا نولّد من المدخلات
-    sections, actions, risk_table = [], [], []
-    title, severity, status = f"Hendelsesrapport – {NOR_LABELS.get(category, category.capitalize())}", "Middels", "open"
-
     try:
-        if generate_deep_hms_report:
-            gen = generate_deep_hms_report(notes=notes, category=category, reporter=reporter, status="open")
-            sections   = gen.get("sections", [])
-            actions    = gen.get("actions", [])
-            risk_table = gen.get("risk_table", [])
-            title      = gen.get("title", title)
-            severity   = gen.get("severity", severity)
-            status     = gen.get("status", status)
-        else:
+        if not generate_deep_hms_report:
             raise RuntimeError("smart_ai not available")
+        gen = generate_deep_hms_report(notes=inp["notes"], category=inp["category"],
+                                       reporter=inp["reporter"], status="open")
+        return _preview_from_gen(inp, gen)
     except Exception:
-        # احتياطي
-        sections = [
-            {"title":"Sammendrag", "body": f"Hendelse registrert på {location or 'ukjent sted'}. Foreløpig risiko: {severity}."},
-            {"title":"Tema", "body": incident or "Ikke spesifisert"},
-            {"title":"Observasjoner", "body": impact or "—"},
-            {"title":"Årsaksanalyse (5 hvorfor)", "body": root_cause or "—"},
-            {"title":"Risikovurdering", "body": f"Forhåndsvurdert nivå før tiltak: {severity}."},
-            {"title":"Tiltaksplan", "body": "Se tabellen nedenfor."},
-            {"title":"Etterlevelse", "body": "Vurdert mot HMS/HACCP for restaurantdrift."},
-            {"title":"Konklusjon", "body": "Tiltak følges opp til lukking."},
-        ]
-        if act_i: actions.append({"tiltak": act_i, "ansvar": responsible, "frist": due_date or "+1 dag", "status":"Planlagt"})
-        if act_c: actions.append({"tiltak": act_c, "ansvar": responsible, "frist": due_date or "+7 dager", "status":"Planlagt"})
-        if act_p: actions.append({"tiltak": act_p, "ansvar": "HMS-ansvarlig", "frist": "+14 dager", "status":"Planlagt"})
-        risk_table = [["Risiko","Beskrivelse","Tiltak"],
-                      [severity, (impact or "Foreløpig vurdering"), (act_i or act_c or act_p or "Oppfølging")]]
-
-    # حقن ذكي لخطر الكهرباء حسب الكلمات
-    text_all = " ".join([notes, free_notes, incident]).lower()
-    if re.search(r"(سلك|كهرب|electri|strøm|ledning)", text_all):
-        severity = "Høy"
-        title = "Hendelsesrapport – Elektrisk fare (eksponert ledning)"
-        sections = [
-            {"title":"Sammendrag", "body": f"Oppdaget eksponert elektrisk ledning i {location or 'ukjent område'}. Umiddelbar avsperring og varsling. Risiko vurdert som Høy."},
-            {"title":"Tema", "body": "Elektrisk fare – eksponert ledning"},
-            {"title":"Bakgrunn", "body": (free_notes or "—")},
-            {"title":"Observasjoner", "body": (impact or "Fare for elektrisk støt, brann og personskade ved berøring.")},
-            {"title":"Årsaksanalyse (5 hvorfor)", "body": (root_cause or "Foreløpig antatt: mekanisk skade/feil montasje/manglende vedlikehold.")},
-            {"title":"Risikovurdering", "body": "Sannsynlighet: Middels–Høy. Konsekvens: Alvorlig. Samlet nivå: Høy før tiltak."},
-            {"title":"Tiltaksplan", "body": "Se tabellen for akutte, korrigerende og forebyggende tiltak."},
-            {"title":"Etterlevelse", "body": "Krav iht. NEK 400, internkontrollforskriften og bedriftens HMS-rutiner."},
-            {"title":"Konklusjon", "body": "Tiltak gjennomføres umiddelbart. Saken lukkes etter verifikasjon fra autorisert elektriker."},
-        ]
-        actions = [
-            {"tiltak":"Sperr området og kutt strømkrets hvis mulig.", "ansvar":"Skiftleder", "frist":"Straks", "status":"Igangsatt"},
-            {"tiltak":"Isoler مؤقتًا الموصل المكشوف حتى يصل الكهربائي.", "ansvar":"HMS-ansvarlig", "frist":"Straks", "status":"Planlagt"},
-            {"tiltak":"Kontakt autorisert elektriker لاصلاح دائم وتوثيق.", "ansvar":"Daglig leder", "frist":"+1 dag", "status":"Planlagt"},
-            {"tiltak":"Kontroller kabler مجاورة وتحديث logg vedlikehold.", "ansvar":"HMS-ansvarlig", "frist":"+3 dager", "status":"Planlagt"},
-            {"tiltak":"Vernerunde سريعة وتذكير بإبلاغ avvik.", "ansvar":"Verneombud", "frist":"+7 dager", "status":"Planlagt"},
-        ]
-        risk_table = [
-            ["Risiko","Beskrivelse","Tiltak (før/etter)"],
-            ["Høy","Eksponert elektrisk ledning; støt/brannskade","FØR: Avsperring/strøm av. ETTER: Fagmessig utbedring + kontroll."],
-        ]
-        status = "open"
-
-    description = "\n\n".join([f"{s['title']}:\n{s['body']}" for s in sections])
+        return _fallback_preview(inp)
 
+def _render_preview(inp: dict, p: dict, job_id: str | None = None):
     return render_template(
         "smart_report_preview.html",
-        category=category, reporter=reporter, date=date_str,
-        title=title, description=description, severity=severity, status=status,
-        sections=json.dumps(sections, ensure_ascii=False),
-        actions=json.dumps(actions, ensure_ascii=False),
-        risk_table=json.dumps(risk_table, ensure_ascii=False),
+        category=inp["category"], reporter=inp["reporter"], date=inp["date"],
+        title=p["title"], description=p["description"], severity=p["severity"], status=p["status"],
+        sections=json.dumps(p["sections"], ensure_ascii=False),
+        actions=json.dumps(p["actions"], ensure_ascii=False),
+        risk_table=json.dumps(p["risk_table"], ensure_ascii=False),
+        job_id=job_id,
     )
 
+@app.route("/smart_report/preview", methods=["POST"])
+def smart_report_preview():
+    inp = _preview_inputs(request.form)
+    if inp["category"] not in UPLOAD_DIRS:
+        abort(400)
+    return _render_preview(inp, _build_preview(inp))
+
+# 2ب) معاينة غير متزامنة: POST يُنشئ مهمة ويرجع فورًا، والصفحة تستقبل الأقسام تباعًا (SSE أو polling)
+# المهمة وأحداثها في القاعدة (preview_jobs.py) ⇒ الاستعلام يصل لأي عملية
+_preview_pool = ThreadPoolExecutor(max_workers=int(os.getenv("HMS_PREVIEW_WORKERS", "8")),
+                                   thread_name_prefix="preview")
+
+def _run_preview_job(job_id: str, inp: dict):
+    with app.app_context():
+        try:
+            if not preview_jobs.emit(job_id, None, status="running"):
+                return   # أُنهيت بالمعاينة الاحتياطية قبل أن يصلها الدور
+            try:
+                if _is_electric(inp):
+                    result = _electric_preview(inp)
+                elif stream_deep_hms_report:
+                    gen = None
+                    for ev in stream_deep_hms_report(notes=inp["notes"], category=inp["category"],
+                                                     reporter=inp["reporter"], status="open"):
+                        if ev["type"] == "result":
+                            gen = ev["data"]
+                        else:
+                            preview_jobs.emit(job_id, ev["type"], ev["data"])
+                    result = _preview_from_gen(inp, gen or {})
+                else:
+                    raise RuntimeError("smart_ai not available")
+            except Exception as e:
+                print("[PreviewJob]", job_id, repr(e))
+                result = _fallback_preview(inp)
+            preview_jobs.emit(job_id, "done", result, status="done")
+        except Exception as e:   # القاعدة غير متاحة... المستمع يُنهيها بعد PREVIEW_STALE_S
+            print("[PreviewJob]", job_id, "not stored:", repr(e))
+        finally:
+            db.session.remove()
+
+def _start_preview_job(inp: dict) -> str:
+    job_id = preview_jobs.create_job(inp)
+    _preview_pool.submit(_run_preview_job, job_id, inp)
+    return job_id
+
+def _check_preview_job(job_id: str):
+    if not preview_jobs.job_exists(job_id):
+        abort(404)
+
+@app.route("/smart_report/jobs", methods=["POST"])
+def smart_report_job_create():
+    inp = _preview_inputs(request.form)
+    if inp["category"] not in UPLOAD_DIRS:
+        return jsonify({"ok": False, "error": "bad_category"}), 400
+    job_id = _start_preview_job(inp)
+    return jsonify({"ok": True, "job_id": job_id,
+                    "events_url": url_for("smart_report_job_events", job_id=job_id),
+                    "poll_url": url_for("smart_report_job_poll", job_id=job_id)}), 202
+
+@app.route("/smart_report/preview_live", methods=["POST"])
+def smart_report_preview_live():
+    inp = _preview_inputs(request.form)
+    if inp["category"] not in UPLOAD_DIRS:
+        abort(400)
+    job_id = _start_preview_job(inp)
+    shell = _finish_preview({"title": _default_title(inp["category"]), "severity": "Middels", "status": "open",
+                             "sections": [], "actions": [], "risk_table": []})
+    return _render_preview(inp, shell, job_id=job_id)
+
+@app.route("/smart_report/jobs/<job_id>")
+def smart_report_job_poll(job_id):
+    _check_preview_job(job_id)
+    since = request.args.get("since", 0, type=int)
+    wait = min(request.args.get("wait", 0, type=float), 25.0)
+    events, status = preview_jobs.wait_events(job_id, since, max(wait, 0.0), fallback=_fallback_preview)
+    return jsonify({"ok": True, "status": status, "next": since + len(events), "events": events})
+
+# SSE و long-poll يحجزان خيط الطلب طوال المعاينة ⇒ عمّال gthread في gunicorn.conf.py (لا sync)
+@app.route("/smart_report/jobs/<job_id>/events")
+def smart_report_job_events(job_id):
+    _check_preview_job(job_id)
+    since = request.args.get("since", 0, type=int)
+
+    def stream():
+        i = since
+        while True:
+            events, status = preview_jobs.wait_events(job_id, i, 15.0, fallback=_fallback_preview)
+            if not events:
+                if status == "done":
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            for ev in events:
+                i += 1
+                yield f"id: {i}\nevent: {ev['event']}\ndata: {json.dumps(ev['data'], ensure_ascii=False)}\n\n"
+                if ev["event"] == "done":
+                    return
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # 3) تأكيد الحفظ + توليد PDF
+def _logo_path():
+    logo_path = os.path.join(BASE_DIR, "static", "images", "logo.png")
+    return logo_path if os.path.exists(logo_path) else None
+
+def _smart_pdf_paths(rpt: SmartReport):
+    """(المسار الكامل، المسار النسبي المحفوظ في pdf_path) لملف PDF التقرير الذكي."""
+    base_dir, pdf_name, _ = build_paths(UPLOAD_ROOT, rpt.category_code, rpt.id)
+    os.makedirs(base_dir, exist_ok=True)
+    rel_pdf = os.path.join("uploads", rpt.category_code, "smart_reports", pdf_name).replace("\\","/")
+    return os.path.join(base_dir, pdf_name), rel_pdf
+
+def _smart_pdf_meta(rpt: SmartReport, date_str: str, sections, actions, risk_table) -> dict:
+    severity = rpt.severity
+    table_rows = risk_table if (isinstance(risk_table, list) and risk_table) else [
+        ["Risiko", "Beskrivelse", "Tiltak"],
+        [severity, "Foreløpig vurdering basert på observasjoner", "Oppfølging etter behov"]
+    ]
+    return {
+        "id": rpt.id, "category_code": rpt.category_code, "title": rpt.title, "date": date_str,
+        "created_by": rpt.created_by, "lang": "no", "severity": severity, "status": rpt.status,
+        "description": rpt.description or f"Forløpig risiko: {severity}.",
+        "table_rows": table_rows,
+        "sections": sections,
+        "actions": actions,
+        "status_badge": {
+            "open": ("Åpen sak", "#dc2626"),
+            "processing": ("Under behandling", "#f59e0b"),
+            "closed": ("Lukket", "#16a34a"),
+        },
+    }
+
 @app.route("/smart_report/confirm", methods=["POST"])
 def smart_report_confirm():
     import json as _json
@@ -384,48 +694,56 @@ def smart_report_confirm():
         created_by=reporter,
         status=status
     )
-    db.session.add(rpt); db.session.commit()
-
-    base_dir, pdf_name, _ = build_paths(UPLOAD_ROOT, category, rpt.id)
-    os.makedirs(base_dir, exist_ok=True)
-    logo_path = os.path.join(BASE_DIR, "static", "images", "logo.png")
-    if not os.path.exists(logo_path): logo_path = None
+    db.session.add(rpt); db.session.flush()   # نحتاج rpt.id لمسار PDF
 
-    table_rows = risk_table if (isinstance(risk_table, list) and risk_table) else [
-        ["Risiko", "Beskrivelse", "Tiltak"],
-        [severity, "Foreløpig vurdering basert på observasjoner", "Oppfølging etter behov"]
-    ]
-    meta = {
-        "id": rpt.id, "category_code": category, "title": title, "date": date_str,
-        "created_by": reporter, "lang": "no", "severity": severity, "status": status,
-        "description": description or f"Forløpig risiko: {severity}.",
-        "table_rows": table_rows,
-        "sections": sections,
-        "actions": actions,
-        "status_badge": {
-            "open": ("Åpen sak", "#dc2626"),
-            "processing": ("Under behandling", "#f59e0b"),
-            "closed": ("Lukket", "#16a34a"),
-        },
-    }
-    pdf_path = os.path.join(base_dir, pdf_name)
-    try:
-        render_pdf(pdf_path, meta, logo_path=logo_path)
-    except Exception as e:
-        print("[PDF ERROR]", e)
-        return render_template_string(
-            "<h3 style='font-family:Arial'>Feil under generering av PDF.</h3>"
-            "<p>Detaljer هي مسجلة في سجلّ الخادم.</p>"
-            "<p><a href='{{ url }}'>⟵ Tilbake</a></p>",
-            url=url_for("smart_report_view", report_id=rpt.id),
-        ), 500
-
-    rel_pdf = os.path.join("uploads", category, "smart_reports", pdf_name).replace("\\","/")
-    rpt.pdf_path = rel_pdf; rpt.html_path = None
+    # PDF في الخلفية (render_queue): التقرير والمهمة في نفس المعاملة
+    _, rel_pdf = _smart_pdf_paths(rpt)
+    meta = _smart_pdf_meta(rpt, date_str, sections, actions, risk_table)
+    render_queue.enqueue_render(rpt, meta, rel_pdf)
     db.session.commit()
+    _ensure_render_workers()
+    render_queue.wake_workers()
 
     return redirect(url_for("smart_report_view", report_id=rpt.id))
 
+def _ensure_render_workers():
+    render_queue.start_render_workers(app, BASE_DIR, _logo_path)
+
+def _render_state(rpt: SmartReport) -> dict:
+    """pdf_ready / rendering / failed لعرض التقرير ومسار التنزيل."""
+    if rpt.pdf_path and os.path.exists(os.path.join(BASE_DIR, rpt.pdf_path)):
+        return {"state": "ready"}
+    job = render_queue.latest_job(rpt.id)
+    if job is None:
+        return {"state": "missing"}
+    if job.status == "failed":
+        return {"state": "failed", "error": job.last_error, "attempts": job.attempts}
+    if job.status == "done":   # الملف حُذف من القرص بعد التوليد
+        return {"state": "missing"}
+    return {"state": "rendering", "job_status": job.status, "attempts": job.attempts}
+
+@app.route("/smart_report/<int:report_id>/render_status")
+def smart_report_render_status(report_id):
+    rpt = SmartReport.query.get_or_404(report_id)
+    st = _render_state(rpt)
+    if st["state"] == "rendering":
+        _ensure_render_workers()
+    return jsonify({"ok": True, "report_id": rpt.id, **st})
+
+@app.route("/smart_report/<int:report_id>/rerender", methods=["POST"])
+def smart_report_rerender(report_id):
+    rpt = SmartReport.query.get_or_404(report_id)
+    if _render_state(rpt)["state"] in ("failed", "missing"):
+        last = render_queue.latest_job(rpt.id)
+        payload = json.loads(last.payload_json) if last else {
+            "meta": _smart_pdf_meta(rpt, (rpt.created_at or datetime.datetime.now()).strftime("%Y-%m-%d"), [], [], []),
+            "pdf_rel": _smart_pdf_paths(rpt)[1]}
+        render_queue.enqueue_render(rpt, payload["meta"], payload["pdf_rel"])
+        db.session.commit()
+        _ensure_render_workers()
+        render_queue.wake_workers()
+    return redirect(url_for("smart_report_view", report_id=rpt.id))
+
 # 4) عرض تقرير محفوظ
 @app.route("/smart_report/view/<int:report_id>")
 def smart_report_view(report_id):
@@ -436,24 +754,153 @@ def smart_report_view(report_id):
             data["created_at"] = rpt.created_at.strftime("%Y-%m-%d %H:%M")
     except Exception:
         pass
-    return render_template("smart_report_view.html", rpt=data)
+    render = _render_state(rpt)
+    if render["state"] == "rendering":
+        _ensure_render_workers()
+    return render_template("smart_report_view.html", rpt=data, render=render)
 
 # 5) تنزيل PDF
 @app.route("/smart_report/download/<int:report_id>")
 def smart_report_download(report_id):
     rpt = SmartReport.query.get_or_404(report_id)
-    if not rpt.pdf_path:
+    render = _render_state(rpt)
+    if render["state"] == "rendering":
+        _ensure_render_workers()
+        resp = app.make_response(render_template_string(
+            "<!doctype html><meta charset='utf-8'><meta http-equiv='refresh' content='2'>"
+            "<p style='font-family:Arial'>PDF genereres… siden lastes på nytt automatisk.</p>"))
+        resp.status_code = 202
+        resp.headers["Retry-After"] = "2"
+        return resp
+    if render["state"] != "ready":
         abort(404)
     full_path = os.path.join(BASE_DIR, rpt.pdf_path)
-    if not os.path.exists(full_path):
-        abort(404)
     return send_from_directory(os.path.dirname(full_path), os.path.basename(full_path), as_attachment=True)
 
+# 6) توليد دفعي: مصفوفة JSON (أو ملف JSONL) من الملاحظات ⇒ تقارير + مهام PDF في render_queue
+BATCH_MAX_ITEMS   = int(os.getenv("HMS_BATCH_MAX_ITEMS", "200"))
+BATCH_GEN_WORKERS = int(os.getenv("HMS_BATCH_GEN_WORKERS", "4"))
+
+def _batch_items_from_request():
+    up = request.files.get("file")
+    if up:
+        items = []
+        for n, line in enumerate(up.stream.read().decode("utf-8-sig").splitlines(), start=1):
+            if line.strip():
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    raise ValueError(f"invalid JSON on line {n}")
+        return items
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get("items")
+    if not isinstance(payload, list):
+        raise ValueError("expected a JSON array, {\"items\": [...]} or a JSONL file upload")
+    return payload
+
+def _batch_generate(item) -> dict:
+    """ينفّذ في خيط: يولّد تقرير عنصر واحد ويرجّع نتيجة العنصر (بدون لمس قاعدة البيانات، ولا يرمي)."""
+    if not isinstance(item, dict):
+        return {"ok": False, "error": "item_not_object"}
+    try:
+        inp = _preview_inputs(item)
+        notes = (_text_field(item, "notes") or "").strip()
+        status = (_text_field(item, "status") or "open").strip()
+    except ValueError as e:
+        return {"ok": False, "error": "bad_item", "detail": str(e)}
+    if inp["category"] not in UPLOAD_DIRS:
+        return {"ok": False, "error": "bad_category"}
+    if notes:
+        inp["notes"] = "\n".join(x for x in [notes, inp["notes"]] if x)
+    try:
+        if _is_electric(inp):
+            p, source = _electric_preview(inp), "rule"
+        else:
+            if not generate_deep_hms_report:
+                raise RuntimeError("smart_ai not available")
+            gen = generate_deep_hms_report(notes=inp["notes"], category=inp["category"],
+                                           reporter=inp["reporter"], status=status)
+            p, source = _preview_from_gen(inp, gen), "ai"
+    except Exception as e:
+        return {"ok": False, "error": "generate_failed", "detail": str(e)}
+    p["status"] = status if status in ("open", "processing", "closed") else "open"
+    return {"ok": True, "source": source, "inp": inp, "preview": p}
+
+@app.route("/api/smart_reports/batch", methods=["POST"])
+def api_smart_reports_batch():
+    t0 = time.perf_counter()
+    try:
+        items = _batch_items_from_request()
+    except ValueError as e:
+        return jsonify({"ok": False, "error": "bad_payload", "detail": str(e)}), 400
+    if not items:
+        return jsonify({"ok": False, "error": "empty_batch"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"ok": False, "error": "batch_too_large", "max": BATCH_MAX_ITEMS}), 413
+
+    # 1) توليد متوازي (محدود) — حد التزامن الفعلي لاستدعاءات النموذج في smart_ai
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_GEN_WORKERS, len(items)))) as pool:
+        results = list(pool.map(_batch_generate, items))
+    t_gen = time.perf_counter()
+
+    # 2) إدراج كل الصفوف ومهام PDF في معاملة واحدة (مثل smart_report_confirm: إعادة المحاولة وبصمة المحتوى في render_queue)
+    pending = []
+    for res in results:
+        if not res["ok"]:
+            continue
+        inp, p = res["inp"], res["preview"]
+        rpt = SmartReport(
+            category_code=inp["category"], title=p["title"], description=p["description"],
+            actions="", severity=p["severity"],
+            tags_json=json.dumps([], ensure_ascii=False),
+            suggestions_json=json.dumps([], ensure_ascii=False),
+            lang="no", created_by=inp["reporter"], status=p["status"],
+        )
+        res["report"] = rpt
+        pending.append(res)
+    db.session.add_all([r["report"] for r in pending])
+    db.session.flush()   # نحتاج rpt.id لمسار PDF
+    for res in pending:
+        rpt, p = res["report"], res["preview"]
+        _, rel_pdf = _smart_pdf_paths(rpt)
+        meta = _smart_pdf_meta(rpt, res["inp"]["date"], p["sections"], p["actions"], p["risk_table"])
+        render_queue.enqueue_render(rpt, meta, rel_pdf)
+    db.session.commit()
+    if pending:
+        _ensure_render_workers()
+        render_queue.wake_workers()
+    t_db = time.perf_counter()
+
+    out = []
+    for i, res in enumerate(results):
+        if not res["ok"]:
+            out.append({"index": i, "ok": False, "error": res["error"], "detail": res.get("detail")})
+            continue
+        rpt = res["report"]
+        out.append({
+            "index": i, "ok": True, "id": rpt.id, "source": res["source"],
+            "category": rpt.category_code, "title": rpt.title, "severity": rpt.severity,
+            "view_url": url_for("smart_report_view", report_id=rpt.id),
+            "render_status_url": url_for("smart_report_render_status", report_id=rpt.id),
+        })
+    elapsed = t_db - t0
+    return jsonify({
+        "ok": True, "count": len(items), "created": len(pending), "failed": len(items) - len(pending),
+        "elapsed_s": round(elapsed, 3),
+        "items_per_s": round(len(items) / elapsed, 2) if elapsed > 0 else None,
+        "timings_s": {"generate": round(t_gen - t0, 3), "insert": round(t_db - t_gen, 3)},
+        "items": out,
+    })
+
 # قائمة التقارير الذكية لفئة
 @app.route("/smart_reports/<category>")
 def smart_reports_list(category):
     if category not in UPLOAD_DIRS:
         abort(404)
+    return _conditional(_category_etag(category), lambda: _smart_reports_list_html(category))
+
+def _smart_reports_list_html(category):
     rows = SmartReport.query.filter_by(category_code=category)\
         .order_by(SmartReport.created_at.desc()).limit(300).all()
     items = []
@@ -468,8 +915,37 @@ def smart_reports_list(category):
 # ============================================================
 #                 التوليد الآلي (Auto PDF)
 # ============================================================
-scheduler = BackgroundScheduler(daemon=True)
+# المهام محفوظة في قاعدة البيانات (تنجو من إعادة التشغيل)، وعملية واحدة فقط
+# (حاملة القفل في scheduler_leases) تنفّذها؛ البقية تبدأ المجدول متوقفًا مؤقتًا.
+SCHED_LEASE_NAME    = "auto_reports"
+SCHED_LEASE_TTL     = float(os.getenv("HMS_SCHED_LEASE_TTL", "60"))
+SCHED_MISFIRE_GRACE = int(os.getenv("HMS_SCHED_MISFIRE_GRACE", str(6 * 3600)))
+SCHED_OWNER         = scheduler_lease.make_owner_id()
+
+with app.app_context():
+    _db_engine = db.engine   # نفس المجمّع ونفس PRAGMA (WAL/busy_timeout) لمخزن المهام
+
+def _new_scheduler() -> BackgroundScheduler:
+    return BackgroundScheduler(
+        daemon=True,
+        jobstores={"default": SQLAlchemyJobStore(engine=_db_engine, tablename="apscheduler_jobs")},
+        job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": SCHED_MISFIRE_GRACE},
+    )
+
+scheduler = _new_scheduler()
 job_id = "auto_reports_job"
+# مرجع نصّي: يُحلّ في أي عملية تستورد app (لا نخزّن كائن الدالة في المخزن)
+AUTO_JOB_REF = "app:auto_generate_selected_categories"
+_sched_state = {"leader": False, "thread": None}
+
+def _period_days(*values):
+    """أول period_days صالح من الطلب ⇒ int (0 = آخر 10 عناصر)، أو None ⇒ HMS_REPORT_PERIOD_DAYS."""
+    for value in values:
+        try:
+            return max(0, int(value))
+        except (TypeError, ValueError):
+            continue
+    return None
 
 @app.route("/api/report_generate", methods=["POST"])
 def api_report_generate():
@@ -482,6 +958,9 @@ def api_report_generate():
         created_by = (payload.get("created_by")
                       or request.form.get("created_by")
                       or "Auto").strip()
+        period_days = _period_days(payload.get("period_days"),
+                                   request.form.get("period_days"),
+                                   request.args.get("period_days"))
 
         if not category:
             return jsonify({"ok": False, "error": "missing_category"}), 400
@@ -495,7 +974,8 @@ def api_report_generate():
         logo_path = os.path.join(BASE_DIR, "static", "images", "logo.png")
         if not os.path.exists(logo_path): logo_path = None
 
-        out_path = generate_category_report(category, UPLOAD_ROOT, logo_path=logo_path, created_by=created_by)
+        out_path = generate_category_report(category, UPLOAD_ROOT, logo_path=logo_path, created_by=created_by,
+                                            period_days=period_days)
         if not out_path or not os.path.exists(out_path):
             return jsonify({"ok": False, "error": "no_output_from_generator"}), 500
 
@@ -506,24 +986,128 @@ def api_report_generate():
         print("[AutoGenerate ERROR]", repr(e))
         return jsonify({"ok": False, "error": "generate_failed", "detail": str(e)}), 500
 
+# توليد تلقائي متوازي: كل فئة في عملية مستقلة (ReportLab يعتمد على المعالج)
+AUTO_REPORT_WORKERS = int(os.getenv("HMS_AUTO_REPORT_WORKERS", str(min(8, os.cpu_count() or 2))))
+
+def _auto_worker_init():
+    # العملية الابنة ورثت اتصالات المحرك من الأب عبر fork: لا نغلقها، فقط نتخلى عنها
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+def _auto_report_worker(cat_code: str) -> dict:
+    """ينفّذ في عملية منفصلة: سياق تطبيق وجلسة خاصة، ونتيجة قابلة للتسلسل."""
+    t0 = time.perf_counter()
+    with app.app_context():
+        try:
+            out_path = generate_category_report(cat_code, UPLOAD_ROOT, logo_path=_logo_path(),
+                                                created_by="AutoScheduler")
+            res = {"category": cat_code, "ok": True, "pdf": os.path.relpath(out_path, BASE_DIR)}
+        except Exception as e:
+            db.session.rollback()
+            res = {"category": cat_code, "ok": False, "error": str(e)}
+        finally:
+            db.session.remove()
+    res["seconds"] = round(time.perf_counter() - t0, 3)
+    return res
+
+def _set_config(key: str, value: str):
+    obj = ConfigSetting.query.filter_by(key=key).first()
+    if obj: obj.value = value
+    else: db.session.add(ConfigSetting(key=key, value=value))
+
 def auto_generate_selected_categories():
     with app.app_context():
-        logo_path = os.path.join(BASE_DIR, "static", "images", "logo.png")
         cats_csv = (ConfigSetting.query.filter_by(key="auto_reports_categories").first()
                     or ConfigSetting(key="auto_reports_categories", value="")).value
         cats = [c for c in cats_csv.split(",") if c in UPLOAD_DIRS and c]
-        for cat_code in cats:
-            try:
-                generate_category_report(cat_code, UPLOAD_ROOT, logo_path=logo_path, created_by="AutoScheduler")
-            except Exception as e:
-                print(f"[AutoReport] Error for {cat_code}: {e}")
-        ts = datetime.datetime.now().isoformat(timespec="seconds")
-        obj = ConfigSetting.query.filter_by(key="auto_reports_last_run").first()
-        if obj: obj.value = ts
-        else: db.session.add(ConfigSetting(key="auto_reports_last_run", value=ts))
+        db.session.remove()   # لا نمرّر اتصالًا مفتوحًا إلى العمليات الابنة
+
+        started = datetime.datetime.now()
+        t0 = time.perf_counter()
+        results = []
+        if cats:
+            workers = max(1, min(AUTO_REPORT_WORKERS, len(cats)))
+            with ProcessPoolExecutor(max_workers=workers, initializer=_auto_worker_init) as pool:
+                futures = {pool.submit(_auto_report_worker, c): c for c in cats}
+                for fut, cat_code in futures.items():
+                    try:
+                        results.append(fut.result())
+                    except Exception as e:   # عملية ماتت (BrokenProcessPool) أو خطأ تسلسل
+                        results.append({"category": cat_code, "ok": False, "error": repr(e), "seconds": None})
+        for r in results:
+            if r["ok"]:
+                print(f"[AutoReport] {r['category']}: {r['seconds']} s -> {r['pdf']}")
+            else:
+                print(f"[AutoReport] Error for {r['category']}: {r['error']}")
+
+        ts = started.isoformat(timespec="seconds")
+        summary = {
+            "started": ts,
+            "seconds": round(time.perf_counter() - t0, 3),
+            "ok": sum(1 for r in results if r["ok"]),
+            "failed": sum(1 for r in results if not r["ok"]),
+            "categories": results,
+        }
+        _set_config("auto_reports_last_run", ts)
+        _set_config("auto_reports_last_summary", json.dumps(summary, ensure_ascii=False))
         db.session.commit()
+        return summary
+
+def _lease_heartbeat():
+    """خيط خلفي: يجدّد القفل؛ القائد يستأنف المجدول ويوقظه ليقرأ تغييرات العمليات الأخرى."""
+    while True:
+        with app.app_context():
+            leader = scheduler_lease.try_acquire(SCHED_LEASE_NAME, SCHED_OWNER, SCHED_LEASE_TTL)
+            db.session.remove()
+        try:
+            if leader and not _sched_state["leader"]:
+                print(f"[Scheduler] {SCHED_OWNER} is leader, resuming jobs.")
+                scheduler.resume()
+            elif not leader and _sched_state["leader"]:
+                print(f"[Scheduler] {SCHED_OWNER} lost leadership, pausing.")
+                scheduler.pause()
+            elif leader:
+                scheduler.wakeup()
+        except Exception as e:
+            print("[Scheduler] heartbeat error:", e)
+        _sched_state["leader"] = leader
+        time.sleep(max(1.0, SCHED_LEASE_TTL / 3))
+
+def _release_lease():
+    if _sched_state["leader"]:
+        with app.app_context():
+            scheduler_lease.release(SCHED_LEASE_NAME, SCHED_OWNER)
+
+def start_scheduler():
+    """يبدأ المجدول (متوقفًا) وخيط القفل مرة واحدة لكل عملية تخدم الطلبات. آمن للاستدعاء المتكرر."""
+    if not scheduler.running:
+        scheduler.start(paused=True)
+    if _sched_state["thread"] is None:
+        t = threading.Thread(target=_lease_heartbeat, name="sched-lease", daemon=True)
+        _sched_state["thread"] = t
+        t.start()
+        atexit.register(_release_lease)
+
+def start_background_services():
+    """
+    خدمات الخلفية لعملية تخدم الطلبات: المجدول + قفل القيادة + عمّال PDF.
+    تُستدعى من app.run أدناه، ومن gunicorn (post_worker_init في gunicorn.conf.py)،
+    وعند أول طلب كاحتياط لخوادم أخرى. أوامر CLI (init-db...) لا تستدعيها.
+    """
+    start_scheduler()
+    _ensure_render_workers()   # يستأنف المهام المعلّقة من تشغيل سابق
+
+@app.before_request
+def _ensure_background_services():
+    if _sched_state["thread"] is None:
+        start_background_services()
 
 def reschedule_auto_job():
+    """
+    يكتب مهمة التوليد الآلي في المخزن حسب الإعدادات (أو يحذفها). لا يبدأ خيط القفل ولا ينفّذ مهامًا:
+    إذا لم يكن المجدول يعمل في هذه العملية (flask init-db) نكتب عبر مجدول مؤقت متوقف على نفس المخزن
+    (مجدول APScheduler أُغلق لا يمكن تشغيله مجددًا، فلا نلمس scheduler نفسه).
+    """
     enabled = (ConfigSetting.query.filter_by(key="auto_reports_enabled").first()
                or ConfigSetting(key="auto_reports_enabled", value="0")).value == "1"
     wd = int((ConfigSetting.query.filter_by(key="auto_reports_weekday").first()
@@ -532,25 +1116,77 @@ def reschedule_auto_job():
               or ConfigSetting(key="auto_reports_hour", value="7")).value)
     mi = int((ConfigSetting.query.filter_by(key="auto_reports_minute").first()
               or ConfigSetting(key="auto_reports_minute", value="0")).value)
+    sched = scheduler if scheduler.running else _new_scheduler()
+    if sched is not scheduler:
+        sched.start(paused=True)   # متوقف ⇒ لا تنفيذ ولا تعويض لتشغيل فائت في هذه العملية
     try:
-        scheduler.remove_job(job_id)
-    except Exception:
-        pass
-    if enabled:
-        scheduler.add_job(auto_generate_selected_categories, "cron",
-                          day_of_week=str(wd), hour=hr, minute=mi, id=job_id)
-        if not scheduler.running:
-            scheduler.start()
+        existing = sched.get_job(job_id)
+        if not enabled:
+            if existing:
+                sched.remove_job(job_id)
+            return
+        trigger = CronTrigger(day_of_week=str(wd), hour=hr, minute=mi)
+        # نفس الجدول ⇒ لا نستبدل المهمة، حتى لا نفقد next_run_time المحفوظ (تشغيل فائت أثناء التوقف)
+        if existing and str(existing.trigger) == str(trigger):
+            return
+        sched.add_job(AUTO_JOB_REF, trigger, id=job_id, replace_existing=True)
+    finally:
+        if sched is not scheduler:
+            sched.shutdown(wait=False)
 
 @app.cli.command("init-db")
 def init_db():
     with app.app_context():
-        db.create_all()
-        ensure_smart_reports_schema()
+        run_migrations()   # يشمل db.create_all() عند الحاجة
         seed_categories_if_needed()
+        ensure_category_stats()
         ensure_upload_dirs()
         reschedule_auto_job()
-        print("DB ready, uploads ensured, scheduler loaded.")
+        print("DB ready, uploads ensured, scheduled job stored.")
+
+@app.cli.command("db-migrate")
+def db_migrate():
+    with app.app_context():
+        applied = run_migrations()
+        print(f"Schema version {schema_version()}/{LATEST_VERSION}, applied: {applied or 'none'}.")
+
+@app.cli.command("render-worker")
+@click.option("--workers", type=int, default=None, help="Antall parallelle PDF-arbeidere.")
+def render_worker(workers):
+    """Kjører PDF-køen i forgrunnen (egen prosess ved siden av webserveren)."""
+    render_queue.start_render_workers(app, BASE_DIR, _logo_path, workers=workers)
+    print(f"Render worker running ({workers or render_queue.RENDER_WORKERS} workers). Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+@app.cli.command("search-rebuild")
+def search_rebuild():
+    with app.app_context():
+        rebuild_search_index()
+        print("Search index rebuilt.")
+
+@app.cli.command("stats-rebuild")
+def stats_rebuild():
+    with app.app_context():
+        n = rebuild_category_stats()
+        print(f"category_stats rebuilt: {n} rows.")
+
+@app.cli.command("kb-reindex")
+@click.option("--full", is_flag=True, help="Ignorer lagret indeks og bygg alt på nytt.")
+def kb_reindex(full):
+    import rag
+    st = rag.build_index(full=full)
+    print(f"KB index: +{st['added']} ~{st['changed']} -{st['removed']} ={st['unchanged']} "
+          f"({st['docs']} docs, {st['passages']} passages, {st['terms']} terms)")
+    if rag.RAG_MODE == "hybrid":
+        vs = rag.sync_vectors()
+        if vs is None:
+            print("Dense vectors: model not available, lexical only.")
+        else:
+            print(f"Dense vectors: {vs['embedded']} embedded, {vs['reused']} reused.")
 
 # ========================= MANUAL REPORTS (CRUD) =========================
 @app.route("/manual/<category>")
@@ -607,16 +1243,22 @@ def manual_delete(rec_id):
 def manual_generate(category):
     if category not in UPLOAD_DIRS: abort(404)
     logo_path = os.path.join(BASE_DIR, "static", "images", "logo.png")
-    out_path = generate_category_report(category, UPLOAD_ROOT, logo_path=logo_path, created_by="Manual")
+    period_days = _period_days(request.form.get("period_days"), request.args.get("period_days"))
+    out_path = generate_category_report(category, UPLOAD_ROOT, logo_path=logo_path, created_by="Manual",
+                                        period_days=period_days)
     rel = out_path.replace(BASE_DIR, "").lstrip("\\/")
     return jsonify({"ok": True, "file": rel})
 
 # ------------------ التشغيل ------------------
 if __name__ == "__main__":
+    # ليُحلّ المرجع النصّي "app:..." إلى هذه الوحدة نفسها بدل استيرادها مرة ثانية
+    sys.modules.setdefault("app", sys.modules[__name__])
     with app.app_context():
-        db.create_all()
-        ensure_smart_reports_schema()
+        run_migrations()   # يشمل db.create_all() عند الحاجة
         seed_categories_if_needed()
+        ensure_category_stats()
         ensure_upload_dirs()
+    start_background_services()
+    with app.app_context():
         reschedule_auto_job()
     app.run(host="0.0.0.0", port=5000, debug=False)
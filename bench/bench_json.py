@@ -0,0 +1,106 @@
+# bench/bench_json.py
+# -*- coding: utf-8 -*-
+"""
+قياس تسلسل 500 سجل (مسار قائمة /api/records) في قاعدة SQLite داخل الذاكرة:
+
+    python bench/bench_json.py [-n 500] [--repeat 200]
+
+legacy      = كائنات ORM + to_dict مع isoformat() + json القياسي (مزوّد Flask الافتراضي)
+orm+orjson  = كائنات ORM + to_dict + OrjsonProvider
+projection  = استعلام أعمدة (بدون كائنات ORM) + project_rows + OrjsonProvider
+"""
+
+import argparse
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from database import db
+from json_provider import OrjsonProvider, orjson
+from models import Category, Record, project_rows
+
+def _legacy_to_dict(r):
+    return {
+        "id": r.id, "category_id": r.category_id, "title": r.title,
+        "description": r.description, "status": r.status,
+        "created_by": r.created_by,
+        "created_at": r.created_at.isoformat() if r.created_at else None
+    }
+
+def _timeit(fn, repeat):
+    fn()   # إحماء
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.95)] * 1000
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", "--rows", type=int, default=500)
+    ap.add_argument("--repeat", type=int, default=200)
+    args = ap.parse_args()
+    if orjson is None:
+        sys.exit("orjson is not installed")
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+    db.init_app(app)
+    std, fast = DefaultJSONProvider(app), OrjsonProvider(app)
+
+    with app.app_context():
+        db.create_all()
+        cat = Category(code="deviations", name="Avvik")
+        db.session.add(cat)
+        db.session.flush()
+        base = datetime.datetime(2026, 1, 1, 7, 30)
+        db.session.add_all([
+            Record(category_id=cat.id, title=f"Avvik #{i}: vått gulv ved oppvask",
+                   description="Søl ved oppvaskmaskin, skiltet og tørket opp. " * 4,
+                   status=("open", "closed", "in_progress")[i % 3], created_by="kjøkkensjef",
+                   created_at=base + datetime.timedelta(minutes=i, microseconds=i))
+            for i in range(args.rows)
+        ])
+        db.session.commit()
+        fields = list(Record.__api_fields__)
+
+        def rows_orm():
+            db.session.expunge_all()   # هيدرة كاملة في كل تكرار كما في طلب جديد
+            return Record.query.order_by(Record.created_at.desc()).limit(args.rows).all()
+
+        def rows_proj():
+            return (db.session.query(*Record.api_columns())
+                    .order_by(Record.created_at.desc()).limit(args.rows).all())
+
+        cases = {
+            "legacy":     lambda: std.response({"records": [_legacy_to_dict(r) for r in rows_orm()]}).get_data(),
+            "orm+orjson": lambda: fast.response({"records": [r.to_dict() for r in rows_orm()]}).get_data(),
+            "projection": lambda: fast.response({"records": project_rows(rows_proj(), fields)}).get_data(),
+        }
+        # التسلسل وحده (بدون استعلام) لنفس القائمة
+        dicts = [_legacy_to_dict(r) for r in rows_orm()]
+        raw = [r.to_dict() for r in rows_orm()]
+        cases["dumps std"] = lambda: std.dumps({"records": dicts})
+        cases["dumps orjson"] = lambda: fast.dumps({"records": raw})
+
+        assert std.loads(cases["legacy"]()) == fast.loads(cases["projection"]()), "payload mismatch"
+
+        print(f"{args.rows} records, median/p95 of {args.repeat} runs")
+        base_ms = None
+        for name, fn in cases.items():
+            med, p95 = _timeit(fn, args.repeat)
+            if name == "legacy":
+                base_ms = med
+            speed = f"  x{base_ms / med:.1f}" if base_ms and not name.startswith("dumps") else ""
+            print(f"  {name:<13} {med:7.2f} ms  p95 {p95:7.2f} ms{speed}")
+
+if __name__ == "__main__":
+    main()
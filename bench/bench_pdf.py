@@ -0,0 +1,88 @@
+# bench/bench_pdf.py
+# -*- coding: utf-8 -*-
+"""
+سرعة وذاكرة smart_reporter.render_pdf لتقارير طويلة (أقسام + تدابير + جدول مخاطر):
+
+    python bench/bench_pdf.py [--pages 5,20,50] [--repeat 3] [--logo static/images/logo.png]
+
+pages/s = صفحات PDF الفعلية ÷ الوقت (وسيط التكرارات)؛ peak = ذروة ذاكرة بايثون (tracemalloc، تشغيل منفصل)
+lazy  = LazyStory (العناصر تُولَّد عند الحاجة) — المسار المستخدم في الإنتاج
+eager = نفس العناصر في قائمة كاملة قبل build() (للمقارنة فقط)
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import smart_reporter
+from smart_reporter import render_pdf
+
+WORDS = ("Søl ved oppvaskmaskin ble oppdaget under morgenrunden og området ble skiltet, "
+         "tørket opp og kontrollert av skiftleder før servering startet igjen. ").split()
+
+def _text(n_words: int, seed: int) -> str:
+    return " ".join(WORDS[(seed + i) % len(WORDS)] for i in range(n_words))
+
+def make_meta(pages: int) -> dict:
+    """Omtrent `pages` sider (≈ 0,6 side per seksjon med tilhørende tiltak og risikorader)."""
+    scale = max(1, round(pages / 0.6))
+    sections = [{"title": f"Seksjon {i + 1}",
+                 "body": "\n\n".join(_text(70, i * 3 + k) for k in range(2))} for i in range(scale)]
+    actions = [{"tiltak": _text(18, i), "ansvar": "Kjøkkensjef", "frist": "2026-11-01", "status": "open"}
+               for i in range(scale * 2)]
+    risk = [["Risiko", "Beskrivelse", "Tiltak"]] + [
+        [("Lav", "Middels", "Høy")[i % 3], _text(30, i), _text(12, i + 1)] for i in range(scale * 3)]
+    return {"id": 1, "category_code": "deviations", "title": "Avvik – langt testdokument",
+            "date": "2026-10-18", "created_by": "bench", "lang": "no", "severity": "Middels",
+            "status": "processing", "description": "", "sections": sections, "actions": actions,
+            "table_rows": risk}
+
+def _render(path: str, meta: dict, lazy: bool, logo: str | None = None) -> int:
+    if lazy:
+        return render_pdf(path, meta, logo)
+    # eager: نفس render_pdf لكن القصة كلها مبنية مسبقًا
+    orig = smart_reporter.LazyStory
+    smart_reporter.LazyStory = lambda source: list(source)
+    try:
+        return render_pdf(path, meta, logo)
+    finally:
+        smart_reporter.LazyStory = orig
+
+def run(meta: dict, lazy: bool, repeat: int, out_dir: str, logo: str | None = None) -> dict:
+    path = os.path.join(out_dir, f"bench_{'lazy' if lazy else 'eager'}.pdf")
+    times, pages = [], 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        pages = _render(path, meta, lazy, logo)
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    tracemalloc.start()
+    _render(path, meta, lazy, logo)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    med = times[len(times) // 2]
+    return {"pages": pages, "seconds": med, "pages/s": pages / med, "peak MB": peak / 1e6,
+            "size KB": os.path.getsize(path) / 1024}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pages", default="5,20,50", help="kommaseparert omtrentlig sidetall")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--logo", default=os.path.join(os.path.dirname(__file__), "..", "static", "images", "logo.png"))
+    args = ap.parse_args()
+    out_dir = tempfile.mkdtemp(prefix="hms_bench_pdf_")
+    print(f"median of {args.repeat} runs; peak = tracemalloc, separate run; font {smart_reporter.FONT}")
+    for target in (int(s) for s in args.pages.split(",") if s.strip()):
+        meta = make_meta(target)
+        for name, lazy in (("lazy", True), ("eager", False)):
+            r = run(meta, lazy, args.repeat, out_dir, args.logo)
+            print(f"  ~{target:<4} {name:<6} pages {r['pages']:4d}  {r['seconds'] * 1000:8.1f} ms"
+                  f"  {r['pages/s']:7.1f} pages/s  peak {r['peak MB']:7.2f} MB  {r['size KB']:8.1f} KB")
+
+if __name__ == "__main__":
+    main()
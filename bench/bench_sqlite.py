@@ -0,0 +1,128 @@
+# bench/bench_sqlite.py
+# -*- coding: utf-8 -*-
+"""
+قرّاء/كتّاب متزامنون على ملف SQLite مؤقت: الإعدادات الافتراضية مقابل Config.SQLITE_PRAGMAS.
+
+    python bench/bench_sqlite.py [--readers 8] [--writers 2] [--seconds 5] [--rows 5000]
+
+القارئ = استعلام صفحة اللوحة (آخر 50 سجلًا لفئة)؛ الكاتب = إدراج سجل + commit
+(مثل GeneratedReport/SmartReport أثناء توليد PDF). "locked" = أخطاء database is locked.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from config import Config
+from database import install_sqlite_pragmas
+
+SCHEMA = """
+CREATE TABLE records (id INTEGER PRIMARY KEY, category_id INTEGER NOT NULL, title TEXT NOT NULL,
+                      description TEXT, status TEXT, created_by TEXT, created_at DATETIME);
+CREATE INDEX ix_records_cat_created_id ON records (category_id, created_at, id);
+"""
+READ_SQL = text("SELECT id, title, status, created_at FROM records WHERE category_id = :c "
+                "ORDER BY created_at DESC, id DESC LIMIT 50")
+WRITE_SQL = text("INSERT INTO records (category_id, title, description, status, created_by, created_at) "
+                 "VALUES (:c, 'bench', 'skrevet under last', 'open', 'bench', datetime('now'))")
+
+def _make_engine(path: str, tuned: bool):
+    if tuned:
+        opts = dict(Config.SQLALCHEMY_ENGINE_OPTIONS)
+        engine = create_engine(f"sqlite:///{path}", **opts)
+        install_sqlite_pragmas(engine, Config.SQLITE_PRAGMAS)
+    else:
+        # الوضع السابق: إعدادات SQLAlchemy/SQLite الافتراضية (journal=DELETE، synchronous=FULL، مهلة 5 ث)
+        engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    return engine
+
+def _seed(path: str, rows: int):
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        for stmt in SCHEMA.strip().split(";"):
+            if stmt.strip():
+                conn.exec_driver_sql(stmt)
+        conn.execute(text("INSERT INTO records (category_id, title, description, status, created_by, created_at) "
+                          "VALUES (:c, :t, 'seed', 'open', 'seed', datetime('now', :age))"),
+                     [{"c": i % 8 + 1, "t": f"r{i}", "age": f"-{i} minutes"} for i in range(rows)])
+    engine.dispose()
+
+def run(tuned: bool, args) -> dict:
+    path = os.path.join(tempfile.mkdtemp(prefix="hms_bench_"), "bench.db")
+    _seed(path, args.rows)
+    engine = _make_engine(path, tuned)
+    stop = threading.Event()
+    counts = {"reads": 0, "writes": 0, "locked": 0}
+    lat = {"reads": [], "writes": []}
+    lock = threading.Lock()
+
+    def reader():
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    conn.execute(READ_SQL, {"c": random.randint(1, 8)}).fetchall()
+                kind = "reads"
+            except OperationalError:
+                kind = "locked"
+            with lock:
+                counts[kind] += 1
+                if kind == "reads":
+                    lat["reads"].append(time.perf_counter() - t0)
+
+    def writer():
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                with engine.begin() as conn:
+                    conn.execute(WRITE_SQL, {"c": random.randint(1, 8)})
+                kind = "writes"
+            except OperationalError:
+                kind = "locked"
+            with lock:
+                counts[kind] += 1
+                if kind == "writes":
+                    lat["writes"].append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=reader) for _ in range(args.readers)]
+    threads += [threading.Thread(target=writer) for _ in range(args.writers)]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    engine.dispose()
+
+    def p95(xs):
+        xs = sorted(xs)
+        return xs[int(len(xs) * 0.95)] * 1000 if xs else float("nan")
+    return {
+        "reads/s": counts["reads"] / args.seconds, "writes/s": counts["writes"] / args.seconds,
+        "locked": counts["locked"], "read p95 ms": p95(lat["reads"]), "write p95 ms": p95(lat["writes"]),
+    }
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--readers", type=int, default=8)
+    ap.add_argument("--writers", type=int, default=2)
+    ap.add_argument("--seconds", type=float, default=5)
+    ap.add_argument("--rows", type=int, default=5000)
+    args = ap.parse_args()
+    print(f"{args.readers} readers, {args.writers} writers, {args.seconds:g} s, {args.rows} seed rows")
+    for name, tuned in (("default", False), ("tuned", True)):
+        r = run(tuned, args)
+        print(f"  {name:<8} reads/s {r['reads/s']:8.0f}  writes/s {r['writes/s']:6.0f}  locked {r['locked']:4d}"
+              f"  read p95 {r['read p95 ms']:6.2f} ms  write p95 {r['write p95 ms']:6.2f} ms")
+
+if __name__ == "__main__":
+    main()
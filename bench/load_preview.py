@@ -0,0 +1,55 @@
+# bench/load_preview.py
+# -*- coding: utf-8 -*-
+"""
+مولّد حمل بسيط لـ /smart_report/preview (أو أي مسار POST بنموذج).
+
+    HMS_LLM_BACKEND=stub python app.py            # أو مع llm_stub_server.py
+    python bench/load_preview.py --url http://127.0.0.1:5000 -n 2000 -c 64
+
+--unique يجعل كل طلب مختلفًا (يتجاوز كاش الردود) لقياس المسار الكامل.
+"""
+
+import argparse
+import statistics
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://127.0.0.1:5000")
+    ap.add_argument("--path", default="/smart_report/preview")
+    ap.add_argument("-n", "--requests", type=int, default=1000)
+    ap.add_argument("-c", "--concurrency", type=int, default=32)
+    ap.add_argument("--category", default="deviations")
+    ap.add_argument("--unique", action="store_true")
+    args = ap.parse_args()
+
+    def one(i: int):
+        form = {"category": args.category, "reporter": "load", "location": "Kjøkken",
+                "incident_type": "Vått gulv", "details": f"Søl ved oppvask #{i}" if args.unique else "Søl ved oppvask"}
+        data = urllib.parse.urlencode(form).encode("utf-8")
+        t0 = time.perf_counter()
+        try:
+            with urllib.request.urlopen(args.url + args.path, data=data, timeout=60) as r:
+                r.read()
+                ok = 200 <= r.status < 300
+        except Exception:
+            ok = False
+        return ok, time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - t0
+
+    lat = sorted(d for _, d in results)
+    errors = sum(1 for ok, _ in results if not ok)
+    p = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] * 1000
+    print(f"{args.requests} requests, concurrency {args.concurrency}, {elapsed:.2f} s")
+    print(f"throughput: {args.requests / elapsed:.1f} req/s, errors: {errors}")
+    print(f"latency ms: mean {statistics.mean(lat) * 1000:.1f}  p50 {p(0.50):.1f}  p95 {p(0.95):.1f}  p99 {p(0.99):.1f}")
+
+if __name__ == "__main__":
+    main()
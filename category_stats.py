@@ -0,0 +1,149 @@
+# category_stats.py
+# -*- coding: utf-8 -*-
+"""
+عدّادات الحالة لكل فئة (جدول category_stats) بدل COUNT على الجداول الكبيرة:
+- تُحدَّث داخل نفس المعاملة عند إضافة/تعديل/حذف Record أو SmartReport (حدث after_flush)
+- rebuild_category_stats() يعيد الحساب من الصفر لإصلاح أي انحراف
+  (مثلاً بعد Query.delete()/update() الجماعية أو SQL مباشر، لأنها لا تمر بالجلسة)
+- في نفس الحدث نزيد category_versions لكل فئة تغيّر فيها أي صف (ETag في app.py)
+"""
+
+import time
+from collections import Counter
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import db
+from models import Category, CategoryStat, CategoryVersion, Record, SmartReport
+
+_cat_codes = {}   # category_id → code (الفئات نادرًا ما تتغير)
+
+def _category_code(session, category_id):
+    if category_id is None:
+        return None
+    code = _cat_codes.get(category_id)
+    if code is None:
+        # عبر الاتصال مباشرة حتى لا نطلق autoflush داخل flush
+        code = session.connection().execute(
+            select(Category.code).where(Category.id == category_id)).scalar()
+        if code is not None:
+            _cat_codes[category_id] = code
+    return code
+
+def _old(obj, attr):
+    # يعتمد على active_history في models.py: بدونه صفة منتهية (بعد commit) لا تحفظ قيمتها القديمة
+    # فيصبح deleted فارغًا ونرجّع القيمة الجديدة (before == after ⇒ لا تحديث للعدّاد)
+    hist = inspect(obj).attrs[attr].history
+    if hist.deleted:
+        return hist.deleted[0]
+    return getattr(obj, attr)
+
+def _key(session, obj, old: bool = False):
+    get = (lambda a: _old(obj, a)) if old else (lambda a: getattr(obj, a))
+    if isinstance(obj, Record):
+        return (_category_code(session, get("category_id")), "manual", get("status") or "open")
+    return (get("category_code"), "smart", get("status") or "open")
+
+def _bump_versions(session, codes):
+    table = CategoryVersion.__table__
+    now = time.time()
+    stmt = sqlite_insert(table).values([{"category_code": c, "version": 1, "updated_at": now} for c in sorted(codes)])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.category_code],
+        set_={"version": table.c.version + 1, "updated_at": stmt.excluded.updated_at},
+    )
+    session.connection().execute(stmt)
+
+def _after_flush(session, flush_context):
+    deltas = Counter()
+    touched = set()
+    for obj in session.new:
+        if isinstance(obj, (Record, SmartReport)):
+            key = _key(session, obj)
+            deltas[key] += 1
+            touched.add(key[0])
+    for obj in session.deleted:
+        if isinstance(obj, (Record, SmartReport)):
+            key = _key(session, obj, old=True)
+            deltas[key] -= 1
+            touched.add(key[0])
+    for obj in session.dirty:
+        if isinstance(obj, (Record, SmartReport)) and session.is_modified(obj):
+            before, after = _key(session, obj, old=True), _key(session, obj)
+            touched.update((before[0], after[0]))
+            if before != after:
+                deltas[before] -= 1
+                deltas[after] += 1
+    touched.discard(None)
+    if touched:
+        _bump_versions(session, touched)
+    rows = [{"category_code": c, "source": src, "status": st, "count": n}
+            for (c, src, st), n in deltas.items() if n and c]
+    if not rows:
+        return
+    table = CategoryStat.__table__
+    stmt = sqlite_insert(table).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.category_code, table.c.source, table.c.status],
+        set_={"count": table.c.count + stmt.excluded.count},
+    )
+    session.connection().execute(stmt)
+
+def register_stats_listeners():
+    if not event.contains(db.session, "after_flush", _after_flush):
+        event.listen(db.session, "after_flush", _after_flush)
+
+def rebuild_category_stats() -> int:
+    """يعيد بناء category_stats من الجداول الأصلية ويرجّع عدد الصفوف."""
+    manual = (db.session.query(Category.code, Record.status, func.count(Record.id))
+              .join(Category, Category.id == Record.category_id)
+              .group_by(Category.code, Record.status).all())
+    smart = (db.session.query(SmartReport.category_code, SmartReport.status, func.count(SmartReport.id))
+             .group_by(SmartReport.category_code, SmartReport.status).all())
+    db.session.query(CategoryStat).delete()
+    rows = [CategoryStat(category_code=c, source="manual", status=st or "open", count=n) for c, st, n in manual]
+    rows += [CategoryStat(category_code=c, source="smart", status=st or "open", count=n) for c, st, n in smart]
+    db.session.add_all(rows)
+    # التعديلات الجماعية لم تزد الإصدارات: نبطل كل ETag المخزّنة عند العملاء
+    codes = {c.code for c in Category.query.all()} | {r.category_code for r in rows}
+    if codes:
+        _bump_versions(db.session, codes)
+    db.session.commit()
+    return len(rows)
+
+def ensure_category_stats():
+    """أول تشغيل بعد إضافة الجدول: نملؤه من البيانات الموجودة."""
+    if db.session.query(CategoryStat.category_code).first() is None and \
+       (db.session.query(Record.id).first() is not None or db.session.query(SmartReport.id).first() is not None):
+        rebuild_category_stats()
+
+def category_counts(category_code: str | None = None) -> dict:
+    """
+    {"manual": {status: n}, "smart": {status: n}} لفئة واحدة،
+    أو لكل الفئات مجمّعة إن لم تُحدَّد فئة.
+    """
+    q = db.session.query(CategoryStat.source, CategoryStat.status, func.sum(CategoryStat.count))
+    if category_code:
+        q = q.filter(CategoryStat.category_code == category_code)
+    out = {"manual": {}, "smart": {}}
+    for src, st, n in q.group_by(CategoryStat.source, CategoryStat.status).all():
+        out.setdefault(src, {})[st] = int(n or 0)
+    return out
+
+def category_version(category_code: str | None = None) -> tuple:
+    """(version, updated_at) لفئة واحدة، أو مجموع الإصدارات/آخر تحديث لكل الفئات."""
+    q = db.session.query(func.coalesce(func.sum(CategoryVersion.version), 0),
+                         func.coalesce(func.max(CategoryVersion.updated_at), 0.0))
+    if category_code:
+        q = q.filter(CategoryVersion.category_code == category_code)
+    version, updated = q.one()
+    return int(version), float(updated)
+
+def totals_by_category() -> dict:
+    """{code: {"manual": n, "smart": n}}"""
+    out = {}
+    for code, src, n in (db.session.query(CategoryStat.category_code, CategoryStat.source, func.sum(CategoryStat.count))
+                         .group_by(CategoryStat.category_code, CategoryStat.source).all()):
+        out.setdefault(code, {"manual": 0, "smart": 0})[src] = int(n or 0)
+    return out
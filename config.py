@@ -6,3 +6,21 @@ class Config:
     SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(BASE_DIR, "hms_smart.db")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     LANG_DIR = os.path.join(BASE_DIR, "langs")
+
+    # SQLite: تُطبّق على كل اتصال جديد (database.install_sqlite_pragmas)
+    # WAL ⇒ القرّاء لا ينتظرون الكاتب (توليد PDF/المجدول) والعكس
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("HMS_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_PRAGMAS = {
+        "journal_mode": os.getenv("HMS_SQLITE_JOURNAL_MODE", "WAL"),
+        "synchronous":  os.getenv("HMS_SQLITE_SYNCHRONOUS", "NORMAL"),
+        "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+        "cache_size":   int(os.getenv("HMS_SQLITE_CACHE_KB", "-65536")),      # سالب = KiB (64 MiB)
+        "mmap_size":    int(os.getenv("HMS_SQLITE_MMAP_BYTES", str(256 * 1024 * 1024))),
+        "temp_store":   "MEMORY",
+    }
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size":     int(os.getenv("HMS_DB_POOL_SIZE", "10")),
+        "max_overflow":  int(os.getenv("HMS_DB_MAX_OVERFLOW", "10")),
+        "pool_timeout":  int(os.getenv("HMS_DB_POOL_TIMEOUT", "30")),
+        "connect_args":  {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000.0, "check_same_thread": False},
+    }
@@ -1,2 +1,38 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+
 db = SQLAlchemy()
+
+def install_sqlite_pragmas(engine, pragmas: dict) -> None:
+    """يطبّق PRAGMA على كل اتصال SQLite جديد في مجمّع هذا المحرك (لا شيء لغير SQLite)."""
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+
+    # busy_timeout أولًا حتى تنتظر بقية الأوامر بدل الفشل الفوري
+    ordered = sorted(pragmas.items(), key=lambda kv: kv[0] != "busy_timeout")
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        try:
+            for name, value in ordered:
+                if name == "journal_mode":
+                    # WAL دائم في ملف القاعدة: لا نعيد التبديل (يحتاج قفلًا حصريًا) إن كان مفعّلًا
+                    if str(cur.execute("PRAGMA journal_mode").fetchone()[0]).lower() == str(value).lower():
+                        continue
+                    try:
+                        cur.execute(f"PRAGMA journal_mode={value}")
+                    except Exception as e:   # عملية أخرى تمسك القفل؛ نكمل بالوضع الحالي
+                        print(f"[DB] journal_mode={value} not applied: {e}")
+                    continue
+                cur.execute(f"PRAGMA {name}={value}")
+        finally:
+            cur.close()
+
+def sqlite_settings(engine) -> dict:
+    """القيم الفعلية على اتصال من المجمّع (للتحقق/التصحيح)."""
+    if engine.dialect.name != "sqlite":
+        return {}
+    names = ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size", "temp_store")
+    with engine.connect() as conn:
+        return {n: conn.exec_driver_sql(f"PRAGMA {n}").scalar() for n in names}
@@ -0,0 +1,20 @@
+# gunicorn.conf.py
+# -*- coding: utf-8 -*-
+# يقرأه gunicorn تلقائيًا من مجلد التشغيل:  gunicorn app:app
+# كل عملية عاملة تبدأ المجدول (يعمل فقط في حامل القفل) وعمّال PDF بعد تحميل التطبيق.
+#
+# عمّال gthread وليس sync: المعاينة الحيّة تُبقي طلبًا مفتوحًا طوال استدعاء النموذج
+# (SSE على /smart_report/jobs/<id>/events أو long-poll بـ wait=20)؛ مع sync كل معاينة
+# مفتوحة تحجز عملية كاملة، فأربع معاينات توقف الخادم. مع gthread تحجز خيطًا واحدًا فقط
+# ⇒ السعة = workers × threads طلبًا متزامنًا (الافتراضي 4 × 16).
+
+import os
+
+bind = os.getenv("HMS_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("HMS_WEB_WORKERS", "4"))
+worker_class = "gthread"
+threads = int(os.getenv("HMS_WEB_THREADS", "16"))
+
+def post_worker_init(worker):
+    from app import start_background_services
+    start_background_services()
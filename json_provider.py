@@ -0,0 +1,65 @@
+# json_provider.py
+# -*- coding: utf-8 -*-
+"""
+مزوّد JSON لـ Flask مبني على orjson (أسرع بعدة مرات من json القياسي):
+- datetime/date/uuid/dataclass تُسلسل داخليًا (ISO 8601) بدون isoformat() لكل صف
+- مفاتيح غير نصية مسموحة (مثل {category_id: n})
+- إن لم يكن orjson مثبتًا: مزوّد Flask القياسي مع نفس الصيغة للتواريخ (ISO 8601 بدل RFC 822)
+  ⇒ شكل الـ API لا يعتمد على تثبيت orjson
+"""
+
+import datetime
+import decimal
+
+try:
+    import orjson
+except ImportError:   # اختياري
+    orjson = None
+
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if orjson else 0
+
+def _default(o):
+    if isinstance(o, decimal.Decimal):
+        return str(o)
+    if isinstance(o, (set, frozenset)):
+        return list(o)
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+class IsoJSONProvider(DefaultJSONProvider):
+    """الاحتياطي بدون orjson: json القياسي، والتواريخ والأنواع الإضافية كما يُخرجها OrjsonProvider."""
+    ensure_ascii = False
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, (datetime.date, datetime.time)):   # datetime يرث date
+            return o.isoformat()
+        if isinstance(o, (set, frozenset)):
+            return list(o)
+        return DefaultJSONProvider.default(o)
+
+class OrjsonProvider(JSONProvider):
+    mimetype = "application/json"
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        # bytes مباشرة: بدون decode/encode إضافي
+        return self._app.response_class(orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS),
+                                        mimetype=self.mimetype)
+
+def install_json_provider(app) -> bool:
+    """يركّب OrjsonProvider على app إن توفر orjson (True)، وإلا IsoJSONProvider (False)."""
+    if orjson is None:
+        app.json = IsoJSONProvider(app)
+        return False
+    app.json = OrjsonProvider(app)
+    return True
@@ -0,0 +1,119 @@
+# llm_cache.py
+# -*- coding: utf-8 -*-
+"""
+كاش ردود نموذج اللغة (content-addressed) داخل SQLite:
+- المفتاح = sha256(model, temperature, system prompt, user prompt بعد توحيد المسافات)
+- صلاحية (TTL) بالثواني، وحد أقصى لعدد المدخلات مع إخلاء الأقدم استخدامًا (LRU)
+- عدّادات hit/miss للعرض في /_debug/ai_cache
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+BASE_DIR = os.path.dirname(__file__)
+
+CACHE_PATH        = os.getenv("HMS_LLM_CACHE_DB", os.path.join(BASE_DIR, "llm_cache.db"))
+CACHE_TTL         = int(os.getenv("HMS_LLM_CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("HMS_LLM_CACHE_MAX", "2000"))
+
+def _normalize(text: str) -> str:
+    return " ".join((text or "").split())
+
+class ResponseCache:
+    def __init__(self, path: str, ttl: int, max_entries: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = ttl > 0 and max_entries > 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self.counters = {"hits": 0, "misses": 0, "expired": 0, "stores": 0, "evictions": 0, "errors": 0}
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("""CREATE TABLE IF NOT EXISTS llm_cache (
+                                key        TEXT PRIMARY KEY,
+                                value      TEXT NOT NULL,
+                                created_at REAL NOT NULL,
+                                last_used  REAL NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_used ON llm_cache(last_used)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def make_key(model: str, temperature: float, system: str, user: str) -> str:
+        payload = json.dumps([model, round(float(temperature), 4), _normalize(system), _normalize(user)],
+                             ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            try:
+                db = self._db()
+                row = db.execute("SELECT value, created_at FROM llm_cache WHERE key=?", (key,)).fetchone()
+                if row is None:
+                    self.counters["misses"] += 1
+                    return None
+                value, created_at = row
+                if now - created_at > self.ttl:
+                    db.execute("DELETE FROM llm_cache WHERE key=?", (key,))
+                    db.commit()
+                    self.counters["expired"] += 1
+                    self.counters["misses"] += 1
+                    return None
+                db.execute("UPDATE llm_cache SET last_used=? WHERE key=?", (now, key))
+                db.commit()
+                self.counters["hits"] += 1
+                return value
+            except Exception as e:
+                self.counters["errors"] += 1
+                print(f"[LLMCache] get failed: {e}")
+                return None
+
+    def put(self, key: str, value: str) -> None:
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            try:
+                db = self._db()
+                db.execute("INSERT OR REPLACE INTO llm_cache(key, value, created_at, last_used) VALUES (?,?,?,?)",
+                           (key, value, now, now))
+                self.counters["stores"] += 1
+                # إخلاء: المنتهية أولًا ثم الأقدم استخدامًا فوق الحد الأقصى
+                cur = db.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+                evicted = cur.rowcount
+                (count,) = db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+                if count > self.max_entries:
+                    cur = db.execute("""DELETE FROM llm_cache WHERE key IN (
+                                            SELECT key FROM llm_cache ORDER BY last_used ASC LIMIT ?)""",
+                                     (count - self.max_entries,))
+                    evicted += cur.rowcount
+                self.counters["evictions"] += max(evicted, 0)
+                db.commit()
+            except Exception as e:
+                self.counters["errors"] += 1
+                print(f"[LLMCache] put failed: {e}")
+
+    def stats(self) -> dict:
+        out = dict(self.counters)
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = round(out["hits"] / lookups, 4) if lookups else 0.0
+        out.update(enabled=self.enabled, ttl=self.ttl, max_entries=self.max_entries)
+        try:
+            with self._lock:
+                out["entries"] = self._db().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] if self.enabled else 0
+        except Exception:
+            out["entries"] = None
+        return out
+
+cache = ResponseCache(CACHE_PATH, CACHE_TTL, CACHE_MAX_ENTRIES)
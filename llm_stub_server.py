@@ -0,0 +1,106 @@
+# llm_stub_server.py
+# -*- coding: utf-8 -*-
+"""
+خادم محلي متوافق مع OpenAI (/v1/chat/completions) يرجّع ردود StubBackend.
+لاختبار الحمل بدون شبكة مع المسار الكامل (httpx + openai + JSON parsing):
+
+    python llm_stub_server.py --port 8089 [--latency-ms 0]
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub python app.py
+"""
+
+import argparse
+import json
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from smart_ai import StubBackend
+
+backend = StubBackend()
+
+def _messages(body: dict):
+    system = user = ""
+    for m in body.get("messages") or []:
+        if m.get("role") == "system":
+            system = m.get("content") or ""
+        elif m.get("role") == "user":
+            user = m.get("content") or ""
+    return system, user
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive مثل الـ API الحقيقي
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _json(self, code: int, payload: dict):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            return self._json(200, {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "local"}]})
+        self._json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._json(404, {"error": {"message": "not found"}})
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        system, user = _messages(body)
+        model = body.get("model") or "stub"
+        temperature = body.get("temperature", 0)
+        cid = "chatcmpl-" + uuid.uuid4().hex[:24]
+        created = int(time.time())
+
+        if not body.get("stream"):
+            content = backend.complete(model=model, temperature=temperature, system=system, user=user)
+            return self._json(200, {
+                "id": cid, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": len(user) // 4, "completion_tokens": len(content) // 4,
+                          "total_tokens": (len(user) + len(content)) // 4},
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def send(delta: dict, finish=None):
+            chunk = {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        send({"role": "assistant", "content": ""})
+        for piece in backend.stream(model=model, temperature=temperature, system=system, user=user):
+            send({"content": piece})
+        send({}, finish="stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+def main():
+    ap = argparse.ArgumentParser(description="OpenAI-compatible stub LLM server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency-ms", type=float, default=None, help="Simulert modell-latens per kall")
+    args = ap.parse_args()
+    if args.latency_ms is not None:
+        backend.latency = args.latency_ms / 1000.0
+    srv = ThreadingHTTPServer((args.host, args.port), Handler)
+    srv.daemon_threads = True
+    print(f"Stub LLM on http://{args.host}:{args.port}/v1 (latency {backend.latency * 1000:.0f} ms)")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
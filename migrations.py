@@ -0,0 +1,121 @@
+# migrations.py
+# -*- coding: utf-8 -*-
+"""
+ترحيلات مخطط قاعدة البيانات بأرقام إصدار (PRAGMA user_version):
+- عند الإقلاع: قراءة واحدة لـ user_version؛ لا شيء آخر إذا كانت القاعدة محدّثة
+- غير ذلك: داخل معاملة واحدة BEGIN IMMEDIATE (عمليات gunicorn التي تقلع معًا تنتظر بعضها)
+  db.create_all() ثم الترحيلات الناقصة بالترتيب، ثم رفع user_version
+- ترحيل جديد = دالة جديدة في آخر MIGRATIONS (لا نعدّل ترحيلًا منشورًا)؛
+  جدول جديد في models.py يحتاج ترحيلًا أيضًا حتى تنشئه القواعد المحدّثة
+"""
+
+from database import db
+
+def _columns(conn, table: str) -> set:
+    return {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})").fetchall()}
+
+def _add_column(conn, table: str, col: str, col_def: str):
+    if col not in _columns(conn, table):
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {col_def}")
+
+# ---------- الترحيلات ----------
+def _m001_smart_report_columns(conn):
+    """أعمدة أُضيفت لـ smart_reports بعد الإصدار الأول (كانت في ensure_smart_reports_schema)."""
+    _add_column(conn, "smart_reports", "status",    "status VARCHAR(20) DEFAULT 'open'")
+    _add_column(conn, "smart_reports", "pdf_path",  "pdf_path TEXT")
+    _add_column(conn, "smart_reports", "html_path", "html_path TEXT")
+
+def _m002_records_keyset_index(conn):
+    """ترقيم /api/records بالمؤشّر وآخر السجلات في report_generator."""
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_records_cat_created_id ON records (category_id, created_at, id)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_smart_reports_cat_date ON smart_reports (category_code, created_at)")
+
+def _m003_status_and_fk_indexes(conn):
+    """فلاتر الحالة (category_stats rebuild، ?status=) ومرفقات السجل."""
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_records_cat_status ON records (category_id, status)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_records_status_created ON records (status, created_at)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_smart_reports_cat_status ON smart_reports (category_code, status)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_record_attachments_record ON record_attachments (record_id)")
+
+_FTS_SOURCES = (("records", "records_fts"), ("smart_reports", "smart_reports_fts"))
+
+def _m004_fulltext_search(conn):
+    """FTS5 (external content) على title/description + triggers للمزامنة — انظر search.py."""
+    for table, fts in _FTS_SOURCES:
+        conn.exec_driver_sql(f"""CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                                   title, description, content='{table}', content_rowid='id',
+                                   tokenize='unicode61 remove_diacritics 2', prefix='2 3')""")
+        conn.exec_driver_sql(f"""CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+                                   INSERT INTO {fts}(rowid, title, description)
+                                   VALUES (new.id, new.title, new.description);
+                                 END""")
+        conn.exec_driver_sql(f"""CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+                                   INSERT INTO {fts}({fts}, rowid, title, description)
+                                   VALUES ('delete', old.id, old.title, old.description);
+                                 END""")
+        conn.exec_driver_sql(f"""CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF title, description ON {table} BEGIN
+                                   INSERT INTO {fts}({fts}, rowid, title, description)
+                                   VALUES ('delete', old.id, old.title, old.description);
+                                   INSERT INTO {fts}(rowid, title, description)
+                                   VALUES (new.id, new.title, new.description);
+                                 END""")
+        conn.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")   # الصفوف الموجودة
+
+def _m005_render_jobs(conn):
+    """طابور PDF في الخلفية (render_queue.py)."""
+    from models import RenderJob
+    RenderJob.__table__.create(conn, checkfirst=True)
+
+def _m006_pdf_content_hash(conn):
+    """بصمة مدخلات PDF لإعادة استخدام ملف لم يتغيّر محتواه (pdf_cache.py)."""
+    _add_column(conn, "generated_reports", "content_hash", "content_hash VARCHAR(64)")
+    _add_column(conn, "render_jobs", "content_hash", "content_hash VARCHAR(64)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_generated_reports_cat_hash "
+                         "ON generated_reports (category_code, content_hash)")
+
+def _m007_preview_jobs(conn):
+    """مهام المعاينة الحيّة في القاعدة بدل ذاكرة العملية (preview_jobs.py)."""
+    from models import PreviewEvent, PreviewJob
+    PreviewJob.__table__.create(conn, checkfirst=True)
+    PreviewEvent.__table__.create(conn, checkfirst=True)
+
+MIGRATIONS = [
+    (1, _m001_smart_report_columns),
+    (2, _m002_records_keyset_index),
+    (3, _m003_status_and_fk_indexes),
+    (4, _m004_fulltext_search),
+    (5, _m005_render_jobs),
+    (6, _m006_pdf_content_hash),
+    (7, _m007_preview_jobs),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def schema_version() -> int:
+    with db.engine.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+def run_migrations() -> list:
+    """ينشئ الجداول ويطبّق الترحيلات الناقصة؛ يرجّع أرقام ما طُبّق (فارغة إن كانت محدّثة)."""
+    if schema_version() >= LATEST_VERSION:
+        return []
+    applied = []
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            # إعادة القراءة داخل القفل: ربما أنهتها عملية أخرى للتو
+            current = conn.exec_driver_sql("PRAGMA user_version").scalar()
+            if current < LATEST_VERSION:
+                db.metadata.create_all(bind=conn)
+                for version, fn in MIGRATIONS:
+                    if version > current:
+                        fn(conn)
+                        applied.append(version)
+                conn.exec_driver_sql(f"PRAGMA user_version = {int(LATEST_VERSION)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    for version, fn in MIGRATIONS:
+        if version in applied:
+            print(f"[Schema] Applied migration {version:03d} {fn.__name__[6:]}.")
+    return applied
@@ -3,10 +3,32 @@
 from datetime import datetime
 from database import db
 
+# =========================
+# Serializers (إسقاط أعمدة بدل to_dict مكتوب يدويًا لكل نموذج)
+# =========================
+class ApiSerializable:
+    """
+    __api_fields__ = أسماء الأعمدة المكشوفة في الـ API.
+    التواريخ تبقى datetime ويُسلسلها مزوّد JSON (json_provider.py) بصيغة ISO 8601، مع orjson أو بدونه.
+    لقوائم كبيرة استخدم api_columns()/project_rows() بدل تحميل كائنات ORM.
+    """
+    __api_fields__ = ()
+
+    def to_dict(self):
+        return {f: getattr(self, f) for f in self.__api_fields__}
+
+    @classmethod
+    def api_columns(cls, fields=None):
+        return [getattr(cls, f) for f in (fields or cls.__api_fields__)]
+
+def project_rows(rows, fields) -> list:
+    """صفوف استعلام أعمدة (tuples) ⇒ قائمة dict بنفس ترتيب fields."""
+    return [dict(zip(fields, row)) for row in rows]
+
 # =========================
 # Users
 # =========================
-class User(db.Model):
+class User(ApiSerializable, db.Model):
     __tablename__ = "users"
     id            = db.Column(db.Integer, primary_key=True)
     username      = db.Column(db.String(80), unique=True, nullable=False)
@@ -14,51 +36,48 @@ class User(db.Model):
     role          = db.Column(db.String(50), default="admin")
     created_at    = db.Column(db.DateTime, default=datetime.utcnow)
 
-    def to_dict(self):
-        return {
-            "id": self.id, "username": self.username, "role": self.role,
-            "created_at": self.created_at.isoformat() if self.created_at else None
-        }
+    __api_fields__ = ("id", "username", "role", "created_at")
 
 # =========================
 # Categories
 # =========================
-class Category(db.Model):
+class Category(ApiSerializable, db.Model):
     __tablename__ = "categories"
     id   = db.Column(db.Integer, primary_key=True)
     code = db.Column(db.String(50), unique=True, nullable=False)   # workers, deviations, ...
     name = db.Column(db.String(120), nullable=False)
 
-    def to_dict(self):
-        return {"id": self.id, "code": self.code, "name": self.name}
+    __api_fields__ = ("id", "code", "name")
 
 # =========================
 # Records (generic entries per category)
 # =========================
-class Record(db.Model):
+class Record(ApiSerializable, db.Model):
     __tablename__ = "records"
     id          = db.Column(db.Integer, primary_key=True)
-    category_id = db.Column(db.Integer, db.ForeignKey("categories.id"), nullable=False)
+    # active_history: القيمة القديمة تُحمَّل قبل التعديل حتى لو كانت منتهية (بعد commit) ⇒ عدّادات category_stats صحيحة
+    category_id = db.mapped_column(db.Integer, db.ForeignKey("categories.id"), nullable=False, active_history=True)
     title       = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text, nullable=True)
-    status      = db.Column(db.String(20), nullable=False, default="open")  # open/closed
+    status      = db.mapped_column(db.String(20), nullable=False, default="open", active_history=True)  # open/closed
     created_by  = db.Column(db.String(100), default="admin")
     created_at  = db.Column(db.DateTime, default=datetime.utcnow)
 
     category = db.relationship("Category", backref=db.backref("records", lazy=True))
 
-    def to_dict(self):
-        return {
-            "id": self.id, "category_id": self.category_id, "title": self.title,
-            "description": self.description, "status": self.status,
-            "created_by": self.created_by,
-            "created_at": self.created_at.isoformat() if self.created_at else None
-        }
+    # الفهارس نفسها تُضاف للقواعد القديمة في migrations.py
+    # ix_records_cat_created_id يخدم ترقيم /api/records بالمؤشّر: WHERE category_id=? AND (created_at,id) < (?,?)
+    __table_args__ = (
+        db.Index("ix_records_cat_created_id", "category_id", "created_at", "id"),
+        db.Index("ix_records_cat_status", "category_id", "status"),
+        db.Index("ix_records_status_created", "status", "created_at"),
+    )
+    __api_fields__ = ("id", "category_id", "title", "description", "status", "created_by", "created_at")
 
 # =========================
 # Record Attachments
 # =========================
-class RecordAttachment(db.Model):
+class RecordAttachment(ApiSerializable, db.Model):
     __tablename__ = "record_attachments"
     id           = db.Column(db.Integer, primary_key=True)
     record_id    = db.Column(db.Integer, db.ForeignKey("records.id"), nullable=False)
@@ -69,57 +88,52 @@ class RecordAttachment(db.Model):
 
     record = db.relationship("Record", backref=db.backref("attachments", lazy=True))
 
-    def to_dict(self):
-        return {
-            "id": self.id, "record_id": self.record_id,
-            "filename": self.filename, "original_name": self.original_name,
-            "content_type": self.content_type,
-            "created_at": self.created_at.isoformat() if self.created_at else None
-        }
+    __table_args__ = (db.Index("ix_record_attachments_record", "record_id"),)
+
+    __api_fields__ = ("id", "record_id", "filename", "original_name", "content_type", "created_at")
 
 # =========================
 # Config Settings (key-value)
 # =========================
-class ConfigSetting(db.Model):
+class ConfigSetting(ApiSerializable, db.Model):
     __tablename__ = "config_settings"
     key   = db.Column(db.String(120), primary_key=True)
     value = db.Column(db.Text, nullable=True)
 
-    def to_dict(self):
-        return {"key": self.key, "value": self.value}
+    __api_fields__ = ("key", "value")
 
 # =========================
 # GeneratedReport (التقارير اليدوية/الآلية القديمة)
 # =========================
-class GeneratedReport(db.Model):
+class GeneratedReport(ApiSerializable, db.Model):
     __tablename__ = "generated_reports"
     id            = db.Column(db.Integer, primary_key=True)
     category_code = db.Column(db.String(50), nullable=False)
     file_path     = db.Column(db.String(1024), nullable=False)
     created_by    = db.Column(db.String(100), default="admin")
     created_at    = db.Column(db.DateTime, default=datetime.utcnow)
+    content_hash  = db.Column(db.String(64), nullable=True)   # pdf_cache.content_hash لمدخلات الرسم
 
-    def to_dict(self):
-        return {
-            "id": self.id, "category_code": self.category_code,
-            "file_path": self.file_path, "created_by": self.created_by,
-            "created_at": self.created_at.isoformat() if self.created_at else None
-        }
+    __table_args__ = (
+        db.Index("ix_generated_reports_cat_hash", "category_code", "content_hash"),
+    )
+    __api_fields__ = ("id", "category_code", "file_path", "created_by", "created_at", "content_hash")
 
 # =========================
 # SmartReport (التقارير الذكية الجديدة)
 # =========================
 import json
 
-class SmartReport(db.Model):
+class SmartReport(ApiSerializable, db.Model):
     __tablename__ = "smart_reports"
     id            = db.Column(db.Integer, primary_key=True)
-    category_code = db.Column(db.String(50), nullable=False)                 # workers / deviations / ...
+    # active_history: انظر Record (category_stats تحتاج القيمة القديمة)
+    category_code = db.mapped_column(db.String(50), nullable=False, active_history=True)  # workers / deviations / ...
     title         = db.Column(db.String(255), nullable=False)                # NO
     description   = db.Column(db.Text, nullable=True)                        # NO (النص النهائي)
     actions       = db.Column(db.Text, nullable=True)                        # احتياطي
     severity      = db.Column(db.String(20), nullable=False, default="Lav")  # Lav/Middels/Høy
-    status        = db.Column(db.String(20), nullable=False, default="open") # open/processing/closed
+    status        = db.mapped_column(db.String(20), nullable=False, default="open", active_history=True)  # open/processing/closed
     tags_json     = db.Column(db.Text, nullable=True)                        # JSON list
     suggestions_json = db.Column(db.Text, nullable=True)                     # JSON list
     lang          = db.Column(db.String(5), nullable=False, default="no")    # ثابت نو
@@ -130,7 +144,10 @@ class SmartReport(db.Model):
 
     __table_args__ = (
         db.Index("ix_smart_reports_cat_date", "category_code", "created_at"),
+        db.Index("ix_smart_reports_cat_status", "category_code", "status"),
     )
+    __api_fields__ = ("id", "category_code", "title", "description", "actions", "severity", "status",
+                      "lang", "created_by", "created_at", "pdf_path", "html_path")
 
     def to_dict(self):
         def _json_load(x):
@@ -138,22 +155,92 @@ class SmartReport(db.Model):
                 return json.loads(x) if x else []
             except Exception:
                 return []
-        return {
-            "id": self.id,
-            "category_code": self.category_code,
-            "title": self.title,
-            "description": self.description,
-            "actions": self.actions,
-            "severity": self.severity,
-            "status": self.status,
-            "tags": _json_load(self.tags_json),
-            "suggestions": _json_load(self.suggestions_json),
-            "lang": self.lang,
-            "created_by": self.created_by,
-            "created_at": self.created_at.isoformat() if self.created_at else None,
-            "pdf_path": self.pdf_path,
-            "html_path": self.html_path,
-        }
+        out = super().to_dict()
+        out["tags"] = _json_load(self.tags_json)
+        out["suggestions"] = _json_load(self.suggestions_json)
+        return out
+
+# =========================
+# RenderJob (طابور توليد PDF في الخلفية — render_queue.py)
+# =========================
+class RenderJob(ApiSerializable, db.Model):
+    __tablename__ = "render_jobs"
+    id           = db.Column(db.Integer, primary_key=True)
+    report_id    = db.Column(db.Integer, db.ForeignKey("smart_reports.id"), nullable=False)
+    status       = db.Column(db.String(20), nullable=False, default="queued")  # queued/running/done/failed
+    payload_json = db.Column(db.Text, nullable=False)                          # meta + pdf_rel
+    attempts     = db.Column(db.Integer, nullable=False, default=0)
+    last_error   = db.Column(db.Text, nullable=True)
+    locked_by    = db.Column(db.String(120), nullable=True)
+    locked_until = db.Column(db.Float, nullable=True)                          # epoch؛ بعده يُعاد الاستلام
+    created_at   = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at   = db.Column(db.DateTime, nullable=True)
+    finished_at  = db.Column(db.DateTime, nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True)                     # بصمة meta+القالب+الشعار (done)
+
+    __table_args__ = (
+        db.Index("ix_render_jobs_status_id", "status", "id"),
+        db.Index("ix_render_jobs_report", "report_id"),
+    )
+    __api_fields__ = ("id", "report_id", "status", "attempts", "last_error", "created_at", "started_at", "finished_at")
+
+# =========================
+# PreviewJob (مهام المعاينة الحيّة وأحداثها — preview_jobs.py)
+# =========================
+class PreviewJob(ApiSerializable, db.Model):
+    __tablename__ = "preview_jobs"
+    id          = db.Column(db.String(32), primary_key=True)                  # uuid hex
+    status      = db.Column(db.String(20), nullable=False, default="queued")  # queued/running/done
+    inputs_json = db.Column(db.Text, nullable=False)                          # مدخلات النموذج (للمعاينة الاحتياطية)
+    heartbeat   = db.Column(db.Float, nullable=False)                         # epoch آخر تقدّم من المنتج
+    created_at  = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    __api_fields__ = ("id", "status", "created_at")
+
+class PreviewEvent(ApiSerializable, db.Model):
+    __tablename__ = "preview_events"
+    id        = db.Column(db.Integer, primary_key=True)
+    job_id    = db.Column(db.String(32), db.ForeignKey("preview_jobs.id"), nullable=False)
+    seq       = db.Column(db.Integer, nullable=False)                         # 1، 2، ... لكل مهمة
+    event     = db.Column(db.String(40), nullable=False)
+    data_json = db.Column(db.Text, nullable=False)
+
+    __table_args__ = (db.Index("ix_preview_events_job_seq", "job_id", "seq", unique=True),)
+    __api_fields__ = ("job_id", "seq", "event")
+
+# =========================
+# CategoryStat (عدّادات مجمّعة لكل فئة/مصدر/حالة — تُحدَّث في category_stats.py)
+# =========================
+class CategoryStat(ApiSerializable, db.Model):
+    __tablename__ = "category_stats"
+    category_code = db.Column(db.String(50), primary_key=True)
+    source        = db.Column(db.String(10), primary_key=True)   # manual / smart
+    status        = db.Column(db.String(20), primary_key=True)
+    count         = db.Column(db.Integer, nullable=False, default=0)
+
+    __api_fields__ = ("category_code", "source", "status", "count")
+
+# =========================
+# CategoryVersion (رقم إصدار يزداد مع كل تغيير في فئة — أساس ETag لواجهات القراءة)
+# =========================
+class CategoryVersion(ApiSerializable, db.Model):
+    __tablename__ = "category_versions"
+    category_code = db.Column(db.String(50), primary_key=True)
+    version       = db.Column(db.Integer, nullable=False, default=0)
+    updated_at    = db.Column(db.Float, nullable=False, default=0.0)   # epoch ثوانٍ
+
+    __api_fields__ = ("category_code", "version", "updated_at")
+
+# =========================
+# SchedulerLease (قفل قيادة: عملية واحدة فقط تشغّل المجدول — scheduler_lease.py)
+# =========================
+class SchedulerLease(ApiSerializable, db.Model):
+    __tablename__ = "scheduler_leases"
+    name       = db.Column(db.String(50), primary_key=True)
+    owner      = db.Column(db.String(120), nullable=False)
+    expires_at = db.Column(db.Float, nullable=False)   # epoch ثوانٍ
+
+    __api_fields__ = ("name", "owner", "expires_at")
 
 # =========================
 # Seed Categories
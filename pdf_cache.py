@@ -0,0 +1,64 @@
+# pdf_cache.py
+# -*- coding: utf-8 -*-
+"""
+بصمة محتوى (sha256) لمدخلات توليد PDF:
+- المدخلات = نوع التقرير + إصدار القالب + إصدار ReportLab + البيانات (meta/الصفوف) + بصمة الشعار + الخط
+- إذا وُجد ملف بنفس البصمة (GeneratedReport.content_hash / RenderJob.content_hash) يُعاد استخدامه بدون رسم
+- وقت التوليد لا يدخل في البصمة: الملف المُعاد يحمل وقت أول توليد لنفس المحتوى
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+from reportlab import Version as REPORTLAB_VERSION
+
+import pdf_resources
+
+_digest_cache = {}   # path -> (mtime_ns, size, sha256)
+_digest_lock = threading.Lock()
+
+def file_digest(path: str | None) -> str:
+    """بصمة ملف (الشعار مثلًا)؛ تُعاد قراءته فقط إذا تغيّر mtime/الحجم."""
+    if not path:
+        return ""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return ""
+    with _digest_lock:
+        hit = _digest_cache.get(path)
+    if hit and hit[:2] == (st.st_mtime_ns, st.st_size):
+        return hit[2]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _digest_lock:
+        _digest_cache[path] = (st.st_mtime_ns, st.st_size, digest)
+    return digest
+
+def _default(o):
+    if isinstance(o, (datetime.datetime, datetime.date)):
+        return o.isoformat()
+    if isinstance(o, (set, frozenset)):
+        return sorted(o)
+    return str(o)
+
+def rows_digest(rows) -> str:
+    """بصمة صفوف متدفقة (استعلام yield_per): sha256 تراكمي بدون الاحتفاظ بالصفوف في الذاكرة."""
+    h = hashlib.sha256()
+    for row in rows:
+        h.update(json.dumps(list(row), ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+def content_hash(kind: str, template_version: int, data, logo_path: str | None = None) -> str:
+    """sha256 ثابت لمدخلات الرسم (مفاتيح مرتّبة ⇒ نفس البيانات = نفس البصمة)."""
+    blob = json.dumps({"kind": kind, "template": template_version, "reportlab": REPORTLAB_VERSION,
+                       "logo": file_digest(logo_path), "font": [file_digest(p) for p in pdf_resources.FONT_FILES], "data": data},
+                      sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=_default)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
@@ -0,0 +1,96 @@
+# pdf_resources.py
+# -*- coding: utf-8 -*-
+"""
+موارد مشتركة لتوليد PDF، تُحمَّل مرة واحدة لكل عملية:
+- الشعار: bytes الملف في الذاكرة (يُعاد قراءتها إذا تغيّر الملف)؛ كل تقرير يأخذ ImageReader جديدًا منها
+- خط TTF يدعم Unicode (عادي + عريض) يُسجَّل عند الاستيراد؛ ReportLab يضمّن فقط الحروف المستخدمة (subset)
+  الافتراضي DejaVu Sans المرفق في static/fonts (لاتيني + نرويجي + عربي) ⇒ نفس الحروف على كل خادم
+  HMS_PDF_FONT / HMS_PDF_FONT_BOLD لخط آخر؛ ملف غير موجود أو غير صالح ⇒ خطأ عند الإقلاع (لا بديل صامت)
+  (HMS_PDF_FONT=Helvetica ⇒ خطوط PDF الأساسية بدون تضمين: ملفات أصغر، لكن بلا حروف خارج Latin-1)
+- النص العربي: تشكيل + ترتيب bidi إن كانت arabic_reshaper و python-bidi مثبتتين (اختياري)
+"""
+
+import io
+import os
+import re
+import threading
+
+from reportlab.lib.fonts import addMapping
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+except ImportError:   # اختياري
+    arabic_reshaper = None
+    get_display = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FONT_DIR = os.path.join(BASE_DIR, "static", "fonts")
+# (عادي، عريض) — مرفق مع المشروع، الترخيص في static/fonts/LICENSE-DejaVu.txt
+BUNDLED_FONT = (os.path.join(FONT_DIR, "DejaVuSans.ttf"), os.path.join(FONT_DIR, "DejaVuSans-Bold.ttf"))
+FONT_FAMILY = "HMSSans"
+FONT_FILES = ()   # ملفات الخط المستخدمة فعلًا (بصمتها تدخل في pdf_cache)؛ فارغة ⇒ Helvetica
+
+_ARABIC_RE = re.compile(r"[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF]")
+
+_logo_cache = {}   # path -> (mtime_ns, size, bytes)
+_logo_lock = threading.Lock()
+
+def _font_paths():
+    regular = os.getenv("HMS_PDF_FONT")
+    if regular and regular.lower() == "helvetica":
+        return None, None
+    if regular:
+        return regular, os.getenv("HMS_PDF_FONT_BOLD") or regular
+    return BUNDLED_FONT
+
+def register_fonts() -> tuple:
+    """يسجّل الخط مرة واحدة؛ يرجّع (اسم الخط العادي، اسم العريض) لأنماط ReportLab. خط مفقود ⇒ RuntimeError."""
+    global FONT_FILES
+    if FONT_FAMILY in pdfmetrics.getRegisteredFontNames():
+        return FONT_FAMILY, f"{FONT_FAMILY}-Bold"
+    regular, bold = _font_paths()
+    if not regular:   # HMS_PDF_FONT=Helvetica صراحةً
+        return "Helvetica", "Helvetica-Bold"
+    try:
+        pdfmetrics.registerFont(TTFont(FONT_FAMILY, regular))
+        pdfmetrics.registerFont(TTFont(f"{FONT_FAMILY}-Bold", bold))
+    except Exception as e:
+        raise RuntimeError(f"PDF font not usable: {regular} / {bold} ({e}). "
+                           f"Restore static/fonts or set HMS_PDF_FONT.") from e
+    FONT_FILES = (regular, bold)
+    # <b> داخل Paragraph ⇒ النسخة العريضة
+    addMapping(FONT_FAMILY, 0, 0, FONT_FAMILY)
+    addMapping(FONT_FAMILY, 1, 0, f"{FONT_FAMILY}-Bold")
+    addMapping(FONT_FAMILY, 0, 1, FONT_FAMILY)
+    addMapping(FONT_FAMILY, 1, 1, f"{FONT_FAMILY}-Bold")
+    return FONT_FAMILY, f"{FONT_FAMILY}-Bold"
+
+FONT, FONT_BOLD = register_fonts()
+
+def logo_image(path: str | None):
+    """ImageReader جديد للشعار من bytes مخزّنة (لكل تقرير كائنه، آمن بين الخيوط)، أو None إن لم يوجد الملف."""
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+        with _logo_lock:
+            hit = _logo_cache.get(path)
+            if not (hit and hit[:2] == (st.st_mtime_ns, st.st_size)):
+                with open(path, "rb") as f:
+                    hit = (st.st_mtime_ns, st.st_size, f.read())
+                _logo_cache[path] = hit
+        return ImageReader(io.BytesIO(hit[2]))
+    except Exception as e:
+        print(f"[PDF] Logo {path} not readable: {e}")
+        return None
+
+def shape(text: str) -> str:
+    """نص فيه عربي ⇒ حروف متصلة وبترتيب العرض (سطرًا بسطر)؛ غير ذلك كما هو."""
+    if not text or get_display is None or not _ARABIC_RE.search(text):
+        return text
+    return "\n".join(get_display(arabic_reshaper.reshape(line)) for line in text.split("\n"))
@@ -0,0 +1,99 @@
+# preview_jobs.py
+# -*- coding: utf-8 -*-
+"""
+مهام المعاينة الحيّة للتقارير الذكية داخل SQLite (preview_jobs + preview_events):
+- المهمة تعمل في خيط داخل العملية التي أنشأتها، والأحداث تُكتب في القاعدة
+  ⇒ polling و SSE يعملان من أي عملية gunicorn (لا حاجة لـ sticky sessions)
+- المستمع في نفس العملية يُوقَظ فورًا (Condition)؛ في عملية أخرى يقرأ كل PREVIEW_POLL_S
+- منتج مات (إعادة تشغيل عملية) ⇒ بعد PREVIEW_STALE_S بدون تقدّم يُنهي المستمع المهمة بالمعاينة الاحتياطية
+- المهام الأقدم من PREVIEW_JOB_TTL تُحذف عند إنشاء مهمة جديدة
+"""
+
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+
+from sqlalchemy import func, text
+
+from database import db
+from models import PreviewEvent, PreviewJob
+
+PREVIEW_JOB_TTL = int(os.getenv("HMS_PREVIEW_JOB_TTL", str(15 * 60)))
+PREVIEW_POLL_S  = float(os.getenv("HMS_PREVIEW_POLL_S", "0.5"))
+PREVIEW_STALE_S = float(os.getenv("HMS_PREVIEW_STALE_S", "300"))
+
+_wake = threading.Condition()
+
+def create_job(inputs: dict) -> str:
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=PREVIEW_JOB_TTL)
+    old = db.session.query(PreviewJob.id).filter(PreviewJob.created_at < cutoff)
+    PreviewEvent.query.filter(PreviewEvent.job_id.in_(old.scalar_subquery())).delete(synchronize_session=False)
+    PreviewJob.query.filter(PreviewJob.created_at < cutoff).delete(synchronize_session=False)
+    job = PreviewJob(id=uuid.uuid4().hex, status="queued", heartbeat=time.time(),
+                     inputs_json=json.dumps(inputs, ensure_ascii=False))
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+def job_exists(job_id: str) -> bool:
+    found = db.session.query(PreviewJob.id).filter_by(id=job_id).first() is not None
+    db.session.close()
+    return found
+
+def emit(job_id: str, event: str | None, data=None, status: str | None = None,
+         stale_before: float | None = None) -> bool:
+    """يضيف حدثًا (و/أو يغيّر الحالة). مهمة منتهية (done) لا تقبل أحداثًا ⇒ False."""
+    params = {"id": job_id, "status": status, "now": time.time()}
+    cond = ""
+    if stale_before is not None:   # استلام مهمة منتجها متوقف فقط
+        cond, params["stale"] = " AND heartbeat < :stale", stale_before
+    res = db.session.execute(text(f"""
+        UPDATE preview_jobs SET status = COALESCE(:status, status), heartbeat = :now
+         WHERE id = :id AND status != 'done'{cond}"""), params)
+    if res.rowcount != 1:
+        db.session.rollback()
+        return False
+    if event:
+        # منتج واحد لكل مهمة، و UPDATE أعلاه يمسك قفل الكتابة ⇒ max(seq)+1 آمن
+        seq = db.session.query(func.coalesce(func.max(PreviewEvent.seq), 0)).filter_by(job_id=job_id).scalar() + 1
+        db.session.add(PreviewEvent(job_id=job_id, seq=seq, event=event,
+                                    data_json=json.dumps(data, ensure_ascii=False, default=str)))
+    db.session.commit()
+    with _wake:
+        _wake.notify_all()
+    return True
+
+def _read(job_id: str, since: int):
+    row = (db.session.query(PreviewJob.status, PreviewJob.heartbeat, PreviewJob.inputs_json)
+           .filter_by(id=job_id).first())
+    events = []
+    if row is not None:
+        events = [{"event": ev, "data": json.loads(data)} for ev, data in
+                  db.session.query(PreviewEvent.event, PreviewEvent.data_json)
+                  .filter(PreviewEvent.job_id == job_id, PreviewEvent.seq > since)
+                  .order_by(PreviewEvent.seq)]
+    db.session.close()   # نهاية معاملة القراءة ⇒ القراءة التالية ترى الأحداث الجديدة (WAL)
+    return row, events
+
+def wait_events(job_id: str, since: int, timeout: float, fallback=None):
+    """(أحداث بعد since، الحالة)؛ ينتظر حتى timeout إن لم يوجد جديد. مهمة محذوفة ⇒ ([], "done")."""
+    deadline = time.monotonic() + timeout
+    while True:
+        row, events = _read(job_id, since)
+        if row is None:
+            return [], "done"
+        status, heartbeat, inputs_json = row
+        if (not events and status != "done" and fallback is not None
+                and heartbeat < time.time() - PREVIEW_STALE_S):
+            stale = time.time() - PREVIEW_STALE_S
+            if emit(job_id, "done", fallback(json.loads(inputs_json)), status="done", stale_before=stale):
+                print(f"[PreviewJob] {job_id} stalled; finished with fallback preview")
+            continue
+        left = deadline - time.monotonic()
+        if events or status == "done" or left <= 0:
+            return events, status
+        with _wake:
+            _wake.wait(min(PREVIEW_POLL_S, left))
@@ -1,44 +1,409 @@
 # rag.py
 # بسيط وخفيف: يبحث في ملفات نصية داخل مجلد "kb" ويُرجع أفضل K مقتطفات كـ context.
+# كل ملف يُقسَّم وقت الفهرسة إلى مقاطع متداخلة (passages)، والفهرس
+# (token → postings مع تكرار الكلمة لكل مقطع) يُبنى مرة واحدة ويُحفظ على القرص،
+# ثم يُعاد تحميله عند أول استعلام (مع إعادة فهرسة الملفات المتغيرة فقط)، والترتيب بـ BM25.
+# الفهرس لا يحمل نص المقاطع: فقط موضعها (بايت) في الملف، والنص يُقرأ من الملف عند الحاجة.
+# وضع اختياري RAG_MODE=hybrid يضيف بحثًا دلاليًا (embeddings) من نموذج ONNX محلي
+# بدون إنترنت، ويدمج درجة التشابه مع درجة BM25.
 
 from pathlib import Path
+from collections import Counter
+import hashlib
+import json
+import math
+import os
 import re
+import tempfile
+import threading
 
 KB_DIR = Path(__file__).parent / "kb"
+INDEX_PATH = KB_DIR / ".kb_index.json"
+VECTORS_PATH = KB_DIR / ".kb_vectors.npz"
+INDEX_VERSION = 4
 
-def _load_docs():
-    docs = []
-    if KB_DIR.exists():
-        for p in KB_DIR.glob("*.txt"):
+# تقسيم المقاطع: عدد الكلمات في المقطع والتداخل بين مقطعين متتاليين
+PASSAGE_WORDS = 120
+PASSAGE_OVERLAP = 30
+
+# ثوابت BM25 القياسية
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# البحث الهجين (اختياري): "lexical" افتراضيًا، أو "hybrid"
+# مجلد النموذج يحتوي model.onnx + tokenizer.json (مثلاً paraphrase-multilingual-MiniLM مُصدَّر لـ ONNX)
+RAG_MODE = os.getenv("RAG_MODE", "lexical").strip().lower()
+EMBED_MODEL_DIR = Path(os.getenv("RAG_EMBED_MODEL_DIR", str(Path(__file__).parent / "models" / "embed")))
+EMBED_MAX_TOKENS = 256
+EMBED_BATCH = 32
+HYBRID_ALPHA = float(os.getenv("RAG_HYBRID_ALPHA", "0.5"))   # وزن التشابه الدلالي مقابل BM25
+DENSE_CANDIDATES = 50
+
+_TOKEN_RE = re.compile(r"\w+")
+_WORD_SPAN_RE = re.compile(r"\S+")
+_index = None
+_index_gen = 0
+_index_lock = threading.Lock()
+
+_embedder = None          # None = لم يُحمّل بعد، False = غير متاح
+_dense = None             # {"gen", "pids", "matrix"} مصفوفة متجهات المقاطع بالترتيب
+_dense_lock = threading.Lock()
+
+def _tokenize(text: str):
+    return _TOKEN_RE.findall((text or "").lower())
+
+def _split_passages(text: str):
+    """يرجّع [(start, end, passage_text)] (مواضع أحرف) بنوافذ من PASSAGE_WORDS كلمة مع تداخل PASSAGE_OVERLAP."""
+    spans = [m.span() for m in _WORD_SPAN_RE.finditer(text or "")]
+    if not spans:
+        return []
+    stride = max(1, PASSAGE_WORDS - PASSAGE_OVERLAP)
+    out = []
+    for i in range(0, len(spans), stride):
+        window = spans[i:i + PASSAGE_WORDS]
+        start, end = window[0][0], window[-1][1]
+        out.append((start, end, text[start:end]))
+        if i + PASSAGE_WORDS >= len(spans):
+            break
+    return out
+
+def _kb_files():
+    return sorted(KB_DIR.glob("*.txt")) if KB_DIR.exists() else []
+
+def _empty_index() -> dict:
+    return {"version": INDEX_VERSION, "chunking": [PASSAGE_WORDS, PASSAGE_OVERLAP],
+            "total_len": 0, "next_pid": 0, "docs": {}, "passages": {}, "postings": {}}
+
+def _read_index_file():
+    if not INDEX_PATH.exists():
+        return None
+    try:
+        index = json.loads(INDEX_PATH.read_text(encoding="utf-8"))
+        if index.get("version") != INDEX_VERSION or index.get("chunking") != [PASSAGE_WORDS, PASSAGE_OVERLAP]:
+            return None
+        return index
+    except Exception:
+        return None
+
+def _publish(tmp_name: str, dest: Path) -> None:
+    # NamedTemporaryFile يُنشئ الملف بصلاحية 0600 و os.replace يبقيها ⇒ نفتحه للقراءة لكل المستخدمين
+    # (خادم الويب قد يعمل بمستخدم غير من شغّل flask kb-reindex)
+    try:
+        os.chmod(tmp_name, 0o644)
+        os.replace(tmp_name, dest)
+    except OSError:
+        os.unlink(tmp_name)
+        raise
+
+def _save_index(index: dict) -> None:
+    # كتابة ذرّية: ملف مؤقت باسم فريد (لكل عملية/خيط) ثم استبدال،
+    # حتى لا يقرأ أحد فهرسًا نصف مكتوب ولا تتداخل كتابتان في نفس الملف المؤقت
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=KB_DIR, prefix=".kb_index.",
+                                     suffix=".tmp", delete=False) as f:
+        json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+    _publish(f.name, INDEX_PATH)
+
+def _remove_doc(index: dict, name: str) -> None:
+    doc = index["docs"].pop(name, None)
+    if not doc:
+        return
+    for pid in doc["passages"]:
+        passage = index["passages"].pop(pid, None)
+        if passage:
+            index["total_len"] -= passage["len"]
+    for tok in doc["terms"]:
+        posting = index["postings"].get(tok)
+        if posting is None:
+            continue
+        for pid in doc["passages"]:
+            posting.pop(pid, None)
+        if not posting:
+            del index["postings"][tok]
+
+def _add_doc(index: dict, name: str, text: str, mtime: float, size: int, digest: str) -> None:
+    pids, doc_terms = [], set()
+    char_pos = byte_pos = 0   # تحويل مواضع الأحرف إلى بايت تزايديًا (المقاطع مرتّبة)
+    def to_byte(c):
+        nonlocal char_pos, byte_pos
+        byte_pos += len(text[char_pos:c].encode("utf-8"))
+        char_pos = c
+        return byte_pos
+    for start, end, ptext in _split_passages(text):
+        pid = str(index["next_pid"])   # رقم قصير: يتكرر في كل postings
+        index["next_pid"] += 1
+        tokens = _tokenize(ptext)
+        terms = Counter(tokens)
+        b_start = to_byte(start)
+        b_end = b_start + len(ptext.encode("utf-8"))
+        index["passages"][pid] = {"doc": name, "offset": start, "bytes": [b_start, b_end], "len": len(tokens)}
+        index["total_len"] += len(tokens)
+        for tok, tf in terms.items():
+            index["postings"].setdefault(tok, {})[pid] = tf
+        doc_terms.update(terms)
+        pids.append(pid)
+    index["docs"][name] = {"mtime": mtime, "size": size, "hash": digest, "passages": pids,
+                           "terms": sorted(doc_terms)}
+
+def _refresh(index: dict) -> dict:
+    """
+    يطابق الفهرس مع محتوى kb/ ويعيد تجزئة الملفات المضافة/المعدّلة/المحذوفة فقط.
+    mtime+size يكفيان للتخطي السريع؛ الـ hash يمنع إعادة الفهرسة لو تغيّر الـ mtime فقط.
+    """
+    stats = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+    seen = set()
+    for p in _kb_files():
+        name = p.name
+        seen.add(name)
+        try:
+            st = p.stat()
+            old = index["docs"].get(name)
+            if old and old["mtime"] == st.st_mtime and old["size"] == st.st_size:
+                stats["unchanged"] += 1
+                continue
+            data = p.read_bytes()
+            digest = hashlib.sha1(data).hexdigest()
+            if old and old["hash"] == digest:
+                old["mtime"], old["size"] = st.st_mtime, st.st_size
+                stats["unchanged"] += 1
+                continue
+            _remove_doc(index, name)
+            _add_doc(index, name, data.decode("utf-8"), st.st_mtime, st.st_size, digest)
+            stats["changed" if old else "added"] += 1
+        except Exception as e:
+            print(f"[RAG] Skipping {name}: {e}")
+    for name in [n for n in index["docs"] if n not in seen]:
+        _remove_doc(index, name)
+        stats["removed"] += 1
+    return stats
+
+def build_index(full: bool = False) -> dict:
+    """
+    يحدّث الفهرس المقلوب ويحفظه في INDEX_PATH، ويرجّع إحصائية بما تغيّر:
+    {"added", "changed", "removed", "unchanged", "docs", "passages", "terms"}.
+    full=True يتجاهل الفهرس المحفوظ ويعيد البناء من الصفر.
+
+    شكل الفهرس:
+    { "version", "chunking", "total_len", "next_pid",
+      "docs": {<اسم الملف>: {"mtime", "size", "hash", "passages": [<pid>, ...], "terms": [<كلمة>, ...]}},
+      "passages": {<pid>: {"doc", "offset" (حرف), "bytes": [بداية, نهاية], "len"}},
+      "postings": {<كلمة>: {<pid>: <تكرار>}} }
+    نص المقطع غير محفوظ: passage_text() يقرؤه من الملف بمواضع البايت.
+    """
+    global _index, _index_gen
+    with _index_lock:
+        if full:
+            index = _empty_index()
+        else:
+            index = _index or _read_index_file() or _empty_index()
+        stats = _refresh(index)
+        if full or any(stats[k] for k in ("added", "changed", "removed")) or not INDEX_PATH.exists():
+            if KB_DIR.exists():
+                try:
+                    _save_index(index)
+                except Exception as e:
+                    print(f"[RAG] Could not save index: {e}")
+        if _index is not index or any(stats[k] for k in ("added", "changed", "removed")):
+            _index_gen += 1
+        _index = index
+        stats.update(docs=len(index["docs"]), passages=len(index["passages"]),
+                     terms=len(index["postings"]))
+        return stats
+
+def load_index() -> dict:
+    """يحمّل الفهرس مرة واحدة لكل عملية (مع تحديث تزايدي من القرص) ويبقيه في الذاكرة."""
+    if _index is None:
+        build_index()
+    return _index
+
+def _read_passages(index: dict, pids) -> dict:
+    """{pid: نص} من ملفات kb/ (كل ملف يُقرأ مرة واحدة). ملف تغيّر بعد الفهرسة ⇒ يُحدَّث الفهرس أولًا."""
+    by_doc = {}
+    for pid in pids:
+        by_doc.setdefault(index["passages"][pid]["doc"], []).append(pid)
+    out = {}
+    for doc, doc_pids in by_doc.items():
+        try:
+            data = (KB_DIR / doc).read_bytes()
+        except OSError as e:
+            print(f"[RAG] Cannot read {doc}: {e}")
+            data = b""
+        for pid in doc_pids:
+            b_start, b_end = index["passages"][pid]["bytes"]
+            out[pid] = data[b_start:b_end].decode("utf-8", errors="replace")
+    return out
+
+def passage_text(pid: str) -> str:
+    return _read_passages(load_index(), [pid]).get(pid, "")
+
+# ===== البحث الدلالي (اختياري) =====
+class _OnnxEmbedder:
+    """مُرمِّز جمل محلي: tokenizers + onnxruntime، mean pooling ثم تطبيع L2."""
+
+    def __init__(self, model_dir: Path):
+        import numpy as np
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        self._np = np
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=EMBED_MAX_TOKENS)
+        self.tokenizer.enable_padding()
+        self.session = ort.InferenceSession(str(model_dir / "model.onnx"),
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def embed(self, texts):
+        np = self._np
+        out = []
+        for i in range(0, len(texts), EMBED_BATCH):
+            enc = self.tokenizer.encode_batch(texts[i:i + EMBED_BATCH])
+            ids = np.array([e.ids for e in enc], dtype=np.int64)
+            mask = np.array([e.attention_mask for e in enc], dtype=np.int64)
+            feed = {"input_ids": ids, "attention_mask": mask}
+            if "token_type_ids" in self.input_names:
+                feed["token_type_ids"] = np.zeros_like(ids)
+            hidden = self.session.run(None, feed)[0]
+            if hidden.ndim == 3:
+                m = mask[..., None].astype(np.float32)
+                hidden = (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+            out.append(hidden.astype(np.float32))
+        vecs = np.vstack(out) if out else np.zeros((0, 0), dtype=np.float32)
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        return vecs / np.clip(norms, 1e-12, None)
+
+def _get_embedder():
+    global _embedder
+    if _embedder is None:
+        try:
+            _embedder = _OnnxEmbedder(EMBED_MODEL_DIR)
+        except Exception as e:
+            print(f"[RAG] Dense retrieval disabled ({EMBED_MODEL_DIR}): {e}")
+            _embedder = False
+    return _embedder or None
+
+def _text_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def sync_vectors():
+    """
+    يضمن وجود متجه لكل مقطع في الفهرس الحالي. المتجهات تُخزَّن في VECTORS_PATH
+    بمفتاح hash نص المقطع، فلا يُعاد ترميز إلا المقاطع الجديدة/المعدّلة.
+    يرجّع {"embedded", "reused", "total"} أو None لو النموذج غير متاح.
+    """
+    global _dense
+    emb = _get_embedder()
+    if emb is None:
+        return None
+    np = emb._np
+    index = load_index()
+    with _dense_lock:
+        gen = _index_gen
+        if _dense is not None and _dense["gen"] == gen:
+            return {"embedded": 0, "reused": len(_dense["pids"]), "total": len(_dense["pids"])}
+        stored = {}
+        if VECTORS_PATH.exists():
             try:
-                docs.append((p.name, p.read_text(encoding="utf-8")))
-            except Exception:
-                pass
-    return docs
+                with np.load(VECTORS_PATH) as z:
+                    stored = dict(zip(z["keys"].tolist(), z["vectors"]))
+            except Exception as e:
+                print(f"[RAG] Ignoring unreadable vector store: {e}")
+        pids = list(index["passages"])
+        texts = _read_passages(index, pids)
+        keys = [_text_key(texts[pid]) for pid in pids]
+        missing = sorted({k for k in keys if k not in stored})
+        if missing:
+            by_key = {k: texts[pid] for pid, k in zip(pids, keys)}
+            for k, v in zip(missing, emb.embed([by_key[k] for k in missing])):
+                stored[k] = v
+        if pids:
+            matrix = np.vstack([stored[k] for k in keys]).astype(np.float32)
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        if missing or len(stored) != len(set(keys)):
+            try:
+                used = sorted(set(keys))
+                with tempfile.NamedTemporaryFile(dir=KB_DIR, prefix=".kb_vectors.", suffix=".tmp.npz",
+                                                 delete=False) as f:
+                    np.savez(f, keys=np.array(used),
+                             vectors=np.vstack([stored[k] for k in used]) if used else matrix)
+                _publish(f.name, VECTORS_PATH)
+            except Exception as e:
+                print(f"[RAG] Could not save vectors: {e}")
+        _dense = {"gen": gen, "pids": pids, "matrix": matrix}
+        return {"embedded": len(missing), "reused": len(pids) - len(missing), "total": len(pids)}
+
+def _dense_scores(query: str):
+    """تشابه cosine بين الاستعلام وكل المقاطع بضرب مصفوفة واحد (المتجهات مُطبَّعة)."""
+    if sync_vectors() is None or not _dense["pids"]:
+        return {}
+    emb = _get_embedder()
+    q = emb.embed([query])[0]
+    sims = _dense["matrix"] @ q
+    n = min(DENSE_CANDIDATES, len(sims))
+    top = emb._np.argpartition(-sims, n - 1)[:n]
+    return {_dense["pids"][i]: float(sims[i]) for i in top}
+
+def _hybrid_scores(index: dict, query: str, q_words):
+    lex = _bm25_scores(index, q_words)
+    dense = _dense_scores(query)
+    if not dense:
+        return lex
+    top_lex = max(lex.values()) if lex else 0.0
+    fused = {}
+    for pid in set(lex) | set(dense):
+        l = (lex.get(pid, 0.0) / top_lex) if top_lex else 0.0
+        d = max(dense.get(pid, 0.0), 0.0)
+        fused[pid] = HYBRID_ALPHA * d + (1 - HYBRID_ALPHA) * l
+    return fused
+
+def _bm25_scores(index: dict, q_words):
+    passages = index["passages"]
+    n_docs = len(passages)
+    if not n_docs:
+        return {}
+    avgdl = (index["total_len"] / n_docs) or 1.0
+    scores = {}
+    for w in set(q_words):
+        posting = index["postings"].get(w)
+        if not posting:
+            continue
+        df = len(posting)
+        idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        for pid, tf in posting.items():
+            dl = passages[pid]["len"]
+            denom = tf + BM25_K1 * (1 - BM25_B + BM25_B * dl / avgdl)
+            scores[pid] = scores.get(pid, 0.0) + idf * tf * (BM25_K1 + 1) / denom
+    return scores
 
 def top_k(query: str, k: int = 3):
     """
-    يرجّع قائمة قوامها dicts كل عنصر فيه:
-    { "title": <اسم الملف>, "content": <النص الكامل> }
-    لو ما في مجلد kb أو ما في تطابق، ترجع قائمة فاضية.
+    يرجّع قائمة قوامها dicts كل عنصر فيه مقطع (وليس الملف كاملًا):
+    { "title": <اسم الملف>, "text": <نص المقطع>, "offset": <موضعه في الملف>, "score": <درجة BM25> }
+    المقاطع المتداخلة من نفس الملف لا تتكرر. لو ما في مجلد kb أو ما في تطابق، ترجع قائمة فاضية.
+    في وضع RAG_MODE=hybrid تكون score مزيجًا من BM25 (مُطبَّع) والتشابه الدلالي.
     """
     if not query:
         return []
 
-    q = query.lower()
-    docs = _load_docs()
-    if not docs:
+    q_words = _tokenize(query)
+    if not q_words:
         return []
 
-    scored = []
-    # درجة بسيطة: عدد كلمات الاستعلام الموجودة في النص
-    q_words = re.findall(r"\w+", q)
-    for name, text in docs:
-        t = text.lower()
-        score = sum(1 for w in q_words if w in t)
-        if score > 0:
-            scored.append((score, name, text))
-
-    scored.sort(reverse=True, key=lambda x: x[0])
-    top = scored[:k]
-    return [{"title": name, "content": text} for _, name, text in top]
+    index = load_index()
+    passages = index["passages"]
+    if RAG_MODE == "hybrid":
+        scores = _hybrid_scores(index, query, q_words)
+    else:
+        scores = _bm25_scores(index, q_words)
+    picked, taken = [], []
+    for pid, score in sorted(scores.items(), key=lambda x: x[1], reverse=True):
+        p = passages[pid]
+        start, end = p["bytes"]
+        if any(doc == p["doc"] and start < e and s < end for doc, s, e in taken):
+            continue
+        taken.append((p["doc"], start, end))
+        picked.append((pid, score))
+        if len(picked) >= k:
+            break
+    texts = _read_passages(index, [pid for pid, _ in picked])   # النص فقط للمقاطع المختارة
+    return [{"title": passages[pid]["doc"], "text": texts[pid], "offset": passages[pid]["offset"],
+             "score": round(score, 4)} for pid, score in picked]
@@ -0,0 +1,175 @@
+# render_queue.py
+# -*- coding: utf-8 -*-
+"""
+طابور توليد PDF للتقارير الذكية داخل SQLite (جدول render_jobs):
+- enqueue_render() يضيف المهمة في نفس معاملة SmartReport ⇒ لا تقرير بدون مهمة
+- خيوط عاملة في كل عملية تستلم المهام بـ UPDATE ... RETURNING ذرّي (آمن مع عدة عمليات gunicorn)
+- ReportLab يعمل في ProcessPoolExecutor (معالج، وليس GIL)
+- مهمة عالقة (عملية ماتت) يُعاد استلامها بعد انتهاء locked_until؛ الفشل يُعاد حتى MAX_ATTEMPTS
+  بتراجع أسّي (locked_until لمهمة queued = لا تُستلم قبل هذا الوقت)
+- بصمة المدخلات (pdf_cache) تُحفظ مع المهمة المنتهية؛ نفس البصمة والملف موجود ⇒ بدون رسم
+- إنهاء المهمة مشروط بـ locked_by: عامل تجاوز مهلته واستُلمت مهمته من جديد تُهمَل نتيجته
+"""
+
+import datetime
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import text
+
+from database import db
+from models import RenderJob, SmartReport
+from pdf_cache import content_hash
+from smart_reporter import TEMPLATE_VERSION, render_pdf
+
+RENDER_WORKERS      = int(os.getenv("HMS_RENDER_WORKERS", "2"))
+RENDER_POLL_S       = float(os.getenv("HMS_RENDER_POLL_S", "2"))
+RENDER_LEASE_S      = float(os.getenv("HMS_RENDER_LEASE_S", "120"))
+RENDER_MAX_ATTEMPTS = int(os.getenv("HMS_RENDER_MAX_ATTEMPTS", "3"))
+
+_state = {"app": None, "threads": [], "pool": None, "base_dir": None, "logo": None}
+_wake = threading.Event()
+_start_lock = threading.Lock()
+
+def enqueue_render(rpt: SmartReport, meta: dict, pdf_rel: str) -> RenderJob:
+    """يضيف مهمة للجلسة الحالية (الاستدعاء يعمل commit). بعد الـ commit: wake_workers()."""
+    job = RenderJob(report_id=rpt.id, status="queued",
+                    payload_json=json.dumps({"meta": meta, "pdf_rel": pdf_rel}, ensure_ascii=False))
+    db.session.add(job)
+    return job
+
+def wake_workers():
+    _wake.set()
+
+def latest_job(report_id: int):
+    return (RenderJob.query.filter_by(report_id=report_id)
+            .order_by(RenderJob.id.desc()).first())
+
+def _claim(worker_id: str):
+    """يستلم أقدم مهمة جاهزة (أو عالقة) ذرّيًا؛ يرجّع (id, report_id, payload_json, attempts) أو None."""
+    now = time.time()
+    row = db.session.execute(text("""
+        UPDATE render_jobs
+           SET status = 'running', locked_by = :w, locked_until = :until,
+               attempts = attempts + 1, started_at = :started
+         WHERE id = (SELECT id FROM render_jobs
+                      WHERE (status = 'queued' AND (locked_until IS NULL OR locked_until < :now))
+                         OR (status = 'running' AND locked_until < :now)
+                      ORDER BY id LIMIT 1)
+        RETURNING id, report_id, payload_json, attempts"""),
+        {"w": worker_id, "until": now + RENDER_LEASE_S, "now": now,
+         "started": datetime.datetime.utcnow()}).first()
+    db.session.commit()
+    return row
+
+def _already_rendered(job_id: int, report_id: int, digest: str) -> bool:
+    return db.session.query(RenderJob.id).filter(
+        RenderJob.report_id == report_id, RenderJob.id != job_id,
+        RenderJob.status == "done", RenderJob.content_hash == digest).first() is not None
+
+def _finish(job_id: int, worker_id: str, report_id: int, pdf_rel: str | None, error: str | None,
+            attempts: int, digest: str | None = None) -> bool:
+    """يسجّل النتيجة فقط إن كانت المهمة ما تزال مستلمة من هذا العامل؛ False ⇒ النتيجة أُهملت."""
+    now = datetime.datetime.utcnow()
+    if error is None:
+        values = {"status": "done", "last_error": None, "content_hash": digest,
+                  "finished_at": now, "locked_until": None}
+    elif attempts < RENDER_MAX_ATTEMPTS:
+        # locked_until لمهمة queued = "ليس قبل" (تراجع بين المحاولات)
+        values = {"status": "queued", "last_error": error[:2000], "content_hash": None,
+                  "finished_at": None, "locked_until": time.time() + min(60.0, 2.0 ** attempts)}
+    else:
+        values = {"status": "failed", "last_error": error[:2000], "content_hash": None,
+                  "finished_at": now, "locked_until": None}
+    res = db.session.execute(text("""
+        UPDATE render_jobs
+           SET status = :status, last_error = :last_error, content_hash = :content_hash,
+               finished_at = :finished_at, locked_until = :locked_until, locked_by = NULL
+         WHERE id = :id AND locked_by = :w AND status = 'running'"""),
+        {**values, "id": job_id, "w": worker_id})
+    if res.rowcount != 1:
+        db.session.rollback()
+        return False
+    if error is None:
+        rpt = db.session.get(SmartReport, report_id)
+        if rpt is not None:
+            rpt.pdf_path = pdf_rel
+            rpt.html_path = None
+    db.session.commit()
+    return True
+
+def _run_one(worker_id: str) -> bool:
+    row = _claim(worker_id)
+    if row is None:
+        return False
+    job_id, report_id, payload_json, attempts = row
+    t0 = time.perf_counter()
+    error, pdf_rel, digest, reused = None, None, None, False
+    try:
+        payload = json.loads(payload_json)
+        pdf_rel = payload["pdf_rel"]
+        pdf_path = os.path.join(_state["base_dir"], pdf_rel)
+        logo_path = _state["logo"]()
+        digest = content_hash("smart_report", TEMPLATE_VERSION, payload, logo_path)
+        reused = os.path.exists(pdf_path) and _already_rendered(job_id, report_id, digest)
+        if not reused:
+            os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+            # ملف مؤقت خاص بهذا العامل ثم استبدال: عاملان على نفس المهمة (مهلة منتهية) لا يكتبان نفس الملف معًا
+            tmp_path = f"{pdf_path}.{worker_id.replace(':', '_')}.tmp"
+            try:
+                pool = _state["pool"]
+                if pool is not None:
+                    pool.submit(render_pdf, tmp_path, payload["meta"], logo_path).result()
+                else:
+                    render_pdf(tmp_path, payload["meta"], logo_path=logo_path)
+                os.replace(tmp_path, pdf_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        print(f"[Render] job {job_id} (report {report_id}) attempt {attempts} failed: {error}")
+    if not _finish(job_id, worker_id, report_id, pdf_rel, error, attempts, digest):
+        print(f"[Render] job {job_id} (report {report_id}) lease lost to another worker; result dropped")
+        return True
+    if error is None:
+        how = "unchanged, reused existing PDF" if reused else f"done in {time.perf_counter() - t0:.2f} s"
+        print(f"[Render] job {job_id} (report {report_id}) {how}")
+    return True
+
+def _worker_loop(n: int):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{n}"
+    app = _state["app"]
+    while True:
+        try:
+            with app.app_context():
+                busy = _run_one(worker_id)
+                db.session.remove()
+        except Exception as e:   # قاعدة مقفلة مؤقتًا... نكمل
+            print(f"[Render] worker {worker_id} error: {e}")
+            busy = False
+        if not busy:
+            _wake.wait(RENDER_POLL_S)
+            _wake.clear()
+
+def start_render_workers(app, base_dir: str, logo_path_fn, workers: int | None = None,
+                         use_processes: bool = True):
+    """يبدأ الخيوط العاملة مرة واحدة لكل عملية. آمن للاستدعاء المتكرر."""
+    with _start_lock:
+        if _state["threads"]:
+            return
+        n = max(1, workers or RENDER_WORKERS)
+        _state.update(app=app, base_dir=base_dir, logo=logo_path_fn,
+                      pool=ProcessPoolExecutor(max_workers=n) if use_processes else None)
+        for i in range(n):
+            t = threading.Thread(target=_worker_loop, args=(i,), name=f"render-{i}", daemon=True)
+            _state["threads"].append(t)
+            t.start()
+
+def queue_stats() -> dict:
+    rows = db.session.execute(text("SELECT status, count(*) FROM render_jobs GROUP BY status")).all()
+    return {st: n for st, n in rows}
@@ -1,15 +1,28 @@
 # report_generator.py
 import os, datetime
+from xml.sax.saxutils import escape
 from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
 from reportlab.lib import colors
 from reportlab.lib.units import cm
-from reportlab.platypus import Table, TableStyle, Paragraph
+from reportlab.platypus import Table, TableStyle, Paragraph, Spacer, SimpleDocTemplate
+from reportlab.platypus.flowables import Flowable
 from reportlab.lib.styles import ParagraphStyle
 from reportlab.lib.enums import TA_LEFT
-from sqlalchemy import func
 from database import db
 from models import Category, Record, GeneratedReport, SmartReport  # ← لاحظ إضافة SmartReport
+from category_stats import category_counts
+from pdf_cache import content_hash, rows_digest
+from smart_reporter import LazyStory
+from pdf_resources import FONT, FONT_BOLD, logo_image, shape
+
+# يُرفع عند أي تغيير في شكل التقرير ⇒ لا يُعاد استخدام ملفات القالب القديم
+TEMPLATE_VERSION = 3
+
+# 0 = آخر LATEST_LIMIT عنصرًا لكل جدول (السلوك القديم)؛ N = كل عناصر آخر N يومًا عبر عدة صفحات
+DEFAULT_PERIOD_DAYS = int(os.getenv("HMS_REPORT_PERIOD_DAYS", "0"))
+LATEST_LIMIT  = 10
+STREAM_BATCH  = 500   # yield_per: صفوف لكل دفعة من المؤشّر
+MIN_ROW_H     = 12 + 6 + 6   # سطر واحد (leading) + الحشو العلوي والسفلي: حدّ أعلى لعدد الصفوف في الإطار
 
 SOFT_RED_BG    = colors.HexColor("#FEE2E2")
 SOFT_YELLOW_BG = colors.HexColor("#FEF9C3")
@@ -23,7 +36,7 @@ BLUE       = colors.HexColor("#007BFF")
 GREY_LINE  = colors.HexColor("#E2E8F0")
 GREY_HEAD  = colors.HexColor("#F8FAFC")
 
-LEFT_MARGIN, RIGHT_MARGIN, TOP_MARGIN = 2*cm, 2*cm, 2.8*cm
+LEFT_MARGIN, RIGHT_MARGIN, TOP_MARGIN, BOTTOM_MARGIN = 2*cm, 2*cm, 2.8*cm, 2*cm
 PAGE_W, PAGE_H = A4
 MAX_TABLE_W = PAGE_W - LEFT_MARGIN - RIGHT_MARGIN
 
@@ -44,60 +57,209 @@ def _status_style(status: str):
 
 def _ensure_dir(p): os.makedirs(p, exist_ok=True)
 
-def generate_category_report(category_code: str, upload_root: str, logo_path: str|None=None, created_by: str="Admin") -> str:
+P = ParagraphStyle(name="P", fontName=FONT, fontSize=9, leading=12, alignment=TA_LEFT, wordWrap="CJK")
+H1 = ParagraphStyle(name="H1", fontName=FONT_BOLD, fontSize=16, leading=20, textColor=BLUE_DARK, spaceAfter=10)
+
+_CELL_STYLE = [
+    ("FONTNAME",(0,0),(-1,-1), FONT),
+    ("WORDWRAP",(0,0),(-1,-1),"CJK"),
+    ("INNERGRID",(0,0),(-1,-1), 0.5, GREY_LINE),
+    ("BOX",(0,0),(-1,-1), 0.75, GREY_LINE),
+    ("ALIGN",(0,0),(-1,-1),"LEFT"),
+    ("VALIGN",(0,0),(-1,-1),"TOP"),
+    ("LEFTPADDING",(0,0),(-1,-1),6),("RIGHTPADDING",(0,0),(-1,-1),6),
+    ("TOPPADDING",(0,0),(-1,-1),6),("BOTTOMPADDING",(0,0),(-1,-1),6),
+]
+# رأس الجداول: سطر عنوان ممتد + سطر أسماء الأعمدة (يتكرران في كل صفحة)
+_LIST_HEAD_STYLE = _CELL_STYLE + [
+    ("BACKGROUND",(0,0),(-1,0), GREY_HEAD),
+    ("SPAN",(0,0),(-1,0)),
+    ("FONTNAME",(0,0),(-1,0),FONT_BOLD),
+    ("BACKGROUND",(0,1),(-1,1), colors.HexColor("#DBEAFE")),
+    ("FONTNAME",(0,1),(-1,1),FONT_BOLD),
+]
+
+class _CellParagraph(Paragraph):
+    """Paragraph في خلية: Table يقيس نفس الخلية عدة مرات (wrap ثم split ثم add) بنفس العرض ⇒ لفّ مرة واحدة."""
+    def wrap(self, availWidth, availHeight):
+        if getattr(self, "_wrapped_for", None) != availWidth:
+            self._wrapped_size = Paragraph.wrap(self, availWidth, availHeight)
+            self._wrapped_for = availWidth
+        return self._wrapped_size
+
+class _StreamingTable(Flowable):
+    """
+    جدول تُسحب صفوفه من مولّد صفحةً بصفحة: كل split() يبني Table لما يتّسع له الإطار فقط
+    ويُبقي الباقي في المولّد ⇒ الذاكرة ثابتة مهما كان عدد الصفوف، والرأس يتكرر في كل صفحة.
+    rows: (cells, [(cmd, col0, col1, *args), ...]) — أوامر تنسيق خاصة بالصف.
+    """
+    def __init__(self, head_rows, head_style, rows, col_widths, empty_row):
+        Flowable.__init__(self)
+        self._head, self._head_style = head_rows, head_style
+        self._col_widths, self._source = col_widths, iter(rows)
+        self._buf, self._t = [], None
+        self._fill(1)
+        if not self._buf:
+            self._buf = [(empty_row, [])]
+
+    def _fill(self, n):
+        while self._source is not None and len(self._buf) < n:
+            try:
+                self._buf.append(next(self._source))
+            except StopIteration:
+                self._source = None
+
+    def _table(self, rows):
+        nh = len(self._head)
+        style = list(self._head_style)
+        for i, (_, cmds) in enumerate(rows, start=nh):
+            style += [(cmd, (c0, i), (c1, i), *args) for cmd, c0, c1, *args in cmds]
+        return Table(self._head + [cells for cells, _ in rows], colWidths=self._col_widths,
+                     repeatRows=nh, splitByRow=1, style=TableStyle(style))
+
+    def wrap(self, aw, ah):
+        # لا يتّسع الإطار لأكثر من ah / MIN_ROW_H صفًا ⇒ نقيس هذا العدد (+1 ليفيض) فقط
+        want = int(ah // MIN_ROW_H) + 1
+        while True:
+            self._fill(want)
+            self._t = self._table(self._buf[:want])
+            w, h = self._t.wrap(aw, ah)
+            if h > ah or (self._source is None and want >= len(self._buf)):
+                return w, h
+            want *= 2
+
+    def split(self, aw, ah):
+        if self._t is None:
+            self.wrap(aw, ah)
+        parts = self._t.split(aw, ah)
+        used = len(parts[0]._cellvalues) - len(self._head) if parts else 0
+        if used <= 0:
+            return []   # لا يتّسع حتى صف واحد ⇒ الصفحة التالية
+        self._buf, self._t = self._buf[used:], None   # الصفوف المرسومة تُحرَّر هنا
+        # الباقي جسم جديد بالنسبة لـ doc.build(): علامة التأجيل من صفحة سابقة لا تنطبق عليه
+        self.__dict__.pop("_postponed", None)
+        return [parts[0], self] if (self._buf or self._source is not None) else [parts[0]]
+
+    def draw(self):
+        self._t.drawOn(self.canv, 0, 0)
+
+def _manual_query(cat_id, since, limit):
+    q = (db.session.query(Record.title, Record.status, Record.created_at, Record.created_by)
+         .filter(Record.category_id == cat_id))
+    if since is not None:
+        q = q.filter(Record.created_at >= since)
+    q = q.order_by(Record.created_at.desc(), Record.id.desc())
+    return (q.limit(limit) if limit else q).yield_per(STREAM_BATCH)
+
+def _smart_query(category_code, since, limit):
+    q = (db.session.query(SmartReport.title, SmartReport.status, SmartReport.created_at)
+         .filter(SmartReport.category_code == category_code))
+    if since is not None:
+        q = q.filter(SmartReport.created_at >= since)
+    q = q.order_by(SmartReport.created_at.desc(), SmartReport.id.desc())
+    return (q.limit(limit) if limit else q).yield_per(STREAM_BATCH)
+
+def _status_cmds(status):
+    _, bg, txt = _status_style(status)
+    return [("BACKGROUND", 1, 1, bg), ("TEXTCOLOR", 1, 1, txt)]
+
+def _counted(rows, counts, key):
+    for row in rows:
+        counts[key] += 1
+        yield row
+
+def _manual_cells(rows):
+    for title, status, created_at, created_by in rows:
+        yield ([_CellParagraph(escape(shape(title or "-")), P), _status_style(status)[0],
+                created_at.strftime("%Y-%m-%d %H:%M") if created_at else "-", shape(created_by or "-")],
+               _status_cmds(status))
+
+def _smart_cells(rows):
+    for title, status, created_at in rows:
+        yield ([_CellParagraph(escape(shape(title or "-")), P), _status_style(status)[0],
+                created_at.strftime("%Y-%m-%d %H:%M") if created_at else "-"],
+               _status_cmds(status))
+
+def generate_category_report(category_code: str, upload_root: str, logo_path: str|None=None, created_by: str="Admin",
+                             period_days: int|None=None) -> str:
+    """
+    period_days: None = DEFAULT_PERIOD_DAYS؛ 0 = آخر 10 عناصر لكل جدول؛ N = كل عناصر آخر N يومًا
+    (الصفوف تُقرأ بالتدفق من المؤشّر وتُرسم صفحةً بصفحة).
+    """
     cat = Category.query.filter_by(code=category_code).first()
     if not cat:
         raise ValueError("Category not found")
+    if period_days is None:
+        period_days = DEFAULT_PERIOD_DAYS
+    period_days = max(0, int(period_days))
 
     # مسار الإخراج
     target_base = os.path.join(upload_root, category_code, "auto_reports")
     _ensure_dir(target_base)
     now = datetime.datetime.now()
-    fname = f"HMS_Rapport_{_nor_label(category_code)}_{now.strftime('%Y-%m-%d_%H-%M')}_by_{created_by.replace(' ','_')}.pdf"
-    out_path = os.path.join(target_base, fname)
 
-    # === مصادر البيانات: قيود يدوية + تقارير ذكية
-    latest_records = (db.session.query(Record)
-                      .join(Category).filter(Category.code==category_code)
-                      .order_by(Record.created_at.desc()).limit(10).all())
+    # === مصادر البيانات: قيود يدوية + تقارير ذكية (الفئة محلولة مرة واحدة أعلاه ⇒ بدون join)
+    # بداية الفترة مقرّبة لبداية اليوم (UTC مثل created_at) ⇒ نفس البصمة طوال اليوم إن لم يتغيّر شيء
+    if period_days:
+        since = (datetime.datetime.utcnow() - datetime.timedelta(days=period_days)).replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        limit = None
+    else:
+        since, limit = None, LATEST_LIMIT
+
+    # أرقام من جدول category_stats (عدّادات مُحدَّثة مع كل تعديل) بدل COUNT على الجداول
+    counts = category_counts(category_code)
+    man = counts["manual"]
+    total_all  = sum(category_counts()["manual"].values())
+    total_cat  = sum(man.values())
+    open_cat   = man.get("open", 0)
+    prog_cat   = man.get("in_progress", 0) + man.get("processing", 0)
+    closed_cat = man.get("closed", 0)
 
-    latest_smart   = (SmartReport.query
-                      .filter_by(category_code=category_code)
-                      .order_by(SmartReport.created_at.desc()).limit(10).all())
+    smart = counts["smart"]
+    total_smart  = sum(smart.values())
+    smart_open   = smart.get("open", 0)
+    smart_proc   = smart.get("processing", 0) + smart.get("in_progress", 0)
+    smart_closed = smart.get("closed", 0)
 
-    # أرقام عامة (يدوي)
-    total_all = db.session.query(func.count(Record.id)).scalar() or 0
-    total_cat = db.session.query(func.count(Record.id)).join(Category).filter(Category.code==category_code).scalar() or 0
-    open_cat  = db.session.query(func.count(Record.id)).join(Category).filter(Category.code==category_code, Record.status=="open").scalar() or 0
-    prog_cat  = db.session.query(func.count(Record.id)).join(Category).filter(Category.code==category_code, Record.status.in_(["in_progress","processing"])).scalar() or 0
-    closed_cat= db.session.query(func.count(Record.id)).join(Category).filter(Category.code==category_code, Record.status=="closed").scalar() or 0
+    # نفس المدخلات (بدون وقت التوليد) = نفس الملف ⇒ لا رسم ولا ملف جديد في auto_reports
+    # الصفوف تُبصم بالتدفق (بدون تحميلها كلها)، ثم تُقرأ مرة ثانية للرسم عند الحاجة فقط
+    digest = content_hash("category_report", TEMPLATE_VERSION, {
+        "category": category_code, "created_by": created_by,
+        "total_all": total_all, "counts": counts,
+        "period_days": period_days, "since": since,
+        "manual": rows_digest(_manual_query(cat.id, since, limit)),
+        "smart": rows_digest(_smart_query(category_code, since, limit)),
+    }, logo_path)
+    prev = (GeneratedReport.query.filter_by(category_code=category_code, content_hash=digest)
+            .order_by(GeneratedReport.id.desc()).first())
+    if prev:
+        prev_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), prev.file_path)
+        if os.path.exists(prev_path):
+            print(f"[GEN] cat={category_code} unchanged, reusing {prev.file_path}")
+            return prev_path
 
-    # أرقام من التقارير الذكية
-    total_smart = SmartReport.query.filter_by(category_code=category_code).count()
-    smart_open  = SmartReport.query.filter_by(category_code=category_code, status="open").count()
-    smart_proc  = SmartReport.query.filter(SmartReport.category_code==category_code, SmartReport.status.in_(["processing","in_progress"])).count()
-    smart_closed= SmartReport.query.filter_by(category_code=category_code, status="closed").count()
+    # بادئة البصمة في الاسم: توليدان مختلفان في نفس الدقيقة لا يكتب أحدهما فوق الآخر
+    fname = (f"HMS_Rapport_{_nor_label(category_code)}_{now.strftime('%Y-%m-%d_%H-%M')}"
+             f"_by_{created_by.replace(' ','_')}_{digest[:8]}.pdf")
+    out_path = os.path.join(target_base, fname)
 
-    # PDF
-    c = canvas.Canvas(out_path, pagesize=A4)
-    if logo_path and os.path.exists(logo_path):
-        try:
-            c.drawImage(logo_path, LEFT_MARGIN, PAGE_H - 2.6*cm, width=2.6*cm, height=2.6*cm, preserveAspectRatio=True, mask='auto')
-        except:
-            pass
-
-    c.setFont("Helvetica-Bold", 14); c.setFillColor(BLUE_DARK)
-    c.drawRightString(PAGE_W - RIGHT_MARGIN, PAGE_H - 1.3*cm, "Amigos LA kokido AS – Internkontroll / HMS")
-    c.setFont("Helvetica", 9); c.setFillColor(colors.black)
-    c.drawRightString(PAGE_W - RIGHT_MARGIN, PAGE_H - 1.9*cm, f"Generert: {now.strftime('%Y-%m-%d %H:%M')}  |  Av: {created_by}")
-
-    c.setStrokeColor(BLUE); c.setLineWidth(2)
-    c.line(LEFT_MARGIN, PAGE_H - TOP_MARGIN, PAGE_W - RIGHT_MARGIN, PAGE_H - TOP_MARGIN)
-    c.setFont("Helvetica-Bold", 16); c.setFillColor(BLUE_DARK)
-    c.drawString(LEFT_MARGIN, PAGE_H - TOP_MARGIN - 0.8*cm, f"HMS Rapport – {_nor_label(category_code)}")
-
-    y = PAGE_H - TOP_MARGIN - 1.6*cm
-    P = ParagraphStyle(name="P", fontName="Helvetica", fontSize=9, leading=12, alignment=TA_LEFT, wordWrap="CJK")
+    # ترويسة كل صفحة: شعار + اسم الشركة + وقت التوليد + خط أزرق؛ ورقم الصفحة أسفلها
+    logo = logo_image(logo_path)
+    def on_page(c, doc):
+        if logo is not None:
+            try:
+                c.drawImage(logo, LEFT_MARGIN, PAGE_H - 2.6*cm, width=2.6*cm, height=2.6*cm, preserveAspectRatio=True, mask='auto')
+            except Exception:
+                pass
+        c.setFont(FONT_BOLD, 14); c.setFillColor(BLUE_DARK)
+        c.drawRightString(PAGE_W - RIGHT_MARGIN, PAGE_H - 1.3*cm, "Amigos LA kokido AS – Internkontroll / HMS")
+        c.setFont(FONT, 9); c.setFillColor(colors.black)
+        c.drawRightString(PAGE_W - RIGHT_MARGIN, PAGE_H - 1.9*cm, f"Generert: {now.strftime('%Y-%m-%d %H:%M')}  |  Av: {shape(created_by)}")
+        c.setStrokeColor(BLUE); c.setLineWidth(2)
+        c.line(LEFT_MARGIN, PAGE_H - TOP_MARGIN, PAGE_W - RIGHT_MARGIN, PAGE_H - TOP_MARGIN)
+        c.setFont(FONT, 8); c.setFillColor(colors.grey)
+        c.drawRightString(PAGE_W - RIGHT_MARGIN, 1.2*cm, f"Side {doc.page}")
 
     # 1) ملخص
     summary_data = [
@@ -113,102 +275,53 @@ def generate_category_report(category_code: str, upload_root: str, logo_path: st
         [f"Lukket (smart)", str(smart_closed)],
     ]
     summary_table = Table(summary_data, colWidths=[8.2*cm, MAX_TABLE_W-8.2*cm])
-    summary_table.setStyle(TableStyle([
-        ("WORDWRAP",(0,0),(-1,-1),"CJK"),
+    summary_table.setStyle(TableStyle(_CELL_STYLE + [
         ("BACKGROUND",(0,0),(-1,0), GREY_HEAD),
-        ("FONTNAME",(0,0),(-1,0),"Helvetica-Bold"),
-        ("INNERGRID",(0,0),(-1,-1), 0.5, GREY_LINE),
-        ("BOX",(0,0),(-1,-1), 0.75, GREY_LINE),
-        ("VALIGN",(0,0),(-1,-1),"TOP"),
-        ("LEFTPADDING",(0,0),(-1,-1),6),("RIGHTPADDING",(0,0),(-1,-1),6),
-        ("TOPPADDING",(0,0),(-1,-1),6),("BOTTOMPADDING",(0,0),(-1,-1),6),
+        ("FONTNAME",(0,0),(-1,0),FONT_BOLD),
     ]))
-    _, sh = summary_table.wrap(MAX_TABLE_W, y-2*cm)
-    summary_table.drawOn(c, LEFT_MARGIN, y - sh)
-    y -= sh + 0.8*cm
-
-    # 2) أحدث القيود اليدوية
-    data_manual = [[Paragraph("<b>Siste 10 registreringer (manuell)</b>", P), "", "", ""],
-                   ["Tittel", "Status", "Dato", "Opprettet av"]]
-    if latest_records:
-        for r in latest_records:
-            label, bg, txt = _status_style(r.status)
-            data_manual.append([
-                Paragraph(r.title or "-", P),
-                Paragraph(f'<font color="{txt}">{label}</font>', P),
-                r.created_at.strftime("%Y-%m-%d %H:%M"),
-                r.created_by or "-"
-            ])
-    else:
-        data_manual.append(["Ingen data", "-", "-", "-"])
-    col_widths = [7.6*cm, 3.0*cm, 3.1*cm, MAX_TABLE_W - (7.6*cm + 3.0*cm + 3.1*cm)]
-    table_m = Table(data_manual, colWidths=col_widths, repeatRows=2, splitByRow=1)
-    style_m = TableStyle([
-        ("WORDWRAP",(0,0),(-1,-1),"CJK"),
-        ("BACKGROUND",(0,0),(-1,0), GREY_HEAD),
-        ("SPAN",(0,0),(-1,0)),
-        ("FONTNAME",(0,0),(-1,0),"Helvetica-Bold"),
-        ("BACKGROUND",(0,1),(-1,1), colors.HexColor("#DBEAFE")),
-        ("FONTNAME",(0,1),(-1,1),"Helvetica-Bold"),
-        ("INNERGRID",(0,0),(-1,-1), 0.5, GREY_LINE),
-        ("BOX",(0,0),(-1,-1), 0.75, GREY_LINE),
-        ("ALIGN",(0,0),(-1,-1),"LEFT"),
-        ("VALIGN",(0,0),(-1,-1),"TOP"),
-        ("LEFTPADDING",(0,0),(-1,-1),6),("RIGHTPADDING",(0,0),(-1,-1),6),
-        ("TOPPADDING",(0,0),(-1,-1),6),("BOTTOMPADDING",(0,0),(-1,-1),6),
-    ])
-    for i, r in enumerate(latest_records, start=2):
-        _, bg, _ = _status_style(r.status)
-        style_m.add("BACKGROUND", (1,i), (1,i), bg)
-    table_m.setStyle(style_m)
-    _, th = table_m.wrap(MAX_TABLE_W, y-2*cm)
-    table_m.drawOn(c, LEFT_MARGIN, y - th)
-    y -= th + 0.8*cm
-
-    # 3) أحدث التقارير الذكية
-    data_smart = [[Paragraph("<b>Siste 10 smartrapporter</b>", P), "", ""],
-                  ["Tittel", "Status", "Dato"]]
-    if latest_smart:
-        for s in latest_smart:
-            label, bg, txt = _status_style(s.status)
-            data_smart.append([
-                Paragraph(s.title or "-", P),
-                Paragraph(f'<font color="{txt}">{label}</font>', P),
-                s.created_at.strftime("%Y-%m-%d %H:%M")
-            ])
+
+    if period_days:
+        manual_title = f"Registreringer siste {period_days} dager (manuell)"
+        smart_title  = f"Smartrapporter siste {period_days} dager"
     else:
-        data_smart.append(["Ingen data", "-", "-"])
-    col2 = [10.0*cm, 3.0*cm, MAX_TABLE_W - (10.0*cm + 3.0*cm)]
-    table_s = Table(data_smart, colWidths=col2, repeatRows=2, splitByRow=1)
-    style_s = TableStyle([
-        ("WORDWRAP",(0,0),(-1,-1),"CJK"),
-        ("BACKGROUND",(0,0),(-1,0), GREY_HEAD),
-        ("SPAN",(0,0),(-1,0)),
-        ("FONTNAME",(0,0),(-1,0),"Helvetica-Bold"),
-        ("BACKGROUND",(0,1),(-1,1), colors.HexColor("#DBEAFE")),
-        ("FONTNAME",(0,1),(-1,1),"Helvetica-Bold"),
-        ("INNERGRID",(0,0),(-1,-1), 0.5, GREY_LINE),
-        ("BOX",(0,0),(-1,-1), 0.75, GREY_LINE),
-        ("ALIGN",(0,0),(-1,-1),"LEFT"),
-        ("VALIGN",(0,0),(-1,-1),"TOP"),
-        ("LEFTPADDING",(0,0),(-1,-1),6),("RIGHTPADDING",(0,0),(-1,-1),6),
-        ("TOPPADDING",(0,0),(-1,-1),6),("BOTTOMPADDING",(0,0),(-1,-1),6),
-    ])
-    for i, s in enumerate(latest_smart, start=2):
-        _, bg, _ = _status_style(s.status)
-        style_s.add("BACKGROUND", (1,i), (1,i), bg)
-    table_s.setStyle(style_s)
-    _, th2 = table_s.wrap(MAX_TABLE_W, y-2*cm)
-    table_s.drawOn(c, LEFT_MARGIN, y - th2)
+        manual_title = f"Siste {LATEST_LIMIT} registreringer (manuell)"
+        smart_title  = f"Siste {LATEST_LIMIT} smartrapporter"
+    shown = {"manual": 0, "smart": 0}
 
-    # (تشخيص) اطبع أعداد العناصر للمساعدة
-    print(f"[GEN] cat={category_code} latest_manual={len(latest_records)} latest_smart={len(latest_smart)} totals(man={total_cat}, smart={total_smart})")
+    def story():
+        yield Paragraph(f"HMS Rapport – {_nor_label(category_code)}", H1)
+        yield summary_table
+        yield Spacer(1, 0.8*cm)
+        # 2) القيود اليدوية
+        yield _StreamingTable(
+            [[Paragraph(f"<b>{escape(manual_title)}</b>", P), "", "", ""], ["Tittel", "Status", "Dato", "Opprettet av"]],
+            _LIST_HEAD_STYLE,
+            _manual_cells(_counted(_manual_query(cat.id, since, limit), shown, "manual")),
+            [7.6*cm, 3.0*cm, 3.1*cm, MAX_TABLE_W - (7.6*cm + 3.0*cm + 3.1*cm)],
+            ["Ingen data", "-", "-", "-"])
+        yield Spacer(1, 0.8*cm)
+        # 3) التقارير الذكية
+        yield _StreamingTable(
+            [[Paragraph(f"<b>{escape(smart_title)}</b>", P), "", ""], ["Tittel", "Status", "Dato"]],
+            _LIST_HEAD_STYLE,
+            _smart_cells(_counted(_smart_query(category_code, since, limit), shown, "smart")),
+            [10.0*cm, 3.0*cm, MAX_TABLE_W - (10.0*cm + 3.0*cm)],
+            ["Ingen data", "-", "-"])
 
-    c.showPage(); c.save()
+    # PDF
+    doc = SimpleDocTemplate(out_path, pagesize=A4, leftMargin=LEFT_MARGIN, rightMargin=RIGHT_MARGIN,
+                            topMargin=TOP_MARGIN + 0.4*cm, bottomMargin=BOTTOM_MARGIN,
+                            title=f"HMS Rapport – {_nor_label(category_code)}", author=created_by)
+    doc.build(LazyStory(story()), onFirstPage=on_page, onLaterPages=on_page)
+
+    # (تشخيص) اطبع أعداد العناصر للمساعدة
+    print(f"[GEN] cat={category_code} period_days={period_days} manual_rows={shown['manual']} "
+          f"smart_rows={shown['smart']} pages={doc.page} totals(man={total_cat}, smart={total_smart})")
 
     # سجل التقرير بقاعدة البيانات بحقول صحيحة
     rel_path = os.path.relpath(out_path, start=os.path.dirname(__file__))
-    rec = GeneratedReport(category_code=category_code, file_path=rel_path, created_by=created_by)
+    rec = GeneratedReport(category_code=category_code, file_path=rel_path, created_by=created_by,
+                          content_hash=digest)
     db.session.add(rec); db.session.commit()
 
     return out_path
@@ -0,0 +1,60 @@
+# scheduler_lease.py
+# -*- coding: utf-8 -*-
+"""
+قفل قيادة (leader lease) داخل قاعدة البيانات نفسها:
+- كل عملية (gunicorn worker) تحاول أخذ/تجديد الصف scheduler_leases[name]
+- الأخذ ينجح فقط إذا كان الصف لنا أو انتهت صلاحيته — عبر UPDATE ذرّي واحد
+- المالك الذي يتوقف عن التجديد يفقد القفل بعد ttl ثانية فتستلمه عملية أخرى
+"""
+
+import os
+import socket
+import time
+import uuid
+
+from sqlalchemy import or_, update, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import db
+from models import SchedulerLease
+
+def make_owner_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+def try_acquire(name: str, owner: str, ttl: float) -> bool:
+    """يأخذ القفل أو يجدّده. True إذا كانت هذه العملية هي القائد الآن."""
+    now = time.time()
+    try:
+        res = db.session.execute(
+            update(SchedulerLease)
+            .where(SchedulerLease.name == name,
+                   or_(SchedulerLease.owner == owner, SchedulerLease.expires_at < now))
+            .values(owner=owner, expires_at=now + ttl)
+        )
+        got = res.rowcount == 1
+        if not got:
+            res = db.session.execute(
+                sqlite_insert(SchedulerLease)
+                .values(name=name, owner=owner, expires_at=now + ttl)
+                .on_conflict_do_nothing(index_elements=["name"])
+            )
+            got = res.rowcount == 1
+        db.session.commit()
+        return got
+    except Exception as e:
+        db.session.rollback()
+        print(f"[Lease] acquire failed: {e}")
+        return False
+
+def release(name: str, owner: str) -> None:
+    try:
+        db.session.execute(delete(SchedulerLease)
+                           .where(SchedulerLease.name == name, SchedulerLease.owner == owner))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"[Lease] release failed: {e}")
+
+def current(name: str):
+    row = db.session.get(SchedulerLease, name)
+    return row.to_dict() if row else None
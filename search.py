@@ -0,0 +1,112 @@
+# search.py
+# -*- coding: utf-8 -*-
+"""
+بحث نصّي كامل (SQLite FTS5) في السجلات اليدوية والتقارير الذكية:
+- الجداول records_fts / smart_reports_fts والـ triggers تُنشأ في migrations.py (ترحيل 004)
+- الترتيب bm25 مع وزن أعلى للعنوان؛ ترقيم بـ limit/offset
+- مرحلتان: (1) أفضل rowid لكل جدول بدون snippet، (2) highlight/snippet لصفوف الصفحة فقط
+"""
+
+import html
+import re
+
+from sqlalchemy import text
+
+from database import db
+
+TITLE_WEIGHT = 10.0
+DESC_WEIGHT  = 1.0
+SNIPPET_TOKENS = 16
+_MARK_OPEN, _MARK_CLOSE = "\x02", "\x03"
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+_SOURCES = {
+    # source: (fts table, join from base table "b" (+ filters), category expr)
+    "manual": ("records_fts", "JOIN records b ON b.id = {id} JOIN categories c ON c.id = b.category_id", "c.code"),
+    "smart":  ("smart_reports_fts", "JOIN smart_reports b ON b.id = {id}", "b.category_code"),
+}
+
+def build_match(q: str) -> str:
+    """نص المستخدم ⇒ استعلام FTS5 آمن: كل كلمة بين علامتي تنصيص (AND)، والأخيرة كبادئة."""
+    tokens = _TOKEN_RE.findall(q or "")[:12]
+    if not tokens:
+        return ""
+    parts = [f'"{t}"' for t in tokens]
+    parts[-1] += "*"
+    return " ".join(parts)
+
+def _marked_html(s: str | None) -> str:
+    return html.escape(s or "").replace(_MARK_OPEN, "<mark>").replace(_MARK_CLOSE, "</mark>")
+
+def _filters(category, status):
+    where, params = [], {}
+    if category:
+        where.append("{cat} = :category")
+        params["category"] = category
+    if status:
+        where.append("b.status = :status")
+        params["status"] = status
+    return where, params
+
+def search(q: str, category: str | None = None, source: str | None = None,
+           status: str | None = None, limit: int = 20, offset: int = 0) -> dict:
+    match = build_match(q)
+    if not match:
+        return {"total": 0, "items": []}
+    sources = [source] if source in _SOURCES else list(_SOURCES)
+    where, params = _filters(category, status)
+    params.update(match=match, n=offset + limit)
+
+    # (1) ترتيب ومجموع لكل مصدر — بدون دوال highlight المكلفة.
+    # المطابقة تُحسب أولًا (MATERIALIZED) ثم الفلاتر؛ وإلا قد يختار المخطط مسح الجدول
+    # وتقييم MATCH لكل صف.
+    ranked, total = [], 0
+    for src in sources:
+        fts, join, cat_expr = _SOURCES[src]
+        matched = (f"WITH m AS MATERIALIZED (SELECT rowid AS id, bm25({fts}, {TITLE_WEIGHT}, {DESC_WEIGHT}) AS score "
+                   f"FROM {fts} WHERE {fts} MATCH :match) ")
+        if where:
+            body = f"FROM m {join.format(id='m.id')} WHERE " + " AND ".join(w.format(cat=cat_expr) for w in where)
+        else:
+            body = "FROM m"
+        # count(*) OVER () = المجموع في نفس المرور (قبل LIMIT)
+        rows = db.session.execute(text(matched + f"SELECT m.id, m.score, count(*) OVER () {body} "
+                                                 f"ORDER BY m.score LIMIT :n"), params).all()
+        if rows:
+            total += rows[0][2]
+        ranked += [(score, src, rowid) for rowid, score, _ in rows]
+    ranked.sort()
+    page = ranked[offset:offset + limit]
+
+    # (2) تفاصيل الصفحة فقط: صف واحد لكل نتيجة؛ حدود rowid تُمرَّر إلى FTS5
+    # فلا يُعاد المرور على كل المطابقات لكل سطر
+    details = {}
+    for score, src, rowid in page:
+        fts, join, cat_expr = _SOURCES[src]
+        row = db.session.execute(text(
+            f"SELECT {cat_expr}, b.status, b.created_at, b.title, "
+            f"highlight({fts}, 0, :mo, :mc), snippet({fts}, 1, :mo, :mc, '…', {SNIPPET_TOKENS}) "
+            f"FROM {fts} f {join.format(id='f.rowid')} "
+            f"WHERE f.{fts} MATCH :match AND f.rowid >= :id AND f.rowid <= :id"),
+            {"match": match, "id": rowid, "mo": _MARK_OPEN, "mc": _MARK_CLOSE}).first()
+        if row is None:
+            continue
+        cat, st, created, title, title_hl, snip = row
+        details[(src, rowid)] = {
+            "source": src, "id": rowid, "category": cat, "status": st,
+            "created_at": str(created).replace(" ", "T", 1) if created else None,
+            "title": title, "title_html": _marked_html(title_hl), "snippet_html": _marked_html(snip),
+        }
+    items = []
+    for score, src, rowid in page:
+        d = details.get((src, rowid))
+        if d:
+            d["score"] = round(-score, 6)   # bm25 في FTS5 سالب: الأصغر أفضل
+            items.append(d)
+    return {"total": total, "items": items}
+
+def rebuild_search_index() -> None:
+    """لإصلاح الانحراف بعد SQL مباشر عطّل الـ triggers أو استيراد جماعي."""
+    for fts, _, _ in _SOURCES.values():
+        db.session.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+    db.session.commit()
@@ -1,28 +1,288 @@
 # smart_ai.py
 # -*- coding: utf-8 -*-
-import os, json, re, time
-from typing import List, Dict, Any, Tuple
-from openai import OpenAI
+import os, json, re, time, hashlib, threading, random
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import List, Dict, Any, Tuple, Iterator, Callable
+import tenacity
 try:
     from rag import top_k
 except Exception:
     def top_k(query: str, k: int = 3):
         # احتياط: لا سياق إضافي إن تعذّر RAG
         return []
+from llm_cache import cache as response_cache
 try:
     from models import HazardTemplate  # لو الجدول موجود
 except Exception:
     HazardTemplate = None              # فallback إن ما كان موجود
 
-# ===== إعداد العميل (مطلوب مفتاح) =====
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "").strip()
-if not OPENAI_API_KEY:
-    # نرمي استثناء صريح بدل "ذكاء خفيف"
-    raise RuntimeError("OPENAI_API_KEY is not set. Please set it before generating smart reports.")
+# ===== إعداد العميل (كسول: يُنشأ عند أول استدعاء) =====
+# لا نستورد openai ولا نتحقق من المفتاح وقت الاستيراد: تشغيل التطبيق أسرع،
+# ومفتاح يُضبط لاحقًا (أو يتغيّر) يُلتقط بدون إعادة تشغيل.
+HTTP_TIMEOUT         = float(os.getenv("HMS_LLM_TIMEOUT", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HMS_LLM_CONNECT_TIMEOUT", "5"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HMS_LLM_MAX_CONNECTIONS", "20"))
+HTTP_KEEPALIVE       = int(os.getenv("HMS_LLM_MAX_KEEPALIVE", "10"))
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+_client = None
+_client_key = None
+_client_lock = threading.Lock()
+
+def _get_client():
+    global _client, _client_key
+    key = os.getenv("OPENAI_API_KEY", "").strip()
+    if not key:
+        # نرمي استثناء صريح بدل "ذكاء خفيف"
+        raise RuntimeError("OPENAI_API_KEY is not set. Please set it before generating smart reports.")
+    with _client_lock:
+        if _client is None or key != _client_key:
+            import httpx
+            from openai import OpenAI
+            # اتصال مشترك (keep-alive) لكل الطلبات بدل اتصال جديد لكل تقرير
+            http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                    max_keepalive_connections=HTTP_KEEPALIVE,
+                                    keepalive_expiry=60),
+                timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            )
+            # max_retries=0: إعادة المحاولة عندنا (_call_with_retry) مع حد التزامن
+            _client = OpenAI(api_key=key, http_client=http_client, max_retries=0)
+            _client_key = key
+        return _client
+
+# ===== حد التزامن + إعادة المحاولة لاستدعاءات النموذج =====
+# عدد محدود من الاستدعاءات المتزامنة لكل عملية؛ الباقي ينتظر دوره (حتى LLM_QUEUE_TIMEOUT).
+# أخطاء 429/5xx/الشبكة تُعاد بتأخير أُسّي عشوائي (jitter) مع احترام Retry-After.
+LLM_MAX_INFLIGHT  = int(os.getenv("HMS_LLM_MAX_INFLIGHT", "4"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("HMS_LLM_QUEUE_TIMEOUT", "30"))
+LLM_MAX_ATTEMPTS  = int(os.getenv("HMS_LLM_MAX_ATTEMPTS", "5"))
+LLM_BACKOFF_BASE  = float(os.getenv("HMS_LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX   = float(os.getenv("HMS_LLM_BACKOFF_MAX", "20"))
+
+_llm_slots = threading.BoundedSemaphore(LLM_MAX_INFLIGHT)
+_metrics_lock = threading.Lock()
+_metrics = {"calls": 0, "succeeded": 0, "failed": 0, "retried": 0, "rate_limited": 0,
+            "rejected": 0, "queued": 0, "queued_total": 0, "inflight": 0}
+
+def _metric(name:str, delta:int=1)->None:
+    with _metrics_lock:
+        _metrics[name] += delta
+
+def llm_metrics()->Dict[str,Any]:
+    with _metrics_lock:
+        out = dict(_metrics)
+    out["max_inflight"] = LLM_MAX_INFLIGHT
+    return out
+
+def _status_code(exc:BaseException):
+    return getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+
+def _is_retryable(exc:BaseException)->bool:
+    code = _status_code(exc)
+    if code is not None:
+        return code in (408, 409, 429) or code >= 500
+    # أخطاء الشبكة/المهلة (openai.APIConnectionError / APITimeoutError / httpx.TransportError)
+    return type(exc).__name__ in ("APIConnectionError", "APITimeoutError") or \
+        any(c.__name__ == "TransportError" for c in type(exc).__mro__)
+
+def _retry_after(exc:BaseException):
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        ms = headers.get("retry-after-ms")
+        if ms:
+            return float(ms) / 1000.0
+        ra = headers.get("retry-after")
+        if not ra:
+            return None
+        try:
+            return float(ra)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(ra).timestamp() - time.time())
+    except Exception:
+        return None
+
+class _wait_backoff(tenacity.wait.wait_base):
+    """Full-jitter exponential backoff، وRetry-After من الخادم إن كان أطول."""
+
+    def __call__(self, retry_state)->float:
+        ceiling = min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** (retry_state.attempt_number - 1)))
+        wait = random.uniform(0, ceiling)
+        exc = retry_state.outcome.exception() if retry_state.outcome else None
+        ra = _retry_after(exc) if exc else None
+        return min(max(wait, ra), LLM_BACKOFF_MAX * 3) if ra else wait
+
+def _before_sleep(retry_state)->None:
+    _metric("retried")
+    exc = retry_state.outcome.exception()
+    if _status_code(exc) == 429:
+        _metric("rate_limited")
+    print(f"[SmartAI] retry {retry_state.attempt_number}/{LLM_MAX_ATTEMPTS} after {type(exc).__name__} "
+          f"(sleep {retry_state.next_action.sleep:.2f}s)")
+
+@contextmanager
+def _llm_slot():
+    _metric("queued"); _metric("queued_total")
+    acquired = _llm_slots.acquire(timeout=LLM_QUEUE_TIMEOUT)
+    _metric("queued", -1)
+    if not acquired:
+        _metric("rejected")
+        raise RuntimeError("LLM concurrency limit: timed out waiting for a free slot")
+    _metric("inflight")
+    try:
+        yield
+    finally:
+        _metric("inflight", -1)
+        _llm_slots.release()
+
+def _retrying():
+    return tenacity.Retrying(
+        stop=tenacity.stop_after_attempt(LLM_MAX_ATTEMPTS),
+        wait=_wait_backoff(),
+        retry=tenacity.retry_if_exception(_is_retryable),
+        before_sleep=_before_sleep,
+        reraise=True,
+    )
+
+def _call_with_retry(fn:Callable[[], Any]):
+    """ينفّذ fn داخل خانة تزامن؛ الخانة تُحرَّر أثناء الانتظار بين المحاولات."""
+    def once():
+        with _llm_slot():
+            return fn()
+    _metric("calls")
+    try:
+        out = _retrying()(once)
+    except Exception:
+        _metric("failed")
+        raise
+    _metric("succeeded")
+    return out
+
+def _stream_with_retry(make_iter:Callable[[], Iterator[str]])->Iterator[str]:
+    """
+    مثل _call_with_retry لكن لمولّد متدفّق: إعادة المحاولة فقط قبل وصول أول جزء،
+    والخانة محجوزة حتى نهاية التدفق.
+    """
+    _metric("calls")
+    slot = None
+    try:
+        def first():
+            nonlocal slot
+            ctx = _llm_slot()
+            ctx.__enter__()
+            try:
+                it = iter(make_iter())
+                head = next(it, None)
+            except BaseException:
+                ctx.__exit__(None, None, None)
+                raise
+            slot = ctx
+            return it, head
+        it, head = _retrying()(first)
+        if head is not None:
+            yield head
+        yield from it
+    except Exception:
+        _metric("failed")
+        raise
+    finally:
+        if slot is not None:
+            slot.__exit__(None, None, None)
+    _metric("succeeded")
+
+# ===== واجهات النموذج (backends) =====
+# HMS_LLM_BACKEND=openai (افتراضي) أو stub (ردود ثابتة محلية بدون شبكة).
+# لاختبار الحمل عبر HTTP: شغّل llm_stub_server.py واضبط OPENAI_BASE_URL عليه مع backend=openai.
+class LLMBackend:
+    name = "base"
+
+    def complete(self, *, model:str, temperature:float, system:str, user:str)->str:
+        raise NotImplementedError
+
+    def stream(self, *, model:str, temperature:float, system:str, user:str)->Iterator[str]:
+        yield self.complete(model=model, temperature=temperature, system=system, user=user)
+
+class OpenAIBackend(LLMBackend):
+    name = "openai"
+
+    def _create(self, model, temperature, system, user, **kw):
+        return _get_client().chat.completions.create(
+            model=model,
+            temperature=temperature,
+            messages=[{"role":"system","content":system},
+                      {"role":"user","content":user}],
+            response_format={"type":"json_object"},
+            **kw
+        )
+
+    def complete(self, *, model, temperature, system, user):
+        resp = self._create(model, temperature, system, user)
+        return resp.choices[0].message.content
+
+    def stream(self, *, model, temperature, system, user):
+        for chunk in self._create(model, temperature, system, user, stream=True):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+_STUB_TEMA = {
+    "workers":"Arbeidssikkerhet og bemanning","environment":"Miljø og avfall","deviations":"Avvik i drift",
+    "risk":"Risikovurdering kjøkken","ppe":"Personlig verneutstyr","emergency":"Beredskap og brann",
+    "maintenance":"Vedlikehold av utstyr","reports":"Generell HMS-rapport",
+}
+
+def stub_payload(category:str, user:str)->Dict[str,Any]:
+    """Rapport gyldig iht. skjemaet, deterministisk per (kategori, prompt) – for test/last uten nett."""
+    h = int(hashlib.sha1((user or "").encode("utf-8")).hexdigest()[:8], 16)
+    severity = SEVERITY_ENUM[h % len(SEVERITY_ENUM)]
+    tema = _STUB_TEMA.get(category, category.capitalize() or "HMS")
+    titles = ["Sammendrag","Tema","Bakgrunn","Observasjoner","Årsaksanalyse (5 hvorfor)",
+              "Risikovurdering","Tiltaksplan","Etterlevelse","Konklusjon"]
+    bodies = {
+        "Sammendrag": f"Hendelse innen {tema.lower()} registrert og vurdert. Samlet risiko: {severity}.",
+        "Tema": tema,
+        "Risikovurdering": f"Sannsynlighet og konsekvens vurdert; nivå {severity} før tiltak.",
+        "Tiltaksplan": "Se tiltakstabellen.",
+        "Etterlevelse": "Vurdert mot internkontrollforskriften og HACCP.",
+        "Konklusjon": "Tiltak følges opp til lukking.",
+    }
+    return {
+        "title": f"Hendelsesrapport – {tema}",
+        "severity": severity,
+        "status": "open",
+        "sections": [{"title": t, "body": bodies.get(t, f"{t}: beskrevet iht. rutine (ref {h % 1000:03d}).")} for t in titles],
+        "actions": [
+            {"tiltak": "Sikre området og informere skiftleder.", "ansvar": "Skiftleder", "frist": "Straks", "status": "Igangsatt"},
+            {"tiltak": "Gjennomgå rutine og oppdatere sjekkliste.", "ansvar": "HMS-ansvarlig", "frist": "+7 dager", "status": "Planlagt"},
+        ],
+        "risk_table": [["Risiko","Beskrivelse","Tiltak"], [severity, tema, "Oppfølging iht. tiltaksplan"]],
+    }
+
+class StubBackend(LLMBackend):
+    name = "stub"
+    latency = float(os.getenv("HMS_STUB_LATENCY_MS", "0")) / 1000.0
+
+    def complete(self, *, model, temperature, system, user):
+        if self.latency:
+            time.sleep(self.latency)
+        m = re.search(r"^Kategori:\s*(\S+)", user or "", re.M)
+        return json.dumps(stub_payload(m.group(1) if m else "", user), ensure_ascii=False)
+
+    def stream(self, *, model, temperature, system, user):
+        text = self.complete(model=model, temperature=temperature, system=system, user=user)
+        for i in range(0, len(text), 64):
+            yield text[i:i + 64]
+
+_BACKENDS = {"openai": OpenAIBackend(), "stub": StubBackend()}
+
+def get_backend()->LLMBackend:
+    name = os.getenv("HMS_LLM_BACKEND", "openai").strip().lower()
+    if name not in _BACKENDS:
+        raise RuntimeError(f"Unknown HMS_LLM_BACKEND: {name}")
+    return _BACKENDS[name]
 
 # ===== ثوابت =====
+LLM_MODEL = "gpt-4o-mini"
+LLM_TEMPERATURE = 0.2
 SEVERITY_ENUM = ["Lav","Middels","Høy"]
 STATUS_ENUM = ["open","processing","closed"]
 
@@ -90,8 +350,9 @@ def _hazards_context(limit:int=20)->str:
 
 def _build_user_prompt(notes:str, category:str, reporter:str, system_code:str|None=None)->str:
     # RAG سياق من مستنداتك (إن وُجدت)
-    chunks = top_k(notes or "", k=6)
-    ctx = "\n---\n".join([c["text"][:1200] for c in chunks]) if chunks else "Ingen utdrag tilgjengelig."
+    # top_k يرجّع مقاطع قصيرة ذات صلة {title, text, offset, score} وليس ملفات كاملة
+    chunks = top_k(notes or "", k=4)
+    ctx = "\n---\n".join([f"[{c['title']}]\n{c['text']}" for c in chunks]) if chunks else "Ingen utdrag tilgjengelig."
 
     hz = _hazards_context()
 
@@ -155,29 +416,123 @@ def generate_deep_hms_report(*, notes:str, category:str, reporter:str, status:st
     notes = _clean(notes)
     user = _build_user_prompt(notes, category, reporter, system_code)
 
+    backend = get_backend()
+    # كاش: نفس الموديل/الحرارة/البرومبت ⇒ نفس الرد بدون استدعاء API
+    cache_key = response_cache.make_key(f"{backend.name}:{LLM_MODEL}", LLM_TEMPERATURE, BASE_SYSTEM_NO, user)
+    cached = response_cache.get(cache_key)
+    if cached:
+        data = json.loads(cached)
+        data["status"] = status if status in STATUS_ENUM else "open"
+        return _post_process(data)
+
     # محاولات قليلة لإجبار JSON صحيح
     last_err = ""
     for attempt in range(2):
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            temperature=0.2,
-            messages=[{"role":"system","content":BASE_SYSTEM_NO},
-                      {"role":"user","content":user}],
-            response_format={"type":"json_object"}
-        )
-        content = resp.choices[0].message.content
+        # أخطاء النقل (429/5xx) تُعاد داخل _call_with_retry؛ هنا فقط رد غير صالح
+        content = _call_with_retry(lambda: backend.complete(model=LLM_MODEL, temperature=LLM_TEMPERATURE,
+                                                            system=BASE_SYSTEM_NO, user=user))
         try:
             data = json.loads(content)
             ok, why = _validate_payload(data)
             if not ok:
                 last_err = f"validation: {why}"
-                time.sleep(0.3)
                 continue
+            response_cache.put(cache_key, content)
             data["status"] = status if status in STATUS_ENUM else "open"
             data = _post_process(data)
             return data
         except Exception as e:
             last_err = f"json: {e}"
-            time.sleep(0.3)
             continue
     raise RuntimeError(f"Smart generation failed: {last_err}")
+
+# ===== توليد متدفّق (streaming) للمعاينة الحيّة =====
+class _JsonArrayWatcher:
+    """
+    يراقب نص JSON يصل على دفعات ويُخرج عناصر مصفوفة معيّنة ("sections" مثلًا)
+    فور اكتمال كل عنصر، بدون انتظار نهاية الرد.
+    """
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, key: str):
+        self._key_re = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        self._pos = None      # موضع القراءة التالي داخل المصفوفة
+        self._closed = False
+
+    def feed(self, buf: str) -> List[Any]:
+        out = []
+        if self._closed:
+            return out
+        if self._pos is None:
+            m = self._key_re.search(buf)
+            if not m:
+                return out
+            self._pos = m.end()
+        while True:
+            i = self._pos
+            while i < len(buf) and buf[i] in " \t\r\n,":
+                i += 1
+            if i >= len(buf):
+                return out
+            if buf[i] == "]":
+                self._closed = True
+                return out
+            try:
+                item, end = self._decoder.raw_decode(buf, i)
+            except ValueError:
+                return out          # العنصر لم يكتمل بعد
+            self._pos = end
+            out.append(item)
+
+def stream_deep_hms_report(*, notes:str, category:str, reporter:str, status:str="open", system_code:str|None=None)->Iterator[Dict[str,Any]]:
+    """
+    نفس generate_deep_hms_report لكن كمولّد أحداث:
+      {"type": "section", "data": {...}}  عند اكتمال كل قسم في الرد المتدفق
+      {"type": "action",  "data": {...}}  عند اكتمال كل إجراء
+      {"type": "result",  "data": {...}}  النتيجة النهائية بعد التحقق (دائمًا آخر حدث)
+    لو فشل التحقق من الرد المتدفق نرجع لـ generate_deep_hms_report (مع محاولاته).
+    """
+    notes = _clean(notes)
+    user = _build_user_prompt(notes, category, reporter, system_code)
+    final_status = status if status in STATUS_ENUM else "open"
+
+    backend = get_backend()
+    cache_key = response_cache.make_key(f"{backend.name}:{LLM_MODEL}", LLM_TEMPERATURE, BASE_SYSTEM_NO, user)
+    cached = response_cache.get(cache_key)
+    if cached:
+        data = json.loads(cached)
+        data["status"] = final_status
+        data = _post_process(data)
+        for sec in data.get("sections", []):
+            yield {"type": "section", "data": sec}
+        for act in data.get("actions", []):
+            yield {"type": "action", "data": act}
+        yield {"type": "result", "data": data}
+        return
+
+    watchers = {"section": _JsonArrayWatcher("sections"), "action": _JsonArrayWatcher("actions")}
+    buf = ""
+    for delta in _stream_with_retry(lambda: backend.stream(model=LLM_MODEL, temperature=LLM_TEMPERATURE,
+                                                           system=BASE_SYSTEM_NO, user=user)):
+        buf += delta
+        for kind, w in watchers.items():
+            for item in w.feed(buf):
+                if isinstance(item, dict):
+                    if kind == "section":
+                        item["body"] = _clean(item.get("body", ""))
+                    yield {"type": kind, "data": item}
+
+    try:
+        data = json.loads(buf)
+        ok, why = _validate_payload(data)
+    except Exception as e:
+        ok, why = False, f"json: {e}"
+    if not ok:
+        print(f"[SmartAI] streamed payload rejected ({why}), retrying without stream")
+        data = generate_deep_hms_report(notes=notes, category=category, reporter=reporter,
+                                        status=final_status, system_code=system_code)
+        yield {"type": "result", "data": data}
+        return
+    response_cache.put(cache_key, buf)
+    data["status"] = final_status
+    yield {"type": "result", "data": _post_process(data)}
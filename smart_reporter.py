@@ -1,19 +1,53 @@
 # smart_reporter.py
 # -*- coding: utf-8 -*-
 """
-توليد PDF منسّق للتقارير الذكية:
+توليد PDF منسّق للتقارير الذكية (ReportLab platypus):
 - عنوان
 - شارة حالة ملونة (Åpen / Under behandling / Løst)
 - ميتاداتا (Kategori, Dato, Opprettet av, Språk)
-- نص التقرير المنسق
-- جدول تقييم المخاطر
+- نص التقرير: الأقسام (sections) أو الوصف، لفّ حسب عرض الخط الفعلي
+- جدول التدابير (actions) وجدول تقييم المخاطر: عدة صفحات مع تكرار رأس الجدول
+- العناصر تُولَّد عند الحاجة (LazyStory) وتُحرَّر بعد وضعها في الصفحة
 """
 
 import os
-from reportlab.pdfgen import canvas
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_LEFT
 from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle
 from reportlab.lib.units import cm
-from reportlab.lib import colors
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from pdf_resources import FONT, FONT_BOLD, logo_image, shape
+
+# يُرفع عند أي تغيير في شكل PDF ⇒ بصمات render_jobs القديمة لا تطابق
+TEMPLATE_VERSION = 3
+
+PAGE_W, PAGE_H = A4
+MARGIN_X, MARGIN_TOP, MARGIN_BOTTOM = 2*cm, 2.2*cm, 2*cm
+CONTENT_W = PAGE_W - 2 * MARGIN_X
+RISK_COL_WIDTHS = (3*cm, 9*cm, CONTENT_W - 12*cm)
+ACTION_COL_WIDTHS = (7.5*cm, 3.5*cm, 2.8*cm, CONTENT_W - 13.8*cm)
+TABLE_CHUNK_ROWS = 40   # صفوف كل Table: الجداول الطويلة تُقسَّم بدل قياس الجدول كله مرة واحدة
+
+H1 = ParagraphStyle(name="H1", fontName=FONT_BOLD, fontSize=14, leading=18, spaceAfter=6,
+                    rightIndent=2.5*cm)   # مكان الشعار
+H2 = ParagraphStyle(name="H2", fontName=FONT_BOLD, fontSize=12, leading=15, spaceBefore=8, spaceAfter=4,
+                    keepWithNext=1)
+BODY = ParagraphStyle(name="Body", fontName=FONT, fontSize=10, leading=14, alignment=TA_LEFT,
+                      spaceAfter=4, wordWrap="CJK")
+META = ParagraphStyle(name="Meta", parent=BODY, spaceAfter=0)
+CELL = ParagraphStyle(name="Cell", fontName=FONT, fontSize=9, leading=11, wordWrap="CJK")
+CELL_HEAD = ParagraphStyle(name="CellHead", parent=CELL, fontName=FONT_BOLD)
+BADGE = ParagraphStyle(name="Badge", fontName=FONT_BOLD, fontSize=9, leading=11, textColor=colors.white)
+
+_STATUS_BADGES = {
+    "closed":     ("Løst", colors.Color(0, 0.6, 0)),
+    "processing": ("Under behandling", colors.Color(1, 0.8, 0)),
+}
+_OPEN_BADGE = ("Åpen sak", colors.Color(1, 0, 0))
 
 def ensure_dir(path: str) -> None:
     os.makedirs(path, exist_ok=True)
@@ -28,140 +62,148 @@ def build_paths(uploads_root: str, category_code: str, report_id: int):
     pdf_name = f"smart_{category_code}_{report_id}.pdf"
     return base_dir, pdf_name, None  # html_name محجوز لاحقًا
 
-def _new_page_if_needed(c: canvas.Canvas, y: float, min_y: float = 2.5*cm) -> float:
-    if y < min_y:
-        c.showPage()
-        return A4[1] - 2.5*cm
-    return y
-
-def draw_wrapped(c: canvas.Canvas, x: float, y: float, text: str,
-                 width_chars: int = 95, leading: int = 14,
-                 font: str = "Helvetica", size: int = 10) -> float:
+class LazyStory(list):
     """
-    لفّ نص بسيط على عدد أحرف تقريبي لكل سطر (سهل وسريع).
-    يضيف صفحات جديدة عند الحاجة.
+    قائمة flowables تُملأ من مولّد عند الحاجة: doc.build() يستهلك من أولها (del [0])
+    ويسأل len() قبل كل عنصر، فنملأ بضعة عناصر مسبقًا فقط (keepWithNext يحتاج النظر للأمام).
     """
-    c.setFont(font, size)
-    for para in (text or "").splitlines():
-        buf = ""
-        words = para.split()
-        if not words:
-            y -= leading // 2
-            y = _new_page_if_needed(c, y)
-            continue
-        for w in words:
-            if len((buf + " " + w).strip()) <= width_chars:
-                buf = (buf + " " + w).strip()
-            else:
-                c.drawString(x, y, buf)
-                y -= leading
-                y = _new_page_if_needed(c, y)
-                buf = w
-        if buf:
-            c.drawString(x, y, buf)
-            y -= leading
-            y = _new_page_if_needed(c, y)
-        y -= 4
-        y = _new_page_if_needed(c, y)
-    return y
-
-def draw_table(c: canvas.Canvas, x: float, y: float, data,
-               col_widths=(3*cm, 9*cm, 5*cm), row_h: int = 16) -> float:
-    """
-    جدول بسيط لثلاثة أعمدة (Risiko, Beskrivelse, Tiltak).
-    يضيف صفحات جديدة عند الحاجة.
-    """
-    if not data:
-        return y
-    table_w = sum(col_widths)
-    for r, row in enumerate(data):
-        y = _new_page_if_needed(c, y, min_y=3*cm)
-        bg = colors.lightgrey if r == 0 else colors.whitesmoke
-        c.setFillColor(bg)
-        c.rect(x, y - row_h, table_w, row_h, fill=1, stroke=0)
-        c.setFillColor(colors.black)
-
-        cx = x
-        for i, cell in enumerate(row[:3]):  # نضمن ثلاثة أعمدة
-            c.rect(cx, y - row_h, col_widths[i], row_h, fill=0, stroke=1)
-            txt = str(cell) if cell is not None else ""
-            c.setFont("Helvetica", 9)
-            c.drawString(cx + 4, y - row_h + 4, txt[:120])  # قصّة خفيفة داخل الخلية
-            cx += col_widths[i]
-        y -= row_h
-    return y - 6
-
-def render_pdf(pdf_path: str, meta: dict, logo_path: str | None = None) -> None:
+    def __init__(self, source, lookahead: int = 8):
+        super().__init__()
+        self._source = iter(source)
+        self._lookahead = lookahead
+
+    def __len__(self):
+        while self._source is not None and list.__len__(self) < self._lookahead:
+            try:
+                self.append(next(self._source))
+            except StopIteration:
+                self._source = None
+        return list.__len__(self)
+
+def _p(text, style=BODY) -> Paragraph:
+    """نص عادي (من المستخدم/النموذج) ⇒ Paragraph: هروب XML وأسطر جديدة ⇒ <br/>."""
+    return Paragraph(escape(shape(str(text if text is not None else ""))).replace("\n", "<br/>"), style)
+
+def _text_blocks(text: str):
+    """فقرة لكل كتلة مفصولة بسطر فارغ: فقرات قصيرة تُقسَّم وتُحرَّر أسرع من فقرة واحدة ضخمة."""
+    block = []
+    for line in (text or "").splitlines():
+        if line.strip():
+            block.append(line.strip())
+        elif block:
+            yield _p("\n".join(block))
+            block = []
+    if block:
+        yield _p("\n".join(block))
+
+def _badge(status: str) -> Table:
+    label, color = _STATUS_BADGES.get((status or "open").strip().lower(), _OPEN_BADGE)
+    t = Table([[Paragraph(label, BADGE)]], colWidths=[145], hAlign="LEFT")
+    t.setStyle(TableStyle([
+        ("BACKGROUND", (0, 0), (-1, -1), color),
+        ("TOPPADDING", (0, 0), (-1, -1), 2), ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
+        ("LEFTPADDING", (0, 0), (-1, -1), 6),
+    ]))
+    return t
+
+def _table_chunks(head, rows, col_widths):
+    """جدول طويل ⇒ عدة Table متتالية (كل منها يُقسَّم بين الصفحات مع تكرار الرأس)."""
+    style = TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+        ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.whitesmoke, colors.white]),
+        ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
+        ("VALIGN", (0, 0), (-1, -1), "TOP"),
+        ("LEFTPADDING", (0, 0), (-1, -1), 4), ("RIGHTPADDING", (0, 0), (-1, -1), 4),
+        ("TOPPADDING", (0, 0), (-1, -1), 3), ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
+    ])
+    head_row = [_p(h, CELL_HEAD) for h in head]
+    chunk = []
+    for row in rows:
+        chunk.append([_p(cell, CELL) for cell in row])
+        if len(chunk) == TABLE_CHUNK_ROWS:
+            yield Table([head_row] + chunk, colWidths=col_widths, repeatRows=1, style=style)
+            chunk = []
+    if chunk:
+        yield Table([head_row] + chunk, colWidths=col_widths, repeatRows=1, style=style)
+
+def _risk_rows(rows):
+    for row in rows:
+        row = list(row) if isinstance(row, (list, tuple)) else [row]
+        yield (row + ["", "", ""])[:3]   # نضمن ثلاثة أعمدة
+
+def _action_rows(actions):
+    for a in actions:
+        if isinstance(a, dict):
+            yield [a.get("tiltak") or a.get("what") or "", a.get("ansvar") or a.get("who") or "",
+                   a.get("frist") or a.get("due") or "", a.get("status") or ""]
+        else:
+            yield [a, "", "", ""]
+
+def _sections_text(sections) -> str:
+    # نفس صيغة الوصف الاحتياطي في /smart_report/confirm
+    return "\n\n".join(f"{s.get('title','')}:\n{s.get('body','')}" for s in sections)
+
+def _story(meta: dict):
+    """مولّد flowables بترتيب الصفحة؛ لا شيء منها موجود قبل أن يحتاجه doc.build()."""
+    yield _p(meta.get("title", "HMS Smartrapport"), H1)
+    yield _badge(meta.get("status"))
+    yield Spacer(1, 8)
+    yield _p(f"Kategori: {meta.get('category_code','')}", META)
+    yield _p(f"Dato: {meta.get('date','')}", META)
+    yield _p(f"Opprettet av: {meta.get('created_by','')}", META)
+    yield _p(f"Språk: {(meta.get('lang') or 'no').upper()}", META)
+    yield Spacer(1, 10)
+
+    sections = [s for s in (meta.get("sections") or []) if isinstance(s, dict)]
+    description = (meta.get("description") or "").strip()
+    if sections:
+        if description and description != _sections_text(sections).strip():
+            yield _p("Beskrivelse:", H2)
+            yield from _text_blocks(description)
+        for s in sections:
+            yield _p(s.get("title") or "", H2)
+            yield from _text_blocks(s.get("body") or "")
+    else:
+        yield _p("Rapporttekst:", H2)
+        yield from _text_blocks(description)
+
+    actions = meta.get("actions") or []
+    if isinstance(actions, list) and actions:
+        yield _p("Tiltak:", H2)
+        yield from _table_chunks(["Tiltak", "Ansvar", "Frist", "Status"], _action_rows(actions), ACTION_COL_WIDTHS)
+
+    rows = meta.get("table_rows") or []
+    if rows:
+        yield _p("Risikovurdering:", H2)
+        head, *body = list(_risk_rows(rows))
+        yield from _table_chunks(head, body, RISK_COL_WIDTHS)
+
+def render_pdf(pdf_path: str, meta: dict, logo_path: str | None = None) -> int:
     """
-    main renderer
+    main renderer — يرجّع عدد الصفحات
     meta المتوقعة:
       title, status(open/processing/closed), category_code, date, created_by,
-      lang, severity, description, table_rows
+      lang, severity, description, sections, actions, table_rows
     """
-    c = canvas.Canvas(pdf_path, pagesize=A4)
-    w, h = A4
-    x = 2*cm
-    y = h - 2.2*cm
-
-    # شعار (اختياري)
-    if logo_path and os.path.exists(logo_path):
-        try:
-            c.drawImage(logo_path, w - 4*cm, h - 3*cm, width=2.5*cm, height=2.5*cm, mask='auto')
-        except Exception:
-            pass
-
-    # عنوان
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(x, y, meta.get("title", "HMS Smartrapport"))
-    y -= 18
-
-    # شارة الحالة الملونة
-    status = (meta.get("status") or "open").strip().lower()
-    if status == "closed":
-        color = (0, 0.6, 0); label = "Løst"
-    elif status == "processing":
-        color = (1, 0.8, 0); label = "Under behandling"
-    else:
-        color = (1, 0, 0); label = "Åpen sak"
-    c.setFillColorRGB(*color)
-    c.roundRect(x, y - 12, 145, 16, 3, fill=1, stroke=0)
-    c.setFillColor(colors.white)
-    c.setFont("Helvetica-Bold", 9)
-    c.drawString(x + 6, y - 9, label)
-    c.setFillColor(colors.black)
-    y -= 26
-
-    # ميتاداتا
-    c.setFont("Helvetica", 10)
-    meta_lines = [
-        f"Kategori: {meta.get('category_code','')}",
-        f"Dato: {meta.get('date','')}",
-        f"Opprettet av: {meta.get('created_by','')}",
-        f"Språk: {meta.get('lang','no').upper()}",
-    ]
-    for line in meta_lines:
-        c.drawString(x, y, line)
-        y -= 14
-        y = _new_page_if_needed(c, y)
-
-    y -= 6
-    y = _new_page_if_needed(c, y)
-
-    # نص التقرير
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(x, y, "Rapporttekst:")
-    y -= 14
-    y = draw_wrapped(c, x, y, meta.get("description", ""), 95, leading=14)
-
-    # جدول تقييم المخاطر
-    rows = meta.get("table_rows") or []
-    if rows:
-        c.setFont("Helvetica-Bold", 12)
-        y = _new_page_if_needed(c, y)
-        c.drawString(x, y, "Risikovurdering:")
-        y -= 16
-        y = draw_table(c, x, y, rows)
-
-    # إنهاء
-    c.showPage()
-    c.save()
+    logo = logo_image(logo_path)
+
+    def first_page(c, doc):
+        # شعار (اختياري)
+        if logo is not None:
+            try:
+                c.drawImage(logo, PAGE_W - 4*cm, PAGE_H - 3*cm, width=2.5*cm, height=2.5*cm, mask='auto')
+            except Exception:
+                pass
+        later_pages(c, doc)
+
+    def later_pages(c, doc):
+        c.setFont(FONT, 8)
+        c.setFillColor(colors.grey)
+        c.drawRightString(PAGE_W - MARGIN_X, 1.2*cm, f"Side {doc.page}")
+
+    doc = SimpleDocTemplate(pdf_path, pagesize=A4, leftMargin=MARGIN_X, rightMargin=MARGIN_X,
+                            topMargin=MARGIN_TOP, bottomMargin=MARGIN_BOTTOM,
+                            title=str(meta.get("title") or "HMS Smartrapport"),
+                            author=str(meta.get("created_by") or ""))
+    doc.build(LazyStory(_story(meta)), onFirstPage=first_page, onLaterPages=later_pages)
+    return doc.page
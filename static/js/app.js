@@ -85,7 +85,8 @@
   }
 
   async function loadFeed(){
-    const url = state.cat ? `/api/records?category=${encodeURIComponent(state.cat)}` : '/api/records';
+    const fields = 'fields=id,category,title,description,status,created_at&limit=50';
+    const url = state.cat ? `/api/records?category=${encodeURIComponent(state.cat)}&${fields}` : `/api/records?${fields}`;
     const j = await fetchJSON(url);
     renderFeed(j.records||[]);
   }
@@ -61,8 +61,24 @@ document.addEventListener("DOMContentLoaded", () => {
   let currentCategory = "";
   let currentEditingId = null;
 
+  // الجدول يحتاج هذه الحقول فقط؛ الصفحات التالية تُجلب بالمؤشّر "next"
+  const FEED_FIELDS = "id,category,title,status,created_at";
+  const FEED_PAGE = 50;
+  let feedNext = null;
+  let feedCount = 0;
+  const moreBtn = document.createElement("button");
+  moreBtn.className = "ghost-btn btn-small";
+  moreBtn.textContent = "Vis flere";
+  moreBtn.style.display = "none";
+  feedEmpty.insertAdjacentElement("afterend", moreBtn);
+
   const API = {
-    records: (cat="") => fetch(`/api/records${cat?`?category=${encodeURIComponent(cat)}`:""}`).then(r=>r.json()),
+    records: (cat="", after="") => {
+      const qs = new URLSearchParams({ fields: FEED_FIELDS, limit: String(FEED_PAGE) });
+      if(cat) qs.set("category", cat);
+      if(after) qs.set("after", after);
+      return fetch(`/api/records?${qs}`).then(r=>r.json());
+    },
     stats:   (cat="") => fetch(`/api/stats${cat?`?category=${encodeURIComponent(cat)}`:""}`).then(r=>r.json()),
     form:    (cat)    => fetch(`/forms/${cat}`).then(r=>r.text()),
     create:  (fd)     => fetch(`/api/create_record`, { method: "POST", body: fd }).then(r=>r.json()),
@@ -92,14 +108,14 @@ document.addEventListener("DOMContentLoaded", () => {
       <button class="ghost-btn btn-small" data-action="del" data-id="${id}">🗑</button>
     `;
   }
-  function updateTable(rows){
-    feedBody.innerHTML = "";
-    if(!rows || !rows.length){ feedEmpty.style.display = "block"; return; }
+  function updateTable(rows, append=false){
+    if(!append){ feedBody.innerHTML = ""; feedCount = 0; }
+    if(!feedCount && (!rows || !rows.length)){ feedEmpty.style.display = "block"; return; }
     feedEmpty.style.display = "none";
-    rows.forEach((r,i)=>{
+    (rows||[]).forEach((r)=>{
       const tr = document.createElement("tr");
       tr.innerHTML = `
-        <td>${i+1}</td>
+        <td>${++feedCount}</td>
         <td>${r.category||""}</td>
         <td>${r.title||""}</td>
         <td>${r.status||""}</td>
@@ -115,7 +131,18 @@ document.addEventListener("DOMContentLoaded", () => {
     addBtn.textContent = "+ " + (document.documentElement.lang==="ar" ? "إضافة" : "Ny");
     const [s, rec] = await Promise.all([API.stats(cat), API.records(cat)]);
     updateTable(rec.records||[]); updateKpis(s||{});
+    setNext(rec.next);
+  }
+  function setNext(next){
+    feedNext = next || null;
+    moreBtn.style.display = feedNext ? "inline-flex" : "none";
   }
+  moreBtn.addEventListener("click", async ()=>{
+    if(!feedNext) return;
+    const rec = await API.records(currentCategory, feedNext);
+    updateTable(rec.records||[], true);
+    setNext(rec.next);
+  });
 
   // side menu
   menu.addEventListener("click", (e)=>{